@@ -1,14 +1,27 @@
+import time
+
+# Taken before the other imports, which are the first phase timed by the startup report
+STARTED_AT = time.perf_counter()
+
 import os
+import threading
 
 import dotenv
-from slack_bolt import App, Ack, Respond, Say
+from slack_bolt import App, Ack, BoltRequest, BoltResponse, Respond, Say
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk import WebClient
-from slack_sdk.web import SlackResponse
 
 import blockgen
 import db
+import dedup
+import dm
+import export
+import jobs
+import live
+import metrics
 import models
+import scheduler
+import usergroups
 import util
 
 dotenv.load_dotenv()
@@ -16,26 +29,106 @@ dotenv.load_dotenv()
 CHANNEL_NAME = os.environ['CHANNEL_NAME']
 CHANNEL_ID = os.environ['CHANNEL_ID']
 
-ERR_VOTE_RENDER = '[voting buttons cannot be rendered - please reload]'
-ERR_DM_RENDER = '[this DM was not sent correctly - please try again]'
-ERR_NON_ALLOWED_VOTER = 'ERROR: Vote not submitted. You are not an allowed voted.'
-ERR_USER_ALREADY_VOTED = 'ERROR: Vote not submitted. You have already voted.'
-ERR_ELECTION_FINISHED = 'ERROR: Vote not submitted. This election has finished.'
-
-app = App(token=os.environ['SLACK_BOT_TOKEN'])
+JOB_VOTE_CONFIRMATION = 'vote_confirmation'
+JOB_ELECTION_RESULT = 'election_result'
+
+# Connect to Slack before loading db, buffering the requests received until it is loaded
+LAZY_START = bool(os.environ.get('LAZY_START'))
+
+startup = metrics.StartupTimer(STARTED_AT)
+startup.mark('imports')
+
+# SLACK_API_URL points at another Slack Web API than Slack's own, i.e. the fake one used by bench.py. A lazy start
+# defers the auth.test call verifying the token to the first request.
+app = App(client=metrics.InstrumentedWebClient(token=os.environ['SLACK_BOT_TOKEN'],
+                                               base_url=os.environ.get('SLACK_API_URL') or WebClient.BASE_URL),
+          token_verification_enabled=not LAZY_START)
+startup.mark('app')
+fan_out_dispatcher = dm.FanOutDispatcher(app.client)
+job_queue = jobs.JobQueue()
+tally_updater = live.TallyUpdater(app.client, float(os.environ.get('TALLY_UPDATE_INTERVAL') or live.DEFAULT_INTERVAL))
+deadline_scheduler = scheduler.DeadlineScheduler(lambda eid: finish_election(eid))
+dedup_cache = dedup.DedupCache(float(os.environ.get('DEDUP_TTL') or dedup.DEFAULT_TTL),
+                               int(os.environ.get('DEDUP_MAX_SIZE') or dedup.DEFAULT_MAX_SIZE),
+                               persist=bool(os.environ.get('DEDUP_PERSIST')))
 
 commands = []
+# Vote button handlers of open elections, keyed by action ID and dispatched to by vote_action_
+vote_handlers = {}
+
+# Set once db is loaded, before which requests are buffered by buffer_ to be dispatched again by hydrate()
+loaded = threading.Event()
+_buffered = []
+_buffered_lock = threading.Lock()
 
 
 def register_command(name, description):
     commands.append((name, description))
-    return app.command(name)
+    return lambda func: app.command(name)(metrics.instrument_listener(func))
+
+
+@app.middleware
+def buffer_(body, next):
+    # Registered first, so that buffered requests only go through dedup_ once they are dispatched again
+    if not loaded.is_set():
+        with _buffered_lock:
+            if not loaded.is_set():
+                _buffered.append(body)
+                return BoltResponse(status=200, body='')
+    next()
+
+
+@app.middleware
+def dedup_(body, next):
+    # Registered before the rest, so that a redelivered request is acked and dropped before anything else runs
+    key = dedup.event_key(body)
+    if key is not None and dedup_cache.seen(key):
+        return BoltResponse(status=200, body='')
+    next()
+
 
+@app.middleware
+def instrument_client_(context, next):
+    # Bolt hands listeners a new WebClient per request, copied from app.client but not of its class
+    context['client'] = metrics.InstrumentedWebClient.from_client(context.client)
+    next()
 
-def init_election_actions():
-    for election in db.list_open_elections():
-        app.action(util.button_action_id(election.eid, True))(gen_add_vote_handler(election.eid, True))
-        app.action(util.button_action_id(election.eid, False))(gen_add_vote_handler(election.eid, False))
+
+def register_vote_handlers(eid: str):
+    vote_handlers[util.button_action_id(eid, True)] = gen_add_vote_handler(eid, True)
+    vote_handlers[util.button_action_id(eid, False)] = gen_add_vote_handler(eid, False)
+
+
+def unregister_vote_handlers(eid: str):
+    vote_handlers.pop(util.button_action_id(eid, True), None)
+    vote_handlers.pop(util.button_action_id(eid, False), None)
+
+
+@app.action(util.BUTTON_ACTION_ID_PATTERN)
+@metrics.instrument_listener
+def vote_action_(ack: Ack, client: WebClient, body, action: dict):
+    action_id = action['action_id']
+    eid, is_yes = util.parse_button_action_id(action_id)
+    # Only the first click of a voter in an election is answered, any other one would only be told they voted
+    key = dedup.vote_key(eid, util.uid_from_body(body))
+    if dedup_cache.seen(key):
+        ack()
+        return
+    handler = vote_handlers.get(action_id)
+    if handler is None:
+        # Open elections are registered on their first click after a restart. Finished elections are not
+        # registered at all, but still get a handler so that the voter is told the election has finished.
+        if db.is_election_open(eid):
+            register_vote_handlers(eid)
+            handler = vote_handlers[action_id]
+        else:
+            handler = gen_add_vote_handler(eid, is_yes)
+    try:
+        handler(ack=ack, client=client, body=body)
+    except Exception:
+        # Let the voter click again, as their vote may not have been cast
+        dedup_cache.forget(key)
+        raise
 
 
 @register_command('/vote-create', 'Create an election')
@@ -45,20 +138,22 @@ def create_(ack: Ack, respond: Respond, say: Say, client: WebClient, command: di
 
     if _incorrect_channel(command, respond):
         return
-    args = _parse_args(command)
+    args = util.parse_args(command)
     if _incorrect_num_args(respond, 4, len(args), lambda e, a: a < e):
         return
 
     electee = models.User.from_str(args[0])
+    voter_escstrs = args[3:]
+    deadline = None
+    if not voter_escstrs[0].startswith('<'):
+        # An optional deadline precedes the allowed voters
+        duration = util.parse_duration(voter_escstrs.pop(0))
+        if duration is None or not voter_escstrs:
+            respond(text=blockgen.ERR_INVALID_DEADLINE)
+            return
+        deadline = time.time() + duration
 
-    allowed_voters = []
-    for voter_escstr in args[3:]:
-        if voter_escstr.startswith('<!subteam^'):
-            ug = models.UserGroup.from_str(voter_escstr)
-            ug_users = client.usergroups_users_list(usergroup=ug.ugid)
-            allowed_voters.extend(ug_users['users'])
-        else:
-            allowed_voters.append(models.User.from_str(voter_escstr).uid)
+    allowed_voters = _expand_voters(client, voter_escstrs)
 
     election = models.Election(
         util.random_id(),
@@ -66,55 +161,146 @@ def create_(ack: Ack, respond: Respond, say: Say, client: WebClient, command: di
         args[1],
         args[2],
         allowed_voters,
-        _uid_from_body(body),
-        False
+        util.uid_from_body(body),
+        False,
+        deadline
     )
     if int(election.threshold_pct) > 100:
-        post_ephemeral(client, body, 'Threshold percentage greater than 100')
+        post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_HIGH)
         return
     elif int(election.threshold_pct) < 1:
-        post_ephemeral(client, body, 'Threshold percentage should be 0-100')
+        post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_LOW)
         return
     db.create_election(election)
+    register_vote_handlers(election.eid)
+    if deadline is not None:
+        deadline_scheduler.schedule(election.eid, deadline)
+
+    message = say(channel=CHANNEL_NAME, blocks=blockgen.election(election), text=blockgen.ERR_VOTE_RENDER)
+    db.set_election_message(election.eid, message['channel'], message['ts'])
+
 
-    app.action(util.button_action_id(election.eid, True))(gen_add_vote_handler(election.eid, True))
-    app.action(util.button_action_id(election.eid, False))(gen_add_vote_handler(election.eid, False))
+@register_command('/vote-create-batch', 'Create several elections sharing a threshold and allowed voters')
+def create_batch_(ack: Ack, respond: Respond, say: Say, client: WebClient, command: dict, body):
+    print(command)
+    ack()
+
+    if _incorrect_channel(command, respond):
+        return
+    args = util.parse_args(command)
+    if _incorrect_num_args(respond, 4, len(args), lambda e, a: a < e):
+        return
+    threshold_pct = args[0]
+    slate_args = args[1:]
+    deadline = None
+    if not slate_args[0].startswith('<'):
+        # An optional deadline, shared by the whole slate, precedes the electees
+        duration = util.parse_duration(slate_args.pop(0))
+        if duration is None:
+            respond(text=blockgen.ERR_INVALID_DEADLINE)
+            return
+        deadline = time.time() + duration
+    pairs, voter_escstrs = util.parse_slate_args(slate_args)
+    if not pairs or not voter_escstrs or len(pairs) > blockgen.MAX_SLATE_SIZE:
+        respond(text=blockgen.ERR_INVALID_SLATE)
+        return
+    if int(threshold_pct) > 100:
+        post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_HIGH)
+        return
+    elif int(threshold_pct) < 1:
+        post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_LOW)
+        return
 
-    say(channel=CHANNEL_NAME, blocks=blockgen.election(election), text=ERR_VOTE_RENDER)
+    # Voters are expanded once for the whole slate
+    allowed_voters = _expand_voters(client, voter_escstrs)
+    if len(pairs) > blockgen.max_slate_size(len(allowed_voters)):
+        respond(text=blockgen.ERR_SLATE_TOO_LARGE)
+        return
+    creator_uid = util.uid_from_body(body)
+    elections = [
+        models.Election(util.random_id(), models.User.from_str(electee).uid, position, threshold_pct,
+                        allowed_voters, creator_uid, False, deadline)
+        for electee, position in pairs
+    ]
+    db.create_elections(elections)
+    for election in elections:
+        register_vote_handlers(election.eid)
+        if deadline is not None:
+            deadline_scheduler.schedule(election.eid, deadline)
+
+    message = say(channel=CHANNEL_NAME, blocks=blockgen.slate(elections), text=blockgen.ERR_VOTE_RENDER)
+    db.set_slate_message([e.eid for e in elections], message['channel'], message['ts'])
 
 
 def gen_add_vote_handler(eid: str, is_yes: bool):
-    def add_vote_handler(ack: Ack, say: Say, client: WebClient, body):
+    def add_vote_handler(ack: Ack, client: WebClient, body):
         ack()
 
-        uid = _uid_from_body(body)
-        if db.get_election_result(eid).is_finished:
-            post_ephemeral(client, body, ERR_ELECTION_FINISHED)
+        uid = util.uid_from_body(body)
+        # Committed along with the vote, so that a crash cannot leave a vote without its confirmation
+        confirmation = jobs.new_job(JOB_VOTE_CONFIRMATION, eid, {'eid': eid, 'uid': uid})
+        cast = db.cast_vote(eid, uid, is_yes, [confirmation])
+        if isinstance(cast, models.ElectionFinishedCastVoteResult):
+            post_ephemeral(client, body, blockgen.ERR_ELECTION_FINISHED)
             return
-        elif not db.is_user_allowed_voter(eid, uid):
-            post_ephemeral(client, body, ERR_NON_ALLOWED_VOTER)
+        elif isinstance(cast, models.NonAllowedVoterCastVoteResult):
+            post_ephemeral(client, body, blockgen.ERR_NON_ALLOWED_VOTER)
             return
-        elif db.has_user_voted(eid, uid):
-            post_ephemeral(client, body, ERR_USER_ALREADY_VOTED)
+        elif isinstance(cast, models.AlreadyVotedCastVoteResult):
+            post_ephemeral(client, body, blockgen.ERR_USER_ALREADY_VOTED)
             return
 
-        vote = db.add_vote(eid, uid, is_yes)
-        result = db.get_election_result(eid)
-        send_dm(client, [uid], blocks=blockgen.vote_confirmation(result.election, vote))
-
-        if result.is_finished:
-            db.mark_election_finished(result.election)
-            # TODO allowed voters should either be forwarded this or replied in thread
-            announcement = say(channel=CHANNEL_NAME, blocks=blockgen.election_result(result))
-            announcement_url = client.chat_getPermalink(channel=CHANNEL_ID, message_ts=announcement['ts'])
-            announcement_text = f'An election you are allowed to vote in has concluded: {announcement_url["permalink"]}'
-            for voter_uid in result.election.allowed_voter_uids:
-                # Send SEPARATE DMs to each allowed voter instead of one group DM
-                send_dm(client, [voter_uid], text=announcement_text)
+        # Everything else is a side effect of the committed vote, run in order per election by the job queue
+        job_queue.schedule([confirmation])
+        tally_updater.notify(eid)
+        if cast.result.is_finished:
+            finish_election(eid)
 
     return add_vote_handler
 
 
+def finish_election(eid: str):
+    # Called both by the deciding vote and at the deadline, of which only the first one finishes the election
+    # The announcement is committed along with finishing the election, so that a crash cannot lose it
+    announcement = []
+
+    def announce(result: models.ElectionResult) -> list[models.Job]:
+        announcement.append(jobs.new_job(JOB_ELECTION_RESULT, eid,
+                                         {'eid': eid, 'num_yes': result.num_yes, 'num_no': result.num_no}))
+        return announcement
+
+    if db.close_election(eid, announce) is None:
+        return
+    unregister_vote_handlers(eid)
+    tally_updater.forget(eid)
+    job_queue.schedule(announcement)
+
+
+def send_vote_confirmation(job: models.Job):
+    election = db.get_election(job.payload['eid'])
+    vote = db.get_vote(job.payload['eid'], job.payload['uid'])
+    dm.send_dm(app.client, [vote.uid], blocks=blockgen.vote_confirmation(election, vote))
+
+
+def announce_election_result(job: models.Job):
+    eid = job.payload['eid']
+    if 'ts' not in job.payload:
+        result = models.ElectionResult(db.get_election(eid), job.payload['num_yes'], job.payload['num_no'])
+        # TODO allowed voters should either be forwarded this or replied in thread
+        announcement = app.client.chat_postMessage(channel=CHANNEL_NAME, blocks=blockgen.election_result(result))
+        # Remember the announcement, so that it is not posted again if the rest of this job is retried
+        job.payload['ts'] = announcement['ts']
+        db.put_job(job)
+    announcement_url = app.client.chat_getPermalink(channel=CHANNEL_ID, message_ts=job.payload['ts'])
+    announcement_text = f'An election you are allowed to vote in has concluded: {announcement_url["permalink"]}'
+    # Send SEPARATE DMs to each allowed voter instead of one group DM
+    fan_out_dispatcher.fan_out(util.fan_out_id(eid), db.get_election(eid).allowed_voter_uids, announcement_text)
+
+
+job_queue.register(JOB_VOTE_CONFIRMATION, send_vote_confirmation)
+job_queue.register(JOB_ELECTION_RESULT, announce_election_result)
+
+
 @register_command('/vote-confirm', 'Confirm a vote was counted')
 def confirm_(ack: Ack, respond: Respond, command: dict):
     print(command)
@@ -122,18 +308,22 @@ def confirm_(ack: Ack, respond: Respond, command: dict):
 
     if _incorrect_channel(command, respond):
         return
-    args = _parse_args(command)
-    if _incorrect_num_args(respond, 2, len(args)):
+    args = util.parse_args(command)
+    if _incorrect_num_args(respond, '1 or 2', len(args), op=lambda e, a: a not in (1, 2)):
         return
-    eid, confirmation = args
-    # Remove rich text formatting from eid (i.e. copying from vote-create)
-    eid = util.clean_alphanumeric(eid)
+    if len(args) == 1:
+        # Confirmation codes are unique across elections, so the election ID may be left out
+        is_valid = db.is_vote_valid(None, args[0])
+    else:
+        eid, confirmation = args
+        # Remove rich text formatting from eid (i.e. copying from vote-create)
+        eid = util.clean_alphanumeric(eid)
+        is_valid = db.is_vote_valid(eid, confirmation)
 
-    if db.is_vote_valid(eid, confirmation):
-        respond(text='This vote is valid!')
+    if is_valid:
+        respond(text=blockgen.VOTE_VALID)
     else:
-        respond(text='This vote is invalid. If you believe this to be in error, '
-                     'confirm your confirmation and election ID, or try voting again.')
+        respond(text=blockgen.VOTE_INVALID)
 
 
 @register_command('/vote-check', 'Check the current results of an election')
@@ -143,60 +333,96 @@ def check_(ack: Ack, respond: Respond, command: dict, body):
 
     if _incorrect_channel(command, respond):
         return
-    args = _parse_args(command)
+    args = util.parse_args(command)
     if _incorrect_num_args(respond, 1, len(args)):
         return
     eid = args[0]
     # Remove rich text formatting from eid (i.e. copying from vote-create)
     eid = util.clean_alphanumeric(eid)
 
-    sender_uid = _uid_from_body(body)
+    sender_uid = util.uid_from_body(body)
     result = db.get_election_result(eid, requestor_uid=sender_uid)
     if isinstance(result, models.InvalidPermissionsElectionResult):
-        respond(text='You do not have permissions to check this election\'s results!')
+        respond(text=blockgen.ERR_NO_CHECK_PERMISSIONS)
     elif isinstance(result, models.ShortCircuitElectionResult):
-        respond(text='This election is invalid. If you believe this to be in error, '
-                     'confirm the election ID and try again.')
+        respond(text=blockgen.ERR_INVALID_ELECTION)
     else:
-        status_msg = f'The current status of the election with election ID {eid} is ' \
-                     f'{result.num_yes} yes to {result.num_no} no ({result.vote_pct}%).' \
-                     f'\r\nReporting percentage was {result.reporting_pct}% ' \
-                     f'({result.reporting_voters}/{result.num_voters}).'
-        respond(text=status_msg)
+        respond(text=blockgen.election_status(result))
 
 
-@register_command('/vote-help', 'Help with using votebot')
-def help_(ack: Ack, respond: Respond, command: dict):
+@register_command('/vote-export', 'Export every election, or stats per voter or position, as CSV or NDJSON')
+def export_(ack: Ack, respond: Respond, client: WebClient, command: dict):
     print(command)
     ack()
 
-    cmds_str = '\n'.join([f'{n}: {d}' for n, d in commands])
-    text = '*votebot*\n\n' \
-           'A slack bot that manages elections.\n\n' \
-           '*All commands:*\n' \
-           f'{cmds_str}\n\n' \
-           '*Quickstart:*\n' \
-           '1. Create an election (/vote-create).\n' \
-           '2. Allowed voters click one of the voting buttons in the created message.\n' \
-           '3. Voters will get a DM confirming their vote, and can re-confirm at any time (/vote-confirm). \n' \
-           '4. Once the election has finished, a message will be send by votebot with the final vote.\n' \
-           'The creator of the election may check the vote count at any time (/vote-check). \n'
-    respond(text=text)
+    if _incorrect_channel(command, respond):
+        return
+    args = [a for a in util.parse_args(command) if a]
+    report = args[0] if args else export.REPORT_ELECTIONS
+    file_format = args[1] if len(args) > 1 else export.FORMAT_CSV
+    if len(args) > 2 or report not in export.REPORTS or file_format not in export.FORMATS:
+        respond(text=blockgen.ERR_INVALID_EXPORT)
+        return
 
+    # Streamed out of db and uploaded a chunk at a time, so that only one chunk of the export is ever in memory
+    part = 0
+    for part, content in enumerate(export.export(report, file_format), 1):
+        client.files_upload_v2(channel=CHANNEL_ID, content=content, filename=export.filename(report, file_format, part),
+                               title=f'votebot {report} export, part {part}')
+    respond(text=f'Exported {report} in {part} file(s).')
 
-def post_ephemeral(client, body, text):
-    client.chat_postEphemeral(channel=CHANNEL_ID, user=_uid_from_body(body), text=text)
 
+@register_command('/vote-refresh', 'Refresh the cached members of usergroups')
+def refresh_(ack: Ack, respond: Respond, command: dict):
+    print(command)
+    ack()
 
-def send_dm(client: WebClient, uids: list[str], text=None, blocks=None) -> SlackResponse:
-    dm_channel_resp = client.conversations_open(users=uids)
-    dm_channel_id = dm_channel_resp['channel']['id']
-    if text is not None:
-        return client.chat_postMessage(channel=dm_channel_id, text=text, unfurl_links=True)
-    elif blocks is not None:
-        return client.chat_postMessage(channel=dm_channel_id, blocks=blocks, text=ERR_DM_RENDER, unfurl_links=True)
+    if _incorrect_channel(command, respond):
+        return
+    args = [a for a in util.parse_args(command) if a]
+    if len(args) == 0:
+        usergroups.usergroup_members.refresh()
+        respond(text='The members of all usergroups will be looked up again.')
     else:
-        raise ValueError('Neither text nor blocks provided for DM')
+        for ug_escstr in args:
+            usergroups.usergroup_members.refresh(models.UserGroup.from_str(ug_escstr).ugid)
+        respond(text=f'The members of {", ".join(args)} will be looked up again.')
+
+
+@register_command('/vote-help', 'Help with using votebot')
+def help_(ack: Ack, respond: Respond, command: dict):
+    print(command)
+    ack()
+
+    respond(text=blockgen.help_text(commands))
+
+
+def post_ephemeral(client, body, text):
+    client.chat_postEphemeral(channel=CHANNEL_ID, user=util.uid_from_body(body), text=text)
+
+
+def hydrate() -> int:
+    """
+    Load db and the dedup cache, start the background workers, then dispatch the requests buffered until then.
+
+    :return: the number of requests that were buffered
+    """
+    with startup.phase('db_load'):
+        db.load()
+        dedup_cache.load()
+    # Run any jobs interrupted by the last shutdown (including conclusion DMs)
+    job_queue.start()
+    deadline_scheduler.start()
+    with _buffered_lock:
+        loaded.set()
+        buffered = _buffered[:]
+        _buffered.clear()
+    with startup.phase('replay'):
+        for body in buffered:
+            app.dispatch(BoltRequest(mode='socket_mode', body=body))
+    if buffered:
+        print(f'Dispatched {len(buffered)} requests received while loading')
+    return len(buffered)
 
 
 def _incorrect_channel(command, respond) -> bool:
@@ -214,27 +440,29 @@ def _incorrect_num_args(respond, expected, actual, op=lambda e, a: e != a):
     return is_incorrect
 
 
-def _uid_from_body(body) -> str:
-    return body.get('user_id') if 'user_id' in body else body.get('user').get('id')
-
-
-def _parse_args(command):
-    text = command['text']
-    args = []
-    last_split_idx = 0
-    in_quotes = False
-    for i in range(len(text)):
-        if text[i] == '\"':
-            in_quotes = not in_quotes
-        if text[i] == ' ' and not in_quotes:
-            args.append(text[last_split_idx:i])
-            i += 1
-            last_split_idx = i
-    if last_split_idx != len(text) - 1:
-        args.append(text[last_split_idx:])
-    return [v.replace('\"', '') for v in args]
+def _expand_voters(client: WebClient, voter_escstrs: list[str]) -> list[str]:
+    members = usergroups.usergroup_members.expand(client, usergroups.usergroup_ids(voter_escstrs))
+    return usergroups.merge_voters(voter_escstrs, members)
 
 
 if __name__ == '__main__':
-    init_election_actions()
-    SocketModeHandler(app, os.environ['SLACK_APP_TOKEN']).start()
+    startup.mark('listeners')
+    metrics.registry.register_collector('votebot_dm_channel_cache', dm.dm_channels.stats)
+    metrics.registry.register_collector('votebot_dedup_cache', dedup_cache.stats)
+    metrics.registry.register_collector('votebot_result_cache', db.result_cache_stats)
+    metrics.registry.register_collector('votebot_startup_seconds', startup.stats)
+    if os.environ.get('METRICS_PORT'):
+        metrics.serve(int(os.environ['METRICS_PORT']))
+    if float(os.environ.get('METRICS_LOG_INTERVAL') or 0) > 0:
+        metrics.log_periodically(float(os.environ['METRICS_LOG_INTERVAL']))
+    handler = SocketModeHandler(app, os.environ['SLACK_APP_TOKEN'])
+    if LAZY_START:
+        with startup.phase('connect'):
+            handler.connect()
+        hydrate()
+    else:
+        hydrate()
+        with startup.phase('connect'):
+            handler.connect()
+    print(startup.ready())
+    threading.Event().wait()
@@ -0,0 +1,89 @@
+import collections
+import fcntl
+import gzip
+import json
+import os
+import threading
+import time
+
+DEFAULT_PATH = 'archive'
+
+
+class Archive:
+    """
+    Cold storage of finished elections, with their votes and final tallies, outside of the storage backend.
+
+    Elections are archived into one gzip file per month they finished in. Each append adds a gzip member holding
+    one JSON line per election, so archiving costs the size of those elections rather than of the month.
+    A month is only read when one of its elections is looked up, and the last few months read are cached.
+    Several instances may append to the same archive, each append being serialized by a lock on the file.
+    """
+
+    def __init__(self, path: str, cache_size: int = 4):
+        self.path = path
+        self._cache_size = cache_size
+        # The entries of each month cached, along with the size of its file they were read from
+        self._cache: collections.OrderedDict[str, tuple[int, dict[str, dict]]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_name() -> str:
+        return time.strftime('%Y-%m')
+
+    def append(self, name: str, *entries: dict) -> None:
+        """
+        Durably append elections to an archive.
+
+        :param name: the name of the archive, i.e. the month the elections finished in
+        :param entries: each election, its votes and its tally, keyed by 'election', 'votes' and 'tally'
+        """
+        lines = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(name), 'ab') as raw:
+                fcntl.flock(raw.fileno(), fcntl.LOCK_EX)
+                with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                    f.write(lines.encode())
+                raw.flush()
+                os.fsync(raw.fileno())
+            self._cache.pop(name, None)
+
+    def load(self, name: str) -> dict[str, dict]:
+        """
+        :param name: the name of the archive
+        :return: the entries of every election in the archive, keyed by eid
+        """
+        with self._lock:
+            size = os.path.getsize(self._file(name)) if os.path.exists(self._file(name)) else 0
+            cached = self._cache.get(name)
+            # Another instance may have appended to the archive since it was cached
+            if cached is not None and cached[0] == size:
+                self._cache.move_to_end(name)
+                return cached[1]
+            entries = {}
+            if size > 0:
+                with open(self._file(name), 'rb') as raw:
+                    # Not while another instance is halfway through appending
+                    fcntl.flock(raw.fileno(), fcntl.LOCK_SH)
+                    size = os.fstat(raw.fileno()).st_size
+                    with gzip.GzipFile(fileobj=raw, mode='rb') as f:
+                        for line in f:
+                            # An election archived twice (after a crash mid-archiving) has the same entry both times
+                            entry = json.loads(line)
+                            entries[entry['election']['eid']] = entry
+            self._cache[name] = (size, entries)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+            return entries
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.jsonl.gz')
+
+
+def open_archive(path: str = None) -> Archive:
+    """Open the archive in path, by default the one configured by the ARCHIVE_PATH env var."""
+    return Archive(path or os.environ.get('ARCHIVE_PATH') or DEFAULT_PATH)
+
+
+if __name__ == '__main__':
+    raise NotImplementedError('Not an entrypoint')
@@ -0,0 +1,474 @@
+import time
+
+# Taken before the other imports, which are the first phase timed by the startup report
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import os
+
+import dotenv
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt import BoltResponse
+from slack_bolt.async_app import AsyncApp, AsyncAck, AsyncBoltRequest, AsyncRespond, AsyncSay
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncWebClient
+
+import async_db
+import blockgen
+import dedup
+import dm
+import export
+import jobs
+import live
+import metrics
+import models
+import scheduler
+import usergroups
+import util
+
+dotenv.load_dotenv()
+
+CHANNEL_NAME = os.environ['CHANNEL_NAME']
+CHANNEL_ID = os.environ['CHANNEL_ID']
+
+# The same kinds as in app.py, so that jobs left over by either entry point are run by the other
+JOB_VOTE_CONFIRMATION = 'vote_confirmation'
+JOB_ELECTION_RESULT = 'election_result'
+
+# Connect to Slack before loading db, buffering the requests received until it is loaded. AsyncApp always defers
+# the auth.test call verifying the token to the first request.
+LAZY_START = bool(os.environ.get('LAZY_START'))
+
+startup = metrics.StartupTimer(STARTED_AT)
+startup.mark('imports')
+
+
+class InstrumentedAsyncWebClient(AsyncWebClient):
+    """AsyncWebClient recording its Slack API calls like metrics.InstrumentedWebClient."""
+
+    @classmethod
+    def from_client(cls, client: AsyncWebClient) -> 'InstrumentedAsyncWebClient':
+        return cls(token=client.token, base_url=client.base_url, timeout=client.timeout, ssl=client.ssl,
+                   proxy=client.proxy, session=client.session, trust_env_in_session=client.trust_env_in_session,
+                   headers=client.headers, team_id=client.default_params.get('team_id'),
+                   retry_handlers=client.retry_handlers)
+
+    async def api_call(self, api_method: str, **kwargs):
+        start = time.perf_counter()
+        error = None
+        try:
+            return await super().api_call(api_method, **kwargs)
+        except SlackApiError as e:
+            error = e
+            raise
+        finally:
+            metrics.record_api_call(api_method, time.perf_counter() - start, error)
+
+
+app = AsyncApp(client=InstrumentedAsyncWebClient(token=os.environ['SLACK_BOT_TOKEN'],
+                                                 base_url=os.environ.get('SLACK_API_URL') or AsyncWebClient.BASE_URL))
+startup.mark('app')
+fan_out_dispatcher = dm.AsyncFanOutDispatcher(app.client)
+job_queue = jobs.AsyncJobQueue()
+tally_updater = live.AsyncTallyUpdater(app.client,
+                                       float(os.environ.get('TALLY_UPDATE_INTERVAL') or live.DEFAULT_INTERVAL))
+deadline_scheduler = scheduler.AsyncDeadlineScheduler(lambda eid: finish_election(eid))
+dedup_cache = dedup.DedupCache(float(os.environ.get('DEDUP_TTL') or dedup.DEFAULT_TTL),
+                               int(os.environ.get('DEDUP_MAX_SIZE') or dedup.DEFAULT_MAX_SIZE),
+                               persist=bool(os.environ.get('DEDUP_PERSIST')))
+
+commands = []
+# Vote button handlers of open elections, keyed by action ID and dispatched to by vote_action_
+vote_handlers = {}
+
+# Set once db is loaded, before which requests are buffered by buffer_ to be dispatched again by hydrate()
+loaded = False
+_buffered = []
+
+
+def register_command(name, description):
+    commands.append((name, description))
+    return lambda func: app.command(name)(metrics.instrument_listener(func))
+
+
+@app.middleware
+async def buffer_(body, next):
+    # Registered first, so that buffered requests only go through dedup_ once they are dispatched again
+    if not loaded:
+        _buffered.append(body)
+        return BoltResponse(status=200, body='')
+    await next()
+
+
+@app.middleware
+async def dedup_(body, next):
+    key = dedup.event_key(body)
+    if key is not None and await dedup_cache.seen_async(key):
+        return BoltResponse(status=200, body='')
+    await next()
+
+
+@app.middleware
+async def instrument_client_(context, next):
+    context['client'] = InstrumentedAsyncWebClient.from_client(context.client)
+    await next()
+
+
+def register_vote_handlers(eid: str):
+    vote_handlers[util.button_action_id(eid, True)] = gen_add_vote_handler(eid, True)
+    vote_handlers[util.button_action_id(eid, False)] = gen_add_vote_handler(eid, False)
+
+
+def unregister_vote_handlers(eid: str):
+    vote_handlers.pop(util.button_action_id(eid, True), None)
+    vote_handlers.pop(util.button_action_id(eid, False), None)
+
+
+@app.action(util.BUTTON_ACTION_ID_PATTERN)
+@metrics.instrument_listener
+async def vote_action_(ack: AsyncAck, client: AsyncWebClient, body, action: dict):
+    action_id = action['action_id']
+    eid, is_yes = util.parse_button_action_id(action_id)
+    key = dedup.vote_key(eid, util.uid_from_body(body))
+    if await dedup_cache.seen_async(key):
+        await ack()
+        return
+    handler = vote_handlers.get(action_id)
+    if handler is None:
+        if await async_db.is_election_open(eid):
+            register_vote_handlers(eid)
+            handler = vote_handlers[action_id]
+        else:
+            handler = gen_add_vote_handler(eid, is_yes)
+    try:
+        await handler(ack=ack, client=client, body=body)
+    except Exception:
+        await dedup_cache.forget_async(key)
+        raise
+
+
+@register_command('/vote-create', 'Create an election')
+async def create_(ack: AsyncAck, respond: AsyncRespond, say: AsyncSay, client: AsyncWebClient, command: dict, body):
+    print(command)
+    await ack()
+
+    if await _incorrect_channel(command, respond):
+        return
+    args = util.parse_args(command)
+    if await _incorrect_num_args(respond, 4, len(args), lambda e, a: a < e):
+        return
+
+    electee = models.User.from_str(args[0])
+    voter_escstrs = args[3:]
+    deadline = None
+    if not voter_escstrs[0].startswith('<'):
+        duration = util.parse_duration(voter_escstrs.pop(0))
+        if duration is None or not voter_escstrs:
+            await respond(text=blockgen.ERR_INVALID_DEADLINE)
+            return
+        deadline = time.time() + duration
+
+    allowed_voters = await _expand_voters(client, voter_escstrs)
+
+    election = models.Election(
+        util.random_id(),
+        electee.uid,
+        args[1],
+        args[2],
+        allowed_voters,
+        util.uid_from_body(body),
+        False,
+        deadline
+    )
+    if int(election.threshold_pct) > 100:
+        await post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_HIGH)
+        return
+    elif int(election.threshold_pct) < 1:
+        await post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_LOW)
+        return
+    await async_db.create_election(election)
+    register_vote_handlers(election.eid)
+    if deadline is not None:
+        deadline_scheduler.schedule(election.eid, deadline)
+
+    message = await say(channel=CHANNEL_NAME, blocks=blockgen.election(election), text=blockgen.ERR_VOTE_RENDER)
+    await async_db.set_election_message(election.eid, message['channel'], message['ts'])
+
+
+@register_command('/vote-create-batch', 'Create several elections sharing a threshold and allowed voters')
+async def create_batch_(ack: AsyncAck, respond: AsyncRespond, say: AsyncSay, client: AsyncWebClient, command: dict,
+                        body):
+    print(command)
+    await ack()
+
+    if await _incorrect_channel(command, respond):
+        return
+    args = util.parse_args(command)
+    if await _incorrect_num_args(respond, 4, len(args), lambda e, a: a < e):
+        return
+    threshold_pct = args[0]
+    slate_args = args[1:]
+    deadline = None
+    if not slate_args[0].startswith('<'):
+        duration = util.parse_duration(slate_args.pop(0))
+        if duration is None:
+            await respond(text=blockgen.ERR_INVALID_DEADLINE)
+            return
+        deadline = time.time() + duration
+    pairs, voter_escstrs = util.parse_slate_args(slate_args)
+    if not pairs or not voter_escstrs or len(pairs) > blockgen.MAX_SLATE_SIZE:
+        await respond(text=blockgen.ERR_INVALID_SLATE)
+        return
+    if int(threshold_pct) > 100:
+        await post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_HIGH)
+        return
+    elif int(threshold_pct) < 1:
+        await post_ephemeral(client, body, blockgen.ERR_THRESHOLD_TOO_LOW)
+        return
+
+    allowed_voters = await _expand_voters(client, voter_escstrs)
+    if len(pairs) > blockgen.max_slate_size(len(allowed_voters)):
+        await respond(text=blockgen.ERR_SLATE_TOO_LARGE)
+        return
+    creator_uid = util.uid_from_body(body)
+    elections = [
+        models.Election(util.random_id(), models.User.from_str(electee).uid, position, threshold_pct,
+                        allowed_voters, creator_uid, False, deadline)
+        for electee, position in pairs
+    ]
+    await async_db.create_elections(elections)
+    for election in elections:
+        register_vote_handlers(election.eid)
+        if deadline is not None:
+            deadline_scheduler.schedule(election.eid, deadline)
+
+    message = await say(channel=CHANNEL_NAME, blocks=blockgen.slate(elections), text=blockgen.ERR_VOTE_RENDER)
+    await async_db.set_slate_message([e.eid for e in elections], message['channel'], message['ts'])
+
+
+def gen_add_vote_handler(eid: str, is_yes: bool):
+    async def add_vote_handler(ack: AsyncAck, client: AsyncWebClient, body):
+        await ack()
+
+        uid = util.uid_from_body(body)
+        confirmation = jobs.new_job(JOB_VOTE_CONFIRMATION, eid, {'eid': eid, 'uid': uid})
+        cast = await async_db.cast_vote(eid, uid, is_yes, [confirmation])
+        if isinstance(cast, models.ElectionFinishedCastVoteResult):
+            await post_ephemeral(client, body, blockgen.ERR_ELECTION_FINISHED)
+            return
+        elif isinstance(cast, models.NonAllowedVoterCastVoteResult):
+            await post_ephemeral(client, body, blockgen.ERR_NON_ALLOWED_VOTER)
+            return
+        elif isinstance(cast, models.AlreadyVotedCastVoteResult):
+            await post_ephemeral(client, body, blockgen.ERR_USER_ALREADY_VOTED)
+            return
+
+        job_queue.schedule([confirmation])
+        tally_updater.notify(eid)
+        if cast.result.is_finished:
+            await finish_election(eid)
+
+    return add_vote_handler
+
+
+async def finish_election(eid: str):
+    announcement = []
+
+    def announce(result: models.ElectionResult) -> list[models.Job]:
+        announcement.append(jobs.new_job(JOB_ELECTION_RESULT, eid,
+                                         {'eid': eid, 'num_yes': result.num_yes, 'num_no': result.num_no}))
+        return announcement
+
+    if await async_db.close_election(eid, announce) is None:
+        return
+    unregister_vote_handlers(eid)
+    await tally_updater.forget(eid)
+    job_queue.schedule(announcement)
+
+
+async def send_vote_confirmation(job: models.Job):
+    election = await async_db.get_election(job.payload['eid'])
+    vote = await async_db.get_vote(job.payload['eid'], job.payload['uid'])
+    await dm.send_dm_async(app.client, [vote.uid], blocks=blockgen.vote_confirmation(election, vote))
+
+
+async def announce_election_result(job: models.Job):
+    eid = job.payload['eid']
+    election = await async_db.get_election(eid)
+    if 'ts' not in job.payload:
+        result = models.ElectionResult(election, job.payload['num_yes'], job.payload['num_no'])
+        announcement = await app.client.chat_postMessage(channel=CHANNEL_NAME, blocks=blockgen.election_result(result))
+        job.payload['ts'] = announcement['ts']
+        await async_db.put_job(job)
+    announcement_url = await app.client.chat_getPermalink(channel=CHANNEL_ID, message_ts=job.payload['ts'])
+    announcement_text = f'An election you are allowed to vote in has concluded: {announcement_url["permalink"]}'
+    await fan_out_dispatcher.fan_out(util.fan_out_id(eid), election.allowed_voter_uids, announcement_text)
+
+
+job_queue.register(JOB_VOTE_CONFIRMATION, send_vote_confirmation)
+job_queue.register(JOB_ELECTION_RESULT, announce_election_result)
+
+
+@register_command('/vote-confirm', 'Confirm a vote was counted')
+async def confirm_(ack: AsyncAck, respond: AsyncRespond, command: dict):
+    print(command)
+    await ack()
+
+    if await _incorrect_channel(command, respond):
+        return
+    args = util.parse_args(command)
+    if await _incorrect_num_args(respond, '1 or 2', len(args), op=lambda e, a: a not in (1, 2)):
+        return
+    if len(args) == 1:
+        is_valid = await async_db.is_vote_valid(None, args[0])
+    else:
+        eid, confirmation = args
+        is_valid = await async_db.is_vote_valid(util.clean_alphanumeric(eid), confirmation)
+
+    await respond(text=blockgen.VOTE_VALID if is_valid else blockgen.VOTE_INVALID)
+
+
+@register_command('/vote-check', 'Check the current results of an election')
+async def check_(ack: AsyncAck, respond: AsyncRespond, command: dict, body):
+    print(command)
+    await ack()
+
+    if await _incorrect_channel(command, respond):
+        return
+    args = util.parse_args(command)
+    if await _incorrect_num_args(respond, 1, len(args)):
+        return
+    eid = util.clean_alphanumeric(args[0])
+
+    result = await async_db.get_election_result(eid, requestor_uid=util.uid_from_body(body))
+    if isinstance(result, models.InvalidPermissionsElectionResult):
+        await respond(text=blockgen.ERR_NO_CHECK_PERMISSIONS)
+    elif isinstance(result, models.ShortCircuitElectionResult):
+        await respond(text=blockgen.ERR_INVALID_ELECTION)
+    else:
+        await respond(text=blockgen.election_status(result))
+
+
+@register_command('/vote-export', 'Export every election, or stats per voter or position, as CSV or NDJSON')
+async def export_(ack: AsyncAck, respond: AsyncRespond, client: AsyncWebClient, command: dict):
+    print(command)
+    await ack()
+
+    if await _incorrect_channel(command, respond):
+        return
+    args = [a for a in util.parse_args(command) if a]
+    report = args[0] if args else export.REPORT_ELECTIONS
+    file_format = args[1] if len(args) > 1 else export.FORMAT_CSV
+    if len(args) > 2 or report not in export.REPORTS or file_format not in export.FORMATS:
+        await respond(text=blockgen.ERR_INVALID_EXPORT)
+        return
+
+    # Streamed out of db and uploaded a chunk at a time, so that only one chunk of the export is ever in memory
+    parts = export.export(report, file_format)
+    part = 0
+    # Each chunk is produced in a thread, as producing it may read the archive
+    while (content := await asyncio.to_thread(next, parts, None)) is not None:
+        part += 1
+        await client.files_upload_v2(channel=CHANNEL_ID, content=content,
+                                     filename=export.filename(report, file_format, part),
+                                     title=f'votebot {report} export, part {part}')
+    await respond(text=f'Exported {report} in {part} file(s).')
+
+
+@register_command('/vote-refresh', 'Refresh the cached members of usergroups')
+async def refresh_(ack: AsyncAck, respond: AsyncRespond, command: dict):
+    print(command)
+    await ack()
+
+    if await _incorrect_channel(command, respond):
+        return
+    args = [a for a in util.parse_args(command) if a]
+    if len(args) == 0:
+        usergroups.usergroup_members.refresh()
+        await respond(text='The members of all usergroups will be looked up again.')
+    else:
+        for ug_escstr in args:
+            usergroups.usergroup_members.refresh(models.UserGroup.from_str(ug_escstr).ugid)
+        await respond(text=f'The members of {", ".join(args)} will be looked up again.')
+
+
+@register_command('/vote-help', 'Help with using votebot')
+async def help_(ack: AsyncAck, respond: AsyncRespond, command: dict):
+    print(command)
+    await ack()
+    await respond(text=blockgen.help_text(commands))
+
+
+async def post_ephemeral(client, body, text):
+    await client.chat_postEphemeral(channel=CHANNEL_ID, user=util.uid_from_body(body), text=text)
+
+
+async def hydrate() -> int:
+    """
+    Load db and the dedup cache, start the background workers, then dispatch the requests buffered until then.
+
+    :return: the number of requests that were buffered
+    """
+    global loaded
+    with startup.phase('db_load'):
+        await async_db.load()
+        await asyncio.to_thread(dedup_cache.load)
+    # Run any jobs interrupted by the last shutdown (including conclusion DMs)
+    await job_queue.start()
+    await deadline_scheduler.start()
+    loaded = True
+    buffered = _buffered[:]
+    _buffered.clear()
+    with startup.phase('replay'):
+        for body in buffered:
+            await app.async_dispatch(AsyncBoltRequest(mode='socket_mode', body=body))
+    if buffered:
+        print(f'Dispatched {len(buffered)} requests received while loading')
+    return len(buffered)
+
+
+async def _incorrect_channel(command, respond) -> bool:
+    actual_channel = command['channel_name']
+    is_incorrect = actual_channel != CHANNEL_NAME
+    if is_incorrect:
+        await respond(text=f'Incorrect channel. Expected {CHANNEL_NAME}, got {actual_channel}.')
+    return is_incorrect
+
+
+async def _incorrect_num_args(respond, expected, actual, op=lambda e, a: e != a):
+    is_incorrect = op(expected, actual)
+    if is_incorrect:
+        await respond(text=f'Incorrect number of arguments. Expected {expected}, got {actual}.')
+    return is_incorrect
+
+
+async def _expand_voters(client: AsyncWebClient, voter_escstrs: list[str]) -> list[str]:
+    members = await usergroups.usergroup_members.expand_async(client, usergroups.usergroup_ids(voter_escstrs))
+    return usergroups.merge_voters(voter_escstrs, members)
+
+
+async def main():
+    startup.mark('listeners')
+    metrics.registry.register_collector('votebot_dm_channel_cache', dm.dm_channels.stats)
+    metrics.registry.register_collector('votebot_dedup_cache', dedup_cache.stats)
+    metrics.registry.register_collector('votebot_result_cache', async_db.result_cache_stats)
+    metrics.registry.register_collector('votebot_startup_seconds', startup.stats)
+    if os.environ.get('METRICS_PORT'):
+        metrics.serve(int(os.environ['METRICS_PORT']))
+    if float(os.environ.get('METRICS_LOG_INTERVAL') or 0) > 0:
+        metrics.log_periodically(float(os.environ['METRICS_LOG_INTERVAL']))
+    handler = AsyncSocketModeHandler(app, os.environ['SLACK_APP_TOKEN'])
+    if LAZY_START:
+        with startup.phase('connect'):
+            await handler.connect_async()
+        await hydrate()
+    else:
+        await hydrate()
+        with startup.phase('connect'):
+            await handler.connect_async()
+    print(startup.ready())
+    await asyncio.sleep(float('inf'))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import asyncio
+import functools
+
+import db
+
+
+def _in_thread(func):
+    # db is not async aware: any of its functions may block on the storage backend or on the archive
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+
+# Awaitable versions of the db functions used by async_app.py, each run on the event loop's default executor
+load = _in_thread(db.load)
+create_election = _in_thread(db.create_election)
+create_elections = _in_thread(db.create_elections)
+get_election_result = _in_thread(db.get_election_result)
+get_tally = _in_thread(db.get_tally)
+close_election = _in_thread(db.close_election)
+get_election = _in_thread(db.get_election)
+is_election_open = _in_thread(db.is_election_open)
+list_open_elections = _in_thread(db.list_open_elections)
+get_vote = _in_thread(db.get_vote)
+cast_vote = _in_thread(db.cast_vote)
+is_vote_valid = _in_thread(db.is_vote_valid)
+set_election_message = _in_thread(db.set_election_message)
+set_slate_message = _in_thread(db.set_slate_message)
+get_election_message = _in_thread(db.get_election_message)
+create_fan_out = _in_thread(db.create_fan_out)
+list_deliveries = _in_thread(db.list_deliveries)
+update_delivery = _in_thread(db.update_delivery)
+mark_fan_out_finished = _in_thread(db.mark_fan_out_finished)
+get_dm_channel = _in_thread(db.get_dm_channel)
+set_dm_channel = _in_thread(db.set_dm_channel)
+remove_dm_channel = _in_thread(db.remove_dm_channel)
+put_job = _in_thread(db.put_job)
+remove_job = _in_thread(db.remove_job)
+list_pending_jobs = _in_thread(db.list_pending_jobs)
+refresh_job = _in_thread(db.refresh_job)
+acquire_lease = _in_thread(db.acquire_lease)
+release_lease = _in_thread(db.release_lease)
+update_dedup_keys = _in_thread(db.update_dedup_keys)
+
+# Never blocks, and is called by the metrics collectors rather than on the event loop
+result_cache_stats = db.result_cache_stats
+
+
+if __name__ == '__main__':
+    raise NotImplementedError('Not an entrypoint')
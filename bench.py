@@ -0,0 +1,678 @@
+import argparse
+import asyncio
+import contextlib
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeslack
+
+CHANNEL_NAME = 'bench'
+CHANNEL_ID = 'CBENCH'
+CREATOR_UID = 'UCREATOR'
+ELECTEE_UID = 'UELECTEE'
+
+
+def summarize(latencies: list[float], wall_s: float) -> dict:
+    ordered = sorted(latencies)
+
+    def percentile(pct: float) -> float:
+        return round(1000 * ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 3)
+
+    return {
+        'count': len(ordered),
+        'throughput_per_s': round(len(ordered) / wall_s, 2) if wall_s > 0 else None,
+        'p50_ms': percentile(50),
+        'p99_ms': percentile(99),
+        'max_ms': round(1000 * ordered[-1], 3),
+    }
+
+
+class Bench:
+    """
+    Drives the real votebot listeners with synthetic Slack payloads, against a FakeSlack Web API.
+
+    In thread mode, the listeners of app.py are called on the calling thread. In async mode, the listeners of
+    async_app.py are run on an event loop in a background thread, and the calling thread waits for them.
+    """
+
+    def __init__(self, fake: fakeslack.FakeSlack, backend: str, workdir: str, mode: str = 'thread'):
+        self.fake = fake
+        self.backend = backend
+        self.workdir = workdir
+        self.mode = mode
+        self._runs = 0
+
+        # app reads its configuration at import time, so it is only imported once the environment is set up
+        os.environ.update({
+            'SLACK_BOT_TOKEN': 'xoxb-bench',
+            'SLACK_APP_TOKEN': 'xapp-bench',
+            'SLACK_SIGNING_SECRET': 'bench',
+            'SLACK_API_URL': fake.base_url,
+            'CHANNEL_NAME': CHANNEL_NAME,
+            'CHANNEL_ID': CHANNEL_ID,
+        })
+        if mode == 'async':
+            import async_app as app
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name='bench-loop', daemon=True).start()
+        else:
+            import app
+        import archive
+        import db
+        import dedup
+        import storage
+        self.app = app
+        self.archive = archive
+        self.db = db
+        self.dedup = dedup
+        self.storage = storage
+
+    def reset(self, populate=None) -> tuple[float, float]:
+        """
+        Start from a fresh database, optionally populated by a callback taking the new storage backend.
+
+        :return: the seconds taken by the first db.load() on the new database, which archives its finished elections,
+                 and by the next one
+        """
+        self._runs += 1
+        self.path = os.path.join(self.workdir, f'bench_{self._runs}.{self.backend}')
+        self.archive_path = os.path.join(self.workdir, f'archive_{self._runs}')
+        storage_ = self.storage.open_storage(self.backend, self.path)
+        archive_ = self.archive.Archive(self.archive_path)
+        first_load_s = 0.0
+        if populate is not None:
+            with storage_.transaction():
+                populate(storage_)
+            # The first load archives the populated finished elections
+            start = time.perf_counter()
+            self.db.load(storage_, archive_)
+            first_load_s = time.perf_counter() - start
+        self._reset_app()
+        start = time.perf_counter()
+        self.db.load(storage_, archive_)
+        return first_load_s, time.perf_counter() - start
+
+    def attach(self, path: str, archive_path: str) -> None:
+        """Start from a SQLite database and archive shared with other instances, as with STORAGE_SHARED set."""
+        self._reset_app()
+        storage_ = self.storage.open_storage(self.storage.BACKEND_SQLITE, path, self.storage.FORMAT_JSON)
+        self.db.load(storage_, self.archive.Archive(archive_path), shared=True)
+
+    def create(self, voters: list[str], threshold_pct: int) -> str:
+        ugid = f'S{len(self.fake.usergroups)}'
+        self.fake.usergroups[ugid] = voters
+        self.command(self.app.create_, f'<@{ELECTEE_UID}|electee> "Bench Position" {threshold_pct} '
+                                       f'<!subteam^{ugid}|@bench>', CREATOR_UID)
+        return self.db.list_elections()[-1].eid
+
+    def click(self, eid: str, uid: str, is_yes: bool = True) -> float:
+        action_id = f'{eid}_{"yes" if is_yes else "no"}'
+        body = {'type': 'block_actions', 'user': {'id': uid}, 'actions': [{'action_id': action_id}]}
+        start = time.perf_counter()
+        self._call(self.app.vote_action_, ack=self._context('ack'), client=self.app.app.client, body=body,
+                   action=body['actions'][0])
+        return time.perf_counter() - start
+
+    def command(self, listener, text: str, uid: str) -> float:
+        command = {'channel_name': CHANNEL_NAME, 'channel_id': CHANNEL_ID, 'user_id': uid, 'text': text,
+                   'response_url': self.fake.response_url}
+        kwargs = {
+            'ack': self._context('ack'),
+            'respond': self._context('respond'),
+            'say': self._context('say'),
+            'client': self.app.app.client,
+            'command': command,
+            'body': command,
+        }
+        params = inspect.signature(listener).parameters
+        # Listeners print every command they receive
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            self._call(listener, **{k: v for k, v in kwargs.items() if k in params})
+            return time.perf_counter() - start
+
+    def dispatch(self, body: dict) -> float:
+        """Dispatch a payload as received over Socket Mode, through the middlewares, unlike click() and command()."""
+        if self.mode == 'async':
+            from slack_bolt.async_app import AsyncBoltRequest
+            dispatch, request = self.app.app.async_dispatch, AsyncBoltRequest(mode='socket_mode', body=body)
+        else:
+            from slack_bolt import BoltRequest
+            dispatch, request = self.app.app.dispatch, BoltRequest(mode='socket_mode', body=body)
+        start = time.perf_counter()
+        self._call(dispatch, request)
+        return time.perf_counter() - start
+
+    def unload(self) -> None:
+        """Have the app buffer requests again, as it does from a restart until hydrate() has loaded db."""
+        if self.mode == 'async':
+            self.app.loaded = False
+        else:
+            self.app.loaded.clear()
+
+    def drain(self, timeout: float = 600) -> float:
+        start = time.perf_counter()
+        self._call(self.app.job_queue.join, timeout)
+        return time.perf_counter() - start
+
+    def _reset_app(self) -> None:
+        self.app.vote_handlers.clear()
+        self.app.dedup_cache = self.dedup.DedupCache()
+        self.app.usergroups.usergroup_members.refresh()
+        self.fake.reset()
+
+    def _call(self, func, *args, **kwargs):
+        if self.mode == 'async':
+            return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), self._loop).result()
+        return func(*args, **kwargs)
+
+    def _context(self, name: str):
+        if self.mode == 'async':
+            from slack_bolt.async_app import AsyncAck as Ack, AsyncRespond as Respond, AsyncSay as Say
+        else:
+            from slack_bolt import Ack, Respond, Say
+        if name == 'ack':
+            return Ack()
+        elif name == 'respond':
+            return Respond(response_url=self.fake.response_url)
+        return Say(client=self.app.app.client, channel=CHANNEL_ID)
+
+
+def bench_clicks(bench: Bench, voters: int = 500, window_s: float = 10, double_click_pct: float = 20) -> dict:
+    """All voters click within a window, some of them twice at once, on an election finishing on the last vote."""
+    bench.reset()
+    uids = [f'U{i:05}' for i in range(voters)]
+    eid = bench.create(uids, 100)
+
+    clicks = [(random.uniform(0, window_s), uid) for uid in uids]
+    clicks += [(t + random.uniform(0, 0.05), uid) for t, uid in random.sample(clicks, voters * double_click_pct // 100)]
+    latencies, wall_s = _click_all(bench, eid, clicks, time.time())
+    side_effects_s = bench.drain()
+
+    votes = [bench.db.get_vote(eid, uid) for uid in uids]
+    return {
+        'ops': {'click': summarize(latencies, wall_s)},
+        'side_effects_s': round(side_effects_s, 3),
+        'one_vote_per_voter': all(v is not None for v in votes) and bench.db.get_tally(eid).num_yes == voters,
+        'dedup': bench.app.dedup_cache.stats(),
+        'slack_calls': bench.fake.counts(),
+    }
+
+
+def bench_instances(bench: Bench, voters: int = 200, window_s: float = 5, both_pct: float = 20) -> dict:
+    """
+    Two instances sharing one SQLite file, each clicked on by half the voters, some of whom click on both at once,
+    on an election finishing on the last vote. Its result must be announced (and DM'd) by exactly one of them.
+    """
+    path = os.path.join(bench.workdir, 'shared.sqlite3')
+    archive_path = os.path.join(bench.workdir, 'archive_shared')
+    bench.attach(path, archive_path)
+    uids = [f'U{i:05}' for i in range(voters)]
+    eid = bench.create(uids, 100)
+
+    clicks = [(random.uniform(0, window_s), uid) for uid in uids]
+    random.shuffle(clicks)
+    both = [(t + random.uniform(0, 0.05), uid) for t, uid in clicks[:voters * both_pct // 100]]
+    ours, theirs = clicks[:voters // 2], clicks[voters // 2:] + both
+
+    import dm
+    # The other instance is a fresh interpreter, started before the clicks so that its imports are not timed
+    context = multiprocessing.get_context('spawn')
+    connection, other_connection = context.Pipe()
+    other = context.Process(target=_run_instance, args=[other_connection, path, archive_path, bench.workdir,
+                                                        bench.mode, dict(dm.TIER_LIMITS), eid, theirs])
+    other.start()
+    connection.recv()
+    start_at = time.time() + 0.5
+    connection.send(start_at)
+    latencies, wall_s = _click_all(bench, eid, ours, start_at)
+    bench.drain()
+    other_latencies, other_slack_calls = connection.recv()
+    other.join()
+
+    slack_calls = Counter(bench.fake.counts()) + Counter(other_slack_calls)
+    tally = bench.db.get_tally(eid)
+    return {
+        'ops': {'click': summarize(latencies + other_latencies, wall_s)},
+        'one_vote_per_voter': tally.num_yes == voters and tally.num_no == 0,
+        'results_announced': slack_calls['chat.getPermalink'],
+        'slack_calls': dict(slack_calls),
+    }
+
+
+def _run_instance(connection, path: str, archive_path: str, workdir: str, mode: str, tier_limits: dict[str, int],
+                  eid: str, clicks: list[tuple[float, str]]) -> None:
+    fake = fakeslack.FakeSlack().start()
+    bench = Bench(fake, 'sqlite', workdir, mode)
+    import dm
+    dm.TIER_LIMITS.update(tier_limits)
+    bench.attach(path, archive_path)
+    connection.send('ready')
+    latencies, _ = _click_all(bench, eid, clicks, connection.recv())
+    bench.drain()
+    connection.send((latencies, fake.counts()))
+    fake.stop()
+
+
+def _click_all(bench: Bench, eid: str, clicks: list[tuple[float, str]], start_at: float) -> tuple[list[float], float]:
+    # Each click is made at its offset in seconds from start_at, concurrently with the others
+    latencies = []
+    lock = threading.Lock()
+
+    def click(offset_uid):
+        offset, uid = offset_uid
+        time.sleep(max(0.0, start_at + offset - time.time()))
+        latency = bench.click(eid, uid)
+        with lock:
+            latencies.append(latency)
+
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        list(executor.map(click, sorted(clicks)))
+    return latencies, time.time() - start_at
+
+
+def bench_history(bench: Bench, elections: int = 1000, voters: int = 30, ops: int = 200) -> dict:
+    """Clicks, /vote-check and /vote-confirm on a database holding many finished (and so archived) elections."""
+    import models
+    import util
+
+    archived = []
+
+    def populate(storage_):
+        for i in range(elections):
+            uids = [f'U{j:05}' for j in range(voters)]
+            election = models.Election(util.random_id(), ELECTEE_UID, f'Position {i}', 50, uids, CREATOR_UID, True)
+            storage_.insert_election(election.to_dict())
+            for uid in uids:
+                vote = models.Vote(uid, election.eid, random.random() < 0.7, util.confirmation_code(election.eid))
+                storage_.insert_vote(vote.to_dict())
+                archived.append(vote)
+
+    first_load_s, load_s = bench.reset(populate)
+    uids = [f'U{i:05}' for i in range(ops)]
+    eid = bench.create(uids, 100)
+
+    results = {}
+    start = time.perf_counter()
+    latencies = [bench.click(eid, uid) for uid in uids]
+    results['click'] = summarize(latencies, time.perf_counter() - start)
+    bench.drain()
+
+    start = time.perf_counter()
+    latencies = [bench.command(bench.app.check_, eid, CREATOR_UID) for _ in range(ops)]
+    results['check'] = summarize(latencies, time.perf_counter() - start)
+
+    confirmations = [bench.db.get_vote(eid, uid).confirmation for uid in uids]
+    start = time.perf_counter()
+    latencies = [bench.command(bench.app.confirm_, f'{eid} {c}', CREATOR_UID) for c in confirmations]
+    results['confirm'] = summarize(latencies, time.perf_counter() - start)
+
+    sample = random.sample(archived, ops)
+    start = time.perf_counter()
+    latencies = [bench.command(bench.app.check_, v.eid, CREATOR_UID) for v in sample]
+    results['check_archived'] = summarize(latencies, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    latencies = [bench.command(bench.app.confirm_, f'{v.eid} {v.confirmation}', CREATOR_UID) for v in sample]
+    results['confirm_archived'] = summarize(latencies, time.perf_counter() - start)
+
+    return {
+        'ops': results,
+        'first_load_s': round(first_load_s, 3),
+        'load_s': round(load_s, 3),
+        # What every write rewrites with TinyDB, which archived elections should hardly add to
+        'db_bytes': os.path.getsize(bench.path),
+        'slack_calls': bench.fake.counts(),
+    }
+
+
+def bench_fanout(bench: Bench, voters: int = 300, latency_s: float = 0.02, rate_limit_pct: float = 2) -> dict:
+    """The conclusion DMs to every voter of an election, with slow and occasionally rate limited Slack calls."""
+    bench.reset()
+    uids = [f'U{i:05}' for i in range(voters)]
+    eid = bench.create(uids, 1)
+    # The fewest votes that finish an election with the lowest threshold
+    deciding_uids = uids[:max(1, voters // 100)]
+    for uid in deciding_uids[:-1]:
+        bench.click(eid, uid)
+    bench.drain()
+    bench.fake.reset()
+
+    bench.fake.latency, bench.fake.rate_limit_pct = latency_s, rate_limit_pct
+    try:
+        click_s = bench.click(eid, deciding_uids[-1])
+        fan_out_s = bench.drain()
+    finally:
+        bench.fake.latency, bench.fake.rate_limit_pct = 0.0, 0.0
+
+    return {
+        'ops': {'click': summarize([click_s], click_s)},
+        'fan_out_s': round(fan_out_s, 3),
+        'dms_per_s': round(voters / fan_out_s, 2),
+        'slack_calls': bench.fake.counts(),
+    }
+
+
+def bench_records(bench: Bench, elections: int = 10_000, voters: int = 30, pool: int = 500) -> dict:
+    """(De)serializing models, and dumping and loading a TinyDB database file of them in each storage format."""
+    import models
+    import util
+
+    uids = [f'U{i:05}' for i in range(pool)]
+    election_dicts, vote_dicts = [], []
+    for i in range(elections):
+        election = models.Election(util.random_id(), ELECTEE_UID, f'Position {i}', 50, random.sample(uids, voters),
+                                   CREATOR_UID, True)
+        election_dicts.append(election.to_dict())
+        vote_dicts.extend(models.Vote(uid, election.eid, random.random() < 0.7,
+                                      util.confirmation_code(election.eid)).to_dict()
+                          for uid in election.allowed_voter_uids)
+    # The memory the models themselves take, against what the same attributes take as plain dicts (as in the
+    # __dict__ of models without __slots__), not counting the strings both share
+    models_kib = _traced_kib(lambda: ([models.Election.from_dict(e) for e in election_dicts],
+                                      [models.Vote.from_dict(v) for v in vote_dicts]))
+    dicts_kib = _traced_kib(lambda: ([dict(e) for e in election_dicts], [dict(v) for v in vote_dicts]))
+    election_models = [models.Election.from_dict(e) for e in election_dicts]
+    vote_models = [models.Vote.from_dict(v) for v in vote_dicts]
+
+    results = {}
+    start = time.perf_counter()
+    election_dicts = [e.to_dict() for e in election_models]
+    vote_dicts = [v.to_dict() for v in vote_models]
+    to_dict_s = time.perf_counter() - start
+    start = time.perf_counter()
+    [models.Election.from_dict(e) for e in election_dicts]
+    [models.Vote.from_dict(v) for v in vote_dicts]
+    from_dict_s = time.perf_counter() - start
+    results['to_dict'] = summarize([to_dict_s], to_dict_s)
+    results['from_dict'] = summarize([from_dict_s], from_dict_s)
+
+    # The database as TinyDB holds it, written at once rather than through TinyDBStorage, whose inserts get slower
+    # with every table in the database
+    tinydb_storage = bench.storage.TinyDBStorage
+    tables = {tinydb_storage.ELECTIONS_TABLE: {str(i): e for i, e in enumerate(election_dicts, 1)}}
+    for vote in vote_dicts:
+        table = tables.setdefault(tinydb_storage.votes_table_name(vote['eid']), {})
+        table[str(len(table) + 1)] = vote
+
+    sizes = {}
+    for file_format in tinydb_storage.FORMATS:
+        path = os.path.join(bench.workdir, f'records.{file_format}')
+        file = bench.storage._TinyDBFile(path, file_format)
+        start = time.perf_counter()
+        file.write(tables)
+        dump_s = time.perf_counter() - start
+        file.close()
+        start = time.perf_counter()
+        storage_ = tinydb_storage(path, file_format=file_format)
+        storage_.load_elections()
+        storage_.load_votes()
+        load_s = time.perf_counter() - start
+        storage_.close()
+        results[f'dump_{file_format}'] = summarize([dump_s], dump_s)
+        results[f'load_{file_format}'] = summarize([load_s], load_s)
+        sizes[file_format] = os.path.getsize(path)
+
+    return {
+        'ops': results,
+        'file_kib': {file_format: round(size / 1024, 1) for file_format, size in sizes.items()},
+        'models_kib': round(models_kib, 1),
+        'dicts_kib': round(dicts_kib, 1),
+        'records': len(election_models) + len(vote_models),
+    }
+
+
+def bench_startup(bench: Bench, elections: int = 2000, voters: int = 30, clicks: int = 20) -> dict:
+    """
+    A restart with a large database, during a live vote: how long until Slack is connected to and requests are
+    handled, loading db before connecting and with LAZY_START. Fails unless every click is counted, including those
+    buffered while loading.
+    """
+    import models
+    import util
+
+    # One voter of the live election never clicks, so that it stays open
+    uids = [f'U{i:05}' for i in range(max(voters, clicks + 1))]
+
+    def populate(storage_):
+        for i in range(elections):
+            election = models.Election(util.random_id(), ELECTEE_UID, f'Position {i}', 100, uids[:voters],
+                                       CREATOR_UID, False)
+            storage_.insert_election(election.to_dict())
+            for uid in uids[:voters // 2]:
+                vote = models.Vote(uid, election.eid, True, util.confirmation_code(election.eid))
+                storage_.insert_vote(vote.to_dict())
+        storage_.insert_election(models.Election(live_eid, ELECTEE_UID, 'Live Position', 100, uids[:clicks + 1],
+                                                 CREATOR_UID, False).to_dict())
+
+    live_eid = util.random_id()
+    results = {}
+    phases = {}
+    counted = {}
+    first_load_s = {}
+    failures = []
+    for lazy in (False, True):
+        name = 'lazy' if lazy else 'eager'
+        first_load_s[name] = round(bench.reset(populate)[0], 3)
+        # hydrate() loads the configured database, as it does on a real start
+        os.environ.update({'STORAGE_BACKEND': bench.backend, 'STORAGE_PATH': bench.path,
+                           'ARCHIVE_PATH': bench.archive_path})
+        bench.unload()
+        action = {'type': 'button', 'action_id': util.button_action_id(live_eid, True)}
+        bodies = [{'type': 'block_actions', 'team': {'id': 'TBENCH'}, 'user': {'id': uid},
+                   'trigger_id': util.random_id(), 'actions': [action]} for uid in uids[:clicks]]
+        start = time.perf_counter()
+        if lazy:
+            # Connected at once, clicks are acked and buffered while db loads in the background. Half of them are
+            # received before it starts loading, so that some are always buffered.
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies = [bench.dispatch(body) for body in bodies[:clicks // 2]]
+                if bench.mode == 'async':
+                    hydrated = asyncio.run_coroutine_threadsafe(bench.app.hydrate(), bench._loop)
+                else:
+                    hydrated = ThreadPoolExecutor(1).submit(bench.app.hydrate)
+                latencies += [bench.dispatch(body) for body in bodies[clicks // 2:]]
+                buffered = hydrated.result()
+            connect_s = 0.0
+            ready_s = time.perf_counter() - start
+        else:
+            # Connected only once db is loaded, so clicks received while restarting are acked then at the earliest
+            with contextlib.redirect_stdout(io.StringIO()):
+                bench._call(bench.app.hydrate)
+            connect_s = ready_s = time.perf_counter() - start
+            buffered = 0
+            latencies = [connect_s] * clicks
+            for body in bodies:
+                bench.dispatch(body)
+        results[f'{name}_connect'] = summarize([connect_s], connect_s)
+        results[f'{name}_click_ack'] = summarize(latencies, max(latencies))
+        results[f'{name}_ready'] = summarize([ready_s], ready_s)
+        # Listeners may still be running after the ack
+        deadline = time.time() + 60
+        while bench.db.get_tally(live_eid).num_yes < clicks and time.time() < deadline:
+            time.sleep(0.01)
+        counted[name] = bench.db.get_tally(live_eid).num_yes
+        if counted[name] != clicks:
+            failures.append(f'{name}: {counted[name]} of {clicks} clicks counted ({buffered} were buffered)')
+        if lazy and buffered < clicks // 2:
+            failures.append(f'{name}: {buffered} clicks buffered, though {clicks // 2} were received before loading')
+        phases[name] = {phase: round(seconds, 3) for phase, seconds in bench.app.startup.stats().items()}
+        bench.drain()
+
+    return {
+        'ops': results,
+        'phases': phases,
+        # Of the database as populated, before the restart timed
+        'first_load_s': first_load_s,
+        'clicks': clicks,
+        'counted': counted,
+        'records': elections * (1 + voters // 2) + 1,
+        'failures': failures,
+    }
+
+
+def bench_blocks(bench: Bench, renders: int = 2000, voter_counts: tuple[int, ...] = (30, 500)) -> dict:
+    """Rendering election messages from blockgen's templates, against generating them from a tree of Gen objects."""
+    import blockgen
+    import models
+    import util
+
+    results = {}
+    for voters in voter_counts:
+        uids = [f'U{i:05}' for i in range(voters)]
+        election = models.Election(util.random_id(), ELECTEE_UID, 'Bench Position', 50, uids, CREATOR_UID, False,
+                                   time.time() + 3600)
+        tallies = [models.ElectionResult(election, i % voters, 0) for i in range(renders)]
+        for name, render in (('template', blockgen.election), ('generator', _generate_election)):
+            latencies = []
+            start = time.perf_counter()
+            for result in tallies:
+                render_start = time.perf_counter()
+                render(election, result)
+                latencies.append(time.perf_counter() - render_start)
+            results[f'election_{voters}_{name}'] = summarize(latencies, time.perf_counter() - start)
+
+    # Both render the same blocks while the allowed voters fit in one block
+    uids = [f'U{i:05}' for i in range(blockgen.MAX_MENTIONS_PER_BLOCK)]
+    election = models.Election(util.random_id(), ELECTEE_UID, 'Bench Position', 50, uids, CREATOR_UID, False,
+                               time.time() + 3600)
+    result = models.ElectionResult(election, 10, 5)
+    return {
+        'ops': results,
+        'same_blocks': blockgen.election(election, result) == _generate_election(election, result),
+    }
+
+
+def _generate_election(election, result) -> list[dict]:
+    # blockgen.election() as it was before its templates, generating every block from a new tree of Gen objects
+    import blockgen
+    import util
+
+    rt_sections = [
+        blockgen.GenRTSectionText('ELECTION\r\n', bold=True),
+        blockgen.GenRTSectionText('Do you confirm '),
+        blockgen.GenRTSectionUser(election.electee_uid),
+        blockgen.GenRTSectionText(f' for the position of {election.position}?\r\nAllowed voters: '),
+    ]
+    for uid in election.allowed_voter_uids:
+        rt_sections.append(blockgen.GenRTSectionUser(uid))
+        rt_sections.append(blockgen.GenRTSectionText(' '))
+    if election.deadline is not None:
+        rt_sections.append(blockgen.GenRTSectionText('\r\nVoting closes '))
+        rt_sections.append(blockgen.GenRTSectionDate(int(election.deadline)))
+    filled = 20 * result.reporting_pct // 100
+    bar = '\u2588' * filled + '\u2591' * (20 - filled)
+    rt_sections.append(blockgen.GenRTSectionText(f'\r\n{bar} {result.reporting_pct}% reporting '
+                                                 f'({result.reporting_voters}/{result.num_voters} votes in)'))
+    rt_sections.append(blockgen.GenRTSectionText(f'\r\nElection ID: {election.eid}', italic=True))
+    return [
+        blockgen.GenRT(rt_sections).generate(),
+        blockgen.GenActions([
+            blockgen.GenActionButton('Yes', util.button_action_id(election.eid, True), False),
+            blockgen.GenActionButton('No', util.button_action_id(election.eid, False), True),
+        ]).generate(),
+    ]
+
+
+def _traced_kib(build) -> float:
+    tracemalloc.start()
+    built = build()
+    kib = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+    del built
+    return kib
+
+
+SCENARIOS = {
+    'clicks': bench_clicks,
+    'history': bench_history,
+    'fanout': bench_fanout,
+    'instances': bench_instances,
+    'records': bench_records,
+    'blocks': bench_blocks,
+    'startup': bench_startup,
+}
+
+
+def compare(previous: dict, current: dict) -> None:
+    for name, scenario in current['scenarios'].items():
+        for op, stats in scenario['ops'].items():
+            old = previous.get('scenarios', {}).get(name, {}).get('ops', {}).get(op)
+            if old is None:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p99_ms', 'throughput_per_s'):
+                if old.get(key) and stats.get(key) is not None:
+                    changes.append(f'{key} {old[key]} -> {stats[key]} ({100 * (stats[key] / old[key] - 1):+.1f}%)')
+            print(f'{name}/{op}: {", ".join(changes)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark votebot against a local fake Slack Web API')
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS),
+                        help=f'scenarios to run, out of {", ".join(SCENARIOS)} (default: all)')
+    parser.add_argument('--backend', default='tinydb', help='storage backend to benchmark (default: %(default)s)')
+    parser.add_argument('--mode', default='thread', choices=['thread', 'async'],
+                        help='run the listeners of app.py (thread) or async_app.py (async) (default: %(default)s)')
+    parser.add_argument('--output', default='bench_results.json', help='file to write results to (default: %(default)s)')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    parser.add_argument('--tier-scale', type=float, default=100,
+                        help='multiplier of the Slack rate limit tiers the bot holds itself to (default: %(default)s)')
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    # Rate limits are enforced by the fake Slack instead, so that runs do not take minutes
+    import dm
+    for method in dm.TIER_LIMITS:
+        dm.TIER_LIMITS[method] = int(dm.TIER_LIMITS[method] * args.tier_scale)
+    os.environ['TALLY_UPDATE_INTERVAL'] = os.environ.get('TALLY_UPDATE_INTERVAL') or '1'
+
+    fake = fakeslack.FakeSlack().start()
+    results = {
+        'meta': {
+            'backend': args.backend,
+            'mode': args.mode,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'tier_scale': args.tier_scale,
+        },
+        'scenarios': {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        bench = Bench(fake, args.backend, workdir, args.mode)
+        for name in args.scenarios:
+            print(f'Running {name}...')
+            results['scenarios'][name] = SCENARIOS[name](bench)
+            print(json.dumps(results['scenarios'][name], indent=4))
+    fake.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    # Scenarios checking the bot's behaviour, besides timing it, list what went wrong
+    failures = [f'{name}: {failure}' for name, scenario in results['scenarios'].items()
+                for failure in scenario.get('failures', [])]
+    if failures:
+        print('\n'.join(['Failed:'] + failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
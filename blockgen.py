@@ -1,8 +1,28 @@
+import functools
+import math
 from abc import ABC, abstractmethod
+from typing import Callable
 import models
 
 import util
 
+ERR_VOTE_RENDER = '[voting buttons cannot be rendered - please reload]'
+ERR_NON_ALLOWED_VOTER = 'ERROR: Vote not submitted. You are not an allowed voted.'
+ERR_USER_ALREADY_VOTED = 'ERROR: Vote not submitted. You have already voted.'
+ERR_ELECTION_FINISHED = 'ERROR: Vote not submitted. This election has finished.'
+ERR_THRESHOLD_TOO_HIGH = 'Threshold percentage greater than 100'
+ERR_THRESHOLD_TOO_LOW = 'Threshold percentage should be 0-100'
+ERR_NO_CHECK_PERMISSIONS = 'You do not have permissions to check this election\'s results!'
+ERR_INVALID_ELECTION = 'This election is invalid. If you believe this to be in error, ' \
+                       'confirm the election ID and try again.'
+ERR_INVALID_SLATE = 'Expected a threshold percentage, then pairs of an electee and a position, then the allowed voters.'
+ERR_SLATE_TOO_LARGE = 'Too many elections to announce in one message with this many allowed voters.'
+ERR_INVALID_EXPORT = 'Expected what to export (elections, voters or positions), then optionally csv or ndjson.'
+ERR_INVALID_DEADLINE = 'Expected the deadline before the allowed voters as a duration, i.e. 90m, 48h, 7d or 1d12h.'
+VOTE_VALID = 'This vote is valid!'
+VOTE_INVALID = 'This vote is invalid. If you believe this to be in error, ' \
+               'confirm your confirmation and election ID, or try voting again.'
+
 
 class GenBase(ABC):
     @abstractmethod
@@ -77,6 +97,19 @@ class GenRTSectionText(GenRTSection):
         }
 
 
+class GenRTSectionDate(GenRTSection):
+    def __init__(self, timestamp: int, date_format: str = '{date_short_pretty} at {time}'):
+        self.timestamp = timestamp
+        self.date_format = date_format
+
+    def generate(self) -> dict:
+        return {
+            'type': 'date',
+            'timestamp': self.timestamp,
+            'format': self.date_format,
+        }
+
+
 class GenRT(GenBase):
     def __init__(self, elements: list[GenRTSection]):
         self.elements = elements
@@ -93,47 +126,262 @@ class GenRT(GenBase):
         }
 
 
-_SPACE_RTS_ELEMENT = GenRTSectionText(' ')
+class Slot(GenBase):
+    """
+    Placeholder for a value filled in each time a Template is rendered, standing in for a generator or a value.
+
+    :param key: the name of the value to fill in
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def generate(self) -> 'Slot':
+        return self
+
+    def fill(self, values: dict):
+        return values[self.key]
+
+
+class TextSlot(Slot):
+    """Slot filled in with its key, a str.format() template, formatted with the values."""
+
+    def fill(self, values: dict) -> str:
+        return self.key.format_map(values)
 
 
-def _rts_users(election_: models.Election) -> list[GenRTSection]:
-    rt_sections = []
-    for uid in election_.allowed_voter_uids:
-        rt_sections.append(GenRTSectionUser(uid))
-        rt_sections.append(_SPACE_RTS_ELEMENT)
-    return rt_sections
+class SpreadSlot(Slot):
+    """Slot in a list, filled in with the items of its value (a list) in its place."""
 
 
-def election(election_: models.Election) -> list[dict]:
+class Template:
+    """
+    Blocks generated once, with Slots in place of what changes from one message to the next.
+
+    Rendering only rebuilds the dicts and lists holding slots. Everything else is shared by every rendered copy,
+    which must so not be mutated.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._render = _compile(blocks)
+
+    def render(self, **values):
+        """
+        :param values: the value of every slot, by key
+        :return: the blocks with their slots filled in
+        """
+        if self._render is None:
+            return self._blocks
+        return self._render(values)
+
+
+def _compile(node) -> Callable[[dict], object] | None:
+    # Returns the function rendering a node of a template, or None if the node holds no slots
+    if isinstance(node, Slot):
+        return node.fill
+    if isinstance(node, dict):
+        dynamic = [(key, fill) for key, fill in ((key, _compile(value)) for key, value in node.items()) if fill]
+        if not dynamic:
+            return None
+        # Updating a copy of the whole dict keeps the order of its keys
+        return lambda values: {**node, **{key: fill(values) for key, fill in dynamic}}
+    if isinstance(node, list):
+        parts = [(item, _compile(item), isinstance(item, SpreadSlot)) for item in node]
+        if not any(fill for _, fill, _ in parts):
+            return None
+
+        def render(values: dict) -> list:
+            rendered = []
+            for item, fill, is_spread in parts:
+                if fill is None:
+                    rendered.append(item)
+                elif is_spread:
+                    rendered.extend(fill(values))
+                else:
+                    rendered.append(fill(values))
+            return rendered
+        return render
+    return None
+
+
+# Blocks per message allowed by Slack
+MAX_BLOCKS = 50
+# Mentions of allowed voters per block, with longer lists continued in further blocks, well within the elements and
+# size Slack allows in a rich text block
+MAX_MENTIONS_PER_BLOCK = 100
+
+_SPACE_RTS_ELEMENT = GenRTSectionText(' ').generate()
+
+_ELECTION_HEAD = Template(GenRT([
+    GenRTSectionText('ELECTION\r\n', bold=True),
+    GenRTSectionText('Do you confirm '),
+    GenRTSectionUser(Slot('electee_uid')),
+    GenRTSectionText(TextSlot(' for the position of {position}?\r\nAllowed voters: ')),
+    SpreadSlot('mentions'),
+    SpreadSlot('tail'),
+]).generate())
+_SLATE_HEAD = Template(GenRT([
+    GenRTSectionText('ELECTIONS\r\n', bold=True),
+    GenRTSectionText('Allowed voters: '),
+    SpreadSlot('mentions'),
+    SpreadSlot('tail'),
+]).generate())
+_MENTIONS = Template(GenRT([SpreadSlot('mentions'), SpreadSlot('tail')]).generate())
+_SLATE_ELECTION = Template(GenRT([
+    GenRTSectionText('Do you confirm '),
+    GenRTSectionUser(Slot('electee_uid')),
+    GenRTSectionText(TextSlot(' for the position of {position}?')),
+    Slot('reporting'),
+    Slot('election_id'),
+]).generate())
+_DEADLINE = Template([
+    GenRTSectionText('\r\nVoting closes ').generate(),
+    GenRTSectionDate(Slot('timestamp')).generate(),
+])
+_REPORTING = Template(GenRTSectionText(
+    TextSlot('\r\n{bar} {reporting_pct}% reporting ({reporting_voters}/{num_voters} votes in)')).generate())
+_ELECTION_ID = Template(GenRTSectionText(TextSlot('\r\nElection ID: {eid}'), italic=True).generate())
+_VOTE_BUTTONS = Template(GenActions([
+    GenActionButton('Yes', Slot('yes_action_id'), False),
+    GenActionButton('No', Slot('no_action_id'), True),
+]).generate())
+_ELECTION_RESULT = Template([GenRT([
+    GenRTSectionText('ELECTION RESULT\r\n', bold=True),
+    GenRTSectionText('The election of '),
+    GenRTSectionUser(Slot('electee_uid')),
+    GenRTSectionText(TextSlot(' for {position} has concluded!\r\nThe final vote ')),
+    GenRTSectionText(Slot('outcome'), bold=True),
+    GenRTSectionText(TextSlot(' with a vote of {num_yes} yes to {num_no} no ({vote_pct}%).\r\n'
+                              'The threshold for this election was {threshold_pct}% of {num_voters} '
+                              'allowed voters ({threshold_voters}).\r\nReporting percentage was {reporting_pct}% '
+                              '({reporting_voters}/{num_voters}).\r\n')),
+    GenRTSectionText(TextSlot('Election ID: {eid}'), italic=True),
+]).generate()])
+_VOTE_CONFIRMATION = Template([GenRT([
+    GenRTSectionText('Thank you for voting in the election of '),
+    GenRTSectionUser(Slot('electee_uid')),
+    GenRTSectionText(TextSlot(' for {position}.\r\nYour vote: ')),
+    GenRTSectionText(Slot('vote'), bold=True),
+    GenRTSectionText(TextSlot('\r\nYour confirmation code: {confirmation}\r\n')),
+    GenRTSectionText(TextSlot('Election ID: {eid}'), italic=True),
+]).generate()])
+
+
+def max_slate_size(num_voters: int) -> int:
+    """
+    :param num_voters: the number of allowed voters of a slate
+    :return: the most elections a slate announces in one message, next to the blocks mentioning its allowed voters
+    """
+    mention_blocks = max(1, math.ceil(num_voters / MAX_MENTIONS_PER_BLOCK))
+    return (MAX_BLOCKS - mention_blocks) // 2
+
+
+# Elections of a slate in one message when its allowed voters are mentioned in a single block
+MAX_SLATE_SIZE = max_slate_size(0)
+
+
+@functools.lru_cache(maxsize=256)
+def _mentions(uids: tuple[str, ...]) -> list[list[dict]]:
+    # The elements mentioning each allowed voter, in chunks of one block each. Allowed voters never change over the
+    # life of an election, so these are generated once for all of its renders.
+    chunks = []
+    for start, stop in _mention_chunks(len(uids)):
+        chunk = []
+        for uid in uids[start:stop]:
+            chunk.append(GenRTSectionUser(uid).generate())
+            chunk.append(_SPACE_RTS_ELEMENT)
+        chunks.append(chunk)
+    return chunks
+
+
+def _mention_chunks(num_voters: int) -> list[tuple[int, int]]:
+    # Always at least one chunk, for the block holding the head of the message
+    return [(start, min(num_voters, start + MAX_MENTIONS_PER_BLOCK))
+            for start in range(0, max(1, num_voters), MAX_MENTIONS_PER_BLOCK)]
+
+
+def _with_mentions(head: Template, values: dict, election_: models.Election, tail: list[dict]) -> list[dict]:
+    # The head block mentions the first allowed voters, further blocks the rest of them, and the last one the tail
+    chunks = _mentions(tuple(election_.allowed_voter_uids))
+    blocks = [head.render(**values, mentions=chunks[0], tail=tail if len(chunks) == 1 else [])]
+    for i, chunk in enumerate(chunks[1:], 2):
+        blocks.append(_MENTIONS.render(mentions=chunk, tail=tail if i == len(chunks) else []))
+    return blocks
+
+
+def _reporting_bar(result: models.ElectionResult, width: int = 20) -> str:
+    filled = width * result.reporting_pct // 100
+    return '\u2588' * filled + '\u2591' * (width - filled)
+
+
+def _rts_reporting(result: models.ElectionResult) -> dict:
+    return _REPORTING.render(bar=_reporting_bar(result), reporting_pct=result.reporting_pct,
+                             reporting_voters=result.reporting_voters, num_voters=result.num_voters)
+
+
+def _rts_deadline(election_: models.Election) -> list[dict]:
+    if election_.deadline is None:
+        return []
+    return _DEADLINE.render(timestamp=int(election_.deadline))
+
+
+def _vote_buttons(election_: models.Election) -> dict:
+    return _VOTE_BUTTONS.render(yes_action_id=util.button_action_id(election_.eid, True),
+                                no_action_id=util.button_action_id(election_.eid, False))
+
+
+def election(election_: models.Election, result: models.ElectionResult = None) -> list[dict]:
     """
     Generate Slack API blocks for the announcement of a single election
 
     Message displayed:
         > **ELECTION**
         > Do you confirm [ELECTEE] for the position of [POSITION]?
-        > Allowed voters: [ALLOWED_VOTERS...]
+        > Allowed voters: [ALLOWED_VOTERS...] (continued in further blocks past MAX_MENTIONS_PER_BLOCK)
+        > Voting closes [DEADLINE] (if the election has a deadline)
+        > [REPORTING_BAR] [REPORTING_PCT]% reporting ([REPORTING_VOTERS]/[NUM_VOTERS] votes in)
         > __Election ID: [ELECTION_ID]__
         > [YES_BUTTON] [NO_BUTTON]
 
     :param election_: the election to announce
+    :param result: the current result of the election to report, or None if no votes have been cast yet
+    :return: the resulting Slack API compliant blocks
+    """
+    result = result or models.ElectionResult(election_, 0, 0)
+    tail = [*_rts_deadline(election_), _rts_reporting(result), _ELECTION_ID.render(eid=election_.eid)]
+    blocks = _with_mentions(_ELECTION_HEAD, {'electee_uid': election_.electee_uid, 'position': election_.position},
+                            election_, tail)
+    blocks.append(_vote_buttons(election_))
+    return blocks
+
+
+def slate(elections: list[models.Election], results: list[models.ElectionResult] = None) -> list[dict]:
+    """
+    Generate Slack API blocks for the announcement of several elections sharing their allowed voters
+
+    Message displayed:
+        > **ELECTIONS**
+        > Allowed voters: [ALLOWED_VOTERS...] (continued in further blocks past MAX_MENTIONS_PER_BLOCK)
+        > Voting closes [DEADLINE] (if the elections have a deadline)
+        then for each election:
+        > Do you confirm [ELECTEE] for the position of [POSITION]?
+        > [REPORTING_BAR] [REPORTING_PCT]% reporting ([REPORTING_VOTERS]/[NUM_VOTERS] votes in)
+        > __Election ID: [ELECTION_ID]__
+        > [YES_BUTTON] [NO_BUTTON]
+
+    :param elections: the elections to announce, at most max_slate_size() of their number of allowed voters
+    :param results: the current result of each election to report, or None if no votes have been cast yet
     :return: the resulting Slack API compliant blocks
     """
-    rt_sections = [
-        GenRTSectionText('ELECTION\r\n', bold=True),
-        GenRTSectionText('Do you confirm '),
-        GenRTSectionUser(election_.electee_uid),
-        GenRTSectionText(f' for the position of {election_.position}?\r\nAllowed voters: '),
-    ]
-    rt_sections.extend(_rts_users(election_))
-    rt_sections.append(GenRTSectionText(f'\r\nElection ID: {election_.eid}', italic=True))
-    buttons = [
-        GenActionButton('Yes', util.button_action_id(election_.eid, True), False),
-        GenActionButton('No', util.button_action_id(election_.eid, False), True)
-    ]
-    return [
-        GenRT(rt_sections).generate(),
-        GenActions(buttons).generate()
-    ]
+    results = results or [models.ElectionResult(e, 0, 0) for e in elections]
+    blocks = _with_mentions(_SLATE_HEAD, {}, elections[0], _rts_deadline(elections[0]))
+    for election_, result in zip(elections, results):
+        blocks.append(_SLATE_ELECTION.render(electee_uid=election_.electee_uid, position=election_.position,
+                                             reporting=_rts_reporting(result),
+                                             election_id=_ELECTION_ID.render(eid=election_.eid)))
+        blocks.append(_vote_buttons(election_))
+    return blocks
 
 
 def election_result(result: models.ElectionResult) -> list[dict]:
@@ -151,20 +399,20 @@ def election_result(result: models.ElectionResult) -> list[dict]:
     :return: the resulting Slack API compliant blocks
     """
     threshold_pct = int(result.election.threshold_pct)
-    threshold_voters = max(1, int(threshold_pct / 100 * result.num_voters))
-    rt_sections = [
-        GenRTSectionText('ELECTION RESULT\r\n', bold=True),
-        GenRTSectionText('The election of '),
-        GenRTSectionUser(result.election.electee_uid),
-        GenRTSectionText(f' for {result.election.position} has concluded!\r\nThe final vote '),
-        GenRTSectionText('PASSED' if result.is_passed else 'FAILED', bold=True),
-        GenRTSectionText(f' with a vote of {result.num_yes} yes to {result.num_no} no ({result.vote_pct}%).\r\n'
-                         f'The threshold for this election was {threshold_pct}% of {result.num_voters} '
-                         f'allowed voters ({threshold_voters}).\r\nReporting percentage was {result.reporting_pct}% '
-                         f'({result.reporting_voters}/{result.num_voters}).\r\n'),
-        GenRTSectionText(f'Election ID: {result.election.eid}', italic=True)
-    ]
-    return [GenRT(rt_sections).generate()]
+    return _ELECTION_RESULT.render(
+        electee_uid=result.election.electee_uid,
+        position=result.election.position,
+        outcome='PASSED' if result.is_passed else 'FAILED',
+        num_yes=result.num_yes,
+        num_no=result.num_no,
+        vote_pct=result.vote_pct,
+        threshold_pct=threshold_pct,
+        num_voters=result.num_voters,
+        threshold_voters=max(1, int(threshold_pct / 100 * result.num_voters)),
+        reporting_pct=result.reporting_pct,
+        reporting_voters=result.reporting_voters,
+        eid=result.election.eid,
+    )
 
 
 def vote_confirmation(election_: models.Election, vote: models.Vote) -> list[dict]:
@@ -181,12 +429,39 @@ def vote_confirmation(election_: models.Election, vote: models.Vote) -> list[dic
     :param vote: the Vote that was submitted to the passed Election
     :return: the resulting Slack API compliant blocks
     """
-    rt_sections = [
-        GenRTSectionText('Thank you for voting in the election of '),
-        GenRTSectionUser(election_.electee_uid),
-        GenRTSectionText(f' for {election_.position}.\r\nYour vote: '),
-        GenRTSectionText('yes' if vote.is_yes else 'no', bold=True),
-        GenRTSectionText(f'\r\nYour confirmation code: {vote.confirmation}\r\n'),
-        GenRTSectionText(f'Election ID: {election_.eid}', italic=True)
-    ]
-    return [GenRT(rt_sections).generate()]
+    return _VOTE_CONFIRMATION.render(electee_uid=election_.electee_uid, position=election_.position,
+                                     vote='yes' if vote.is_yes else 'no', confirmation=vote.confirmation,
+                                     eid=election_.eid)
+
+
+def election_status(result: models.ElectionResult) -> str:
+    """
+    Generate the text of the current status of an election, as shown to its creator by /vote-check.
+
+    :param result: the current result of the election
+    :return: the resulting text
+    """
+    return f'The current status of the election with election ID {result.election.eid} is ' \
+           f'{result.num_yes} yes to {result.num_no} no ({result.vote_pct}%).' \
+           f'\r\nReporting percentage was {result.reporting_pct}% ' \
+           f'({result.reporting_voters}/{result.num_voters}).'
+
+
+def help_text(commands: list[tuple[str, str]]) -> str:
+    """
+    Generate the text of /vote-help.
+
+    :param commands: the name and description of every command
+    :return: the resulting text
+    """
+    cmds_str = '\n'.join([f'{n}: {d}' for n, d in commands])
+    return '*votebot*\n\n' \
+           'A slack bot that manages elections.\n\n' \
+           '*All commands:*\n' \
+           f'{cmds_str}\n\n' \
+           '*Quickstart:*\n' \
+           '1. Create an election (/vote-create).\n' \
+           '2. Allowed voters click one of the voting buttons in the created message.\n' \
+           '3. Voters will get a DM confirming their vote, and can re-confirm at any time (/vote-confirm). \n' \
+           '4. Once the election has finished, a message will be send by votebot with the final vote.\n' \
+           'The creator of the election may check the vote count at any time (/vote-check). \n'
@@ -0,0 +1,299 @@
+import array
+import itertools
+import struct
+import sys
+
+# Compact binary encoding of JSON-like values (None, bools, ints, floats, strings, lists and dicts with string keys).
+#
+# An encoded value starts with MAGIC, followed by a table of every distinct string it holds, and then the value
+# itself, in which strings are only referred to by their index in the table. Voter IDs, eids and the keys of every
+# record are so stored once per file, however many votes and elections repeat them. Lengths, counts and ints are
+# varints; negative ints are zigzag encoded first.
+#
+# Lists and dicts of records, i.e. of dicts sharing the same keys (such as the tables of the storage backends), are
+# stored column by column, with the keys once. Columns (and lists) of strings are arrays of 32-bit indexes, columns
+# of bools arrays of bytes, and the string table UTF-8 strings separated by a byte UTF-8 never holds, all of which
+# are decoded without a Python call per value: decoding a database is then about as fast as json.loads(), rather
+# than several times slower.
+MAGIC = b'VBC\x02'
+# Values encoded before records were stored by column, with a table of varint length prefixed strings, are still read
+_MAGIC_V1 = b'VBC\x01'
+_SEPARATOR = b'\xff'
+
+_NONE = 0
+_FALSE = 1
+_TRUE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+_LIST = 6
+_DICT = 7
+_STRS = 8
+_RECORD_LIST = 9
+_RECORD_DICT = 10
+
+# Column types
+_ANY = 0
+_STR_COLUMN = 1
+_BOOL_COLUMN = 2
+
+_DOUBLE = struct.Struct('<d')
+# Typecode of the unsigned 32-bit ints of string index arrays, which are little-endian once encoded
+_INDEX = next(code for code in 'IL' if array.array(code).itemsize == 4)
+
+
+def is_encoded(data: bytes) -> bool:
+    """:return: whether the data was encoded by dumps(), as opposed to being JSON"""
+    return data[:len(MAGIC)] in (MAGIC, _MAGIC_V1)
+
+
+def dumps(value) -> bytes:
+    """
+    :param value: a value that json.dumps() could serialize, whose dicts only have string keys
+    :return: the value encoded
+    """
+    strings: dict[str, int] = {}
+    body = bytearray()
+    _encode(value, body, strings)
+    table = _SEPARATOR.join(string.encode('utf-8') for string in strings)
+    encoded = bytearray(MAGIC)
+    _write_varint(encoded, len(strings))
+    _write_varint(encoded, len(table))
+    encoded += table
+    encoded += body
+    return bytes(encoded)
+
+
+def loads(data: bytes):
+    """
+    :param data: a value encoded by dumps()
+    :return: the value decoded, with lists and dicts as json.loads() would return them
+    """
+    if not is_encoded(data):
+        raise ValueError('Not an encoded value')
+    count, pos = _read_varint(data, len(MAGIC))
+    if data[:len(MAGIC)] == MAGIC:
+        size, pos = _read_varint(data, pos)
+        strings = list(map(bytes.decode, data[pos:pos + size].split(_SEPARATOR))) if count else []
+        if len(strings) != count:
+            raise ValueError(f'{len(strings)} strings in a table of {count}')
+        pos += size
+    else:
+        strings = []
+        for _ in range(count):
+            size, pos = _read_varint(data, pos)
+            strings.append(data[pos:pos + size].decode('utf-8'))
+            pos += size
+    value, pos = _decode(data, pos, strings)
+    if pos != len(data):
+        raise ValueError(f'{len(data) - pos} trailing bytes after the encoded value')
+    return value
+
+
+def _encode(value, out: bytearray, strings: dict[str, int]) -> None:
+    # bool before int, since bools are ints
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, str):
+        out.append(_STR)
+        _write_varint(out, _intern(value, strings))
+    elif isinstance(value, dict):
+        for key in value:
+            if not isinstance(key, str):
+                raise TypeError(f'Keys must be strings, not {type(key).__name__}')
+        fields = _record_fields(value.values())
+        if fields is not None:
+            out.append(_RECORD_DICT)
+            _write_varint(out, len(value))
+            _write_indexes(out, value, strings)
+            _encode_records(list(value.values()), fields, out, strings)
+            return
+        out.append(_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _write_varint(out, _intern(key, strings))
+            _encode(item, out, strings)
+    elif isinstance(value, (list, tuple)):
+        fields = _record_fields(value)
+        if fields is not None:
+            out.append(_RECORD_LIST)
+            _write_varint(out, len(value))
+            _encode_records(value, fields, out, strings)
+        elif value and all(type(item) is str for item in value):
+            out.append(_STRS)
+            _write_varint(out, len(value))
+            _write_indexes(out, value, strings)
+        else:
+            out.append(_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                _encode(item, out, strings)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(value)
+    else:
+        raise TypeError(f'Cannot encode {type(value).__name__}')
+
+
+def _record_fields(values) -> tuple[str, ...] | None:
+    # The keys shared by every value, if they are at least two dicts with the same keys, in the same order, of which
+    # there is at least one (as the records are zipped from their columns)
+    values = iter(values)
+    first = next(values, None)
+    if type(first) is not dict:
+        return None
+    fields = tuple(first)
+    if not all(isinstance(field, str) for field in fields):
+        # Left to be rejected when encoded as a dict
+        return None
+    count = 1
+    for value in values:
+        if type(value) is not dict or len(value) != len(fields) or tuple(value) != fields:
+            return None
+        count += 1
+    return fields if count > 1 and fields else None
+
+
+def _encode_records(records: list[dict], fields: tuple[str, ...], out: bytearray, strings: dict[str, int]) -> None:
+    _write_varint(out, len(fields))
+    for field in fields:
+        _write_varint(out, _intern(field, strings))
+    for field in fields:
+        column = [record[field] for record in records]
+        if all(type(item) is str for item in column):
+            out.append(_STR_COLUMN)
+            _write_indexes(out, column, strings)
+        elif all(type(item) is bool for item in column):
+            out.append(_BOOL_COLUMN)
+            out += bytes(column)
+        else:
+            out.append(_ANY)
+            for item in column:
+                _encode(item, out, strings)
+
+
+def _write_indexes(out: bytearray, items, strings: dict[str, int]) -> None:
+    indexes = array.array(_INDEX, [_intern(item, strings) for item in items])
+    if sys.byteorder == 'big':
+        indexes.byteswap()
+    out += indexes.tobytes()
+
+
+def _decode(data: bytes, pos: int, strings: list[str]):
+    tag = data[pos]
+    pos += 1
+    if tag == _STR:
+        index, pos = _read_varint(data, pos)
+        return strings[index], pos
+    if tag == _RECORD_DICT:
+        count, pos = _read_varint(data, pos)
+        keys, pos = _read_strings(data, pos, count, strings)
+        records, pos = _decode_records(data, pos, count, strings)
+        return dict(zip(keys, records)), pos
+    if tag == _RECORD_LIST:
+        count, pos = _read_varint(data, pos)
+        return _decode_records(data, pos, count, strings)
+    if tag == _STRS:
+        count, pos = _read_varint(data, pos)
+        return _read_strings(data, pos, count, strings)
+    if tag == _DICT:
+        count, pos = _read_varint(data, pos)
+        value = {}
+        for _ in range(count):
+            index, pos = _read_varint(data, pos)
+            value[strings[index]], pos = _decode(data, pos, strings)
+        return value, pos
+    if tag == _LIST:
+        count, pos = _read_varint(data, pos)
+        value = []
+        for _ in range(count):
+            item, pos = _decode(data, pos, strings)
+            value.append(item)
+        return value, pos
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        zigzag, pos = _read_varint(data, pos)
+        return (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1), pos
+    if tag == _FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+    raise ValueError(f'Unknown tag {tag} at byte {pos - 1}')
+
+
+def _decode_records(data: bytes, pos: int, count: int, strings: list[str]) -> tuple[list[dict], int]:
+    num_fields, pos = _read_varint(data, pos)
+    fields = []
+    for _ in range(num_fields):
+        index, pos = _read_varint(data, pos)
+        fields.append(strings[index])
+    columns = []
+    for _ in fields:
+        column_type = data[pos]
+        pos += 1
+        if column_type == _STR_COLUMN:
+            column, pos = _read_strings(data, pos, count, strings)
+        elif column_type == _BOOL_COLUMN:
+            column = list(map(bool, data[pos:pos + count]))
+            pos += count
+        elif column_type == _ANY:
+            column = []
+            for _ in range(count):
+                item, pos = _decode(data, pos, strings)
+                column.append(item)
+        else:
+            raise ValueError(f'Unknown column type {column_type} at byte {pos - 1}')
+        columns.append(column)
+    # Zipped into dicts by builtins, rather than by a Python loop per record
+    return list(map(dict, map(zip, itertools.repeat(fields), zip(*columns)))), pos
+
+
+def _read_strings(data: bytes, pos: int, count: int, strings: list[str]) -> tuple[list[str], int]:
+    end = pos + 4 * count
+    indexes = array.array(_INDEX, data[pos:end])
+    if sys.byteorder == 'big':
+        indexes.byteswap()
+    return list(map(strings.__getitem__, indexes)), end
+
+
+def _intern(string: str, strings: dict[str, int]) -> int:
+    index = strings.get(string)
+    if index is None:
+        index = strings[string] = len(strings)
+    return index
+
+
+def _write_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    # Most varints are lengths, counts and string indexes below 128, which take a single byte
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    n, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+if __name__ == '__main__':
+    raise NotImplementedError('Not an entrypoint')
@@ -1,95 +1,813 @@
-import tinydb
+import collections
+import contextlib
+import os
+import socket
+import threading
+import zlib
+from typing import Callable, Iterator
 
+import archive
+import metrics
 import models
+import storage
 import util
 
 
-ELECTIONS_TABLE = "elections"
+FAN_OUTS_KIND = 'fan_outs'
+DELIVERIES_KIND = 'deliveries'
+DM_CHANNELS_KIND = 'dm_channels'
+JOBS_KIND = 'jobs'
+ELECTION_MESSAGES_KIND = 'election_messages'
+ARCHIVE_INDEX_KIND = 'archive_index'
+DEDUP_KIND = 'dedup'
+VOTER_STATS_KIND = 'voter_stats'
+POSITION_STATS_KIND = 'position_stats'
 
-database = tinydb.TinyDB('db.json', indent=4)
+DEFAULT_RESULT_CACHE_SIZE = 1024
 
+_storage: storage.Storage = None
+_archive: archive.Archive = None
+# Whether other instances share the storage, in which case the indexes below are refreshed from it where needed
+_shared = False
+# Names this instance as the owner of the leases it acquires
+instance_id = f'{socket.gethostname()}/{os.getpid()}/{util.random_id()}'
 
+# Votes are checked and cast under a per-election lock, striped so that different elections rarely contend
+_election_locks = [threading.RLock() for _ in range(64)]
+_fan_outs_lock = threading.Lock()
+_confirmations_lock = threading.Lock()
+
+# In-memory indexes in front of the storage backend, populated once by load().
+# Every mutation is written through to the backend, which is only read again on the next load().
+_elections: dict[str, models.Election] = {}
+_allowed_voters: dict[str, frozenset[str]] = {}
+_votes: dict[tuple[str, str], models.Vote] = {}
+_tallies: dict[str, models.Tally] = {}
+# Confirmation codes of the votes of open elections, to the eid and uid of their vote. Codes name their election, so
+# those of archived elections are looked up in its archive, except for codes issued before they did, which are kept
+# in the archive index.
+_confirmations: dict[str, tuple[str, str]] = {}
+_fan_outs: dict[str, models.FanOut] = {}
+_deliveries: dict[str, dict[str, models.Delivery]] = {}
+_dm_channels: dict[str, str] = {}
+_jobs: dict[str, models.Job] = {}
+_election_messages: dict[str, dict] = {}
+# Archive holding each archived election, by eid. Archived elections are only loaded from it on lookup.
+_archived: dict[str, str] = {}
+# Stats of every finished election, by voter and by position, added to as each election is archived
+_voter_stats: dict[str, models.VoterStats] = {}
+_position_stats: dict[str, models.PositionStats] = {}
+
+# Results served by get_election_result(), least recently used first, with the version of their election they were
+# computed at, or None if their election is finished and so its result final. Versions of open elections are bumped
+# by every vote counted in them, and by finishing them.
+_results: collections.OrderedDict[str, tuple[int | None, models.ElectionResult]] = collections.OrderedDict()
+_result_versions: dict[str, int] = {}
+_results_lock = threading.Lock()
+_results_max_size = DEFAULT_RESULT_CACHE_SIZE
+_result_hits = 0
+_result_misses = 0
+
+
+@metrics.timed('db')
+def load(storage_: storage.Storage = None, archive_: archive.Archive = None, shared: bool = None,
+         read_only: bool = False) -> None:
+    """
+    :param storage_: the storage backend to load from, by default the configured one
+    :param archive_: the archive of finished elections, by default the configured one
+    :param shared: whether other instances share the storage, by default whether the STORAGE_SHARED env var is set
+    :param read_only: whether to leave the storage and archive as they are, i.e. to only read them (as export.py
+                      does), rather than also repairing tallies, aggregating stats and archiving finished elections
+    """
+    global _storage, _archive, _shared, _results_max_size
+    if _storage is not None and _storage is not storage_:
+        _storage.close()
+    _storage = storage_ or storage.open_storage()
+    _archive = archive_ or archive.open_archive()
+    _shared = bool(os.environ.get('STORAGE_SHARED')) if shared is None else shared
+    if _shared and not _storage.SHAREABLE:
+        raise ValueError(f'{_storage.__class__.__name__} cannot be shared between instances')
+    _results_max_size = int(os.environ.get('RESULT_CACHE_SIZE') or DEFAULT_RESULT_CACHE_SIZE)
+    _elections.clear()
+    _allowed_voters.clear()
+    _votes.clear()
+    _tallies.clear()
+    _confirmations.clear()
+    _fan_outs.clear()
+    _deliveries.clear()
+    _dm_channels.clear()
+    _jobs.clear()
+    _election_messages.clear()
+    _archived.clear()
+    _voter_stats.clear()
+    _position_stats.clear()
+    with _results_lock:
+        _results.clear()
+        _result_versions.clear()
+    for record in _storage.load_elections():
+        _index_election(models.Election.from_dict(record))
+    for record in _storage.load_votes():
+        vote = models.Vote.from_dict(record)
+        _index_vote(vote)
+        _count_vote(vote)
+
+    # Persisted tallies are only trusted if they match the ones just rebuilt from the vote rows
+    persisted = {r['eid']: models.Tally.from_dict(r) for r in _storage.load_tallies()}
+    stale = [t for eid, t in _tallies.items() if persisted.get(eid) != t]
+    if stale and not read_only:
+        with _storage.transaction():
+            for tally in stale:
+                _storage.upsert_tally(tally.to_dict())
+
+    for record in _storage.load_records(FAN_OUTS_KIND).values():
+        fan_out = models.FanOut.from_dict(record)
+        _fan_outs[fan_out.fid] = fan_out
+    for record in _storage.load_records(DELIVERIES_KIND).values():
+        delivery = models.Delivery.from_dict(record)
+        _deliveries.setdefault(delivery.fid, {})[delivery.uid] = delivery
+    for key, record in _storage.load_records(DM_CHANNELS_KIND).items():
+        _dm_channels[key] = record['channel_id']
+    for record in _storage.load_records(JOBS_KIND).values():
+        job = models.Job.from_dict(record)
+        _jobs[job.jid] = job
+    _election_messages.update(_storage.load_records(ELECTION_MESSAGES_KIND))
+    unaggregated = {}
+    for eid, record in _storage.load_records(ARCHIVE_INDEX_KIND).items():
+        _index_archived(eid, record)
+        if not record.get('aggregated') and not read_only:
+            unaggregated[eid] = record
+    for record in _storage.load_records(VOTER_STATS_KIND).values():
+        stats = models.VoterStats.from_dict(record)
+        _voter_stats[stats.uid] = stats
+    for record in _storage.load_records(POSITION_STATS_KIND).values():
+        stats = models.PositionStats.from_dict(record)
+        _position_stats[stats.position] = stats
+
+    # Elections archived before their stats were aggregated, added to the stats once
+    for eid, record in unaggregated.items():
+        entry = _archived_entry(eid)
+        with _storage.transaction():
+            # Unless another instance sharing the storage added them since
+            if _shared and _storage.get_record(ARCHIVE_INDEX_KIND, eid).get('aggregated'):
+                continue
+            stats = [] if entry is None else _aggregate([(models.Election.from_dict(entry['election']),
+                                                          [models.Vote.from_dict(v) for v in entry['votes']])])
+            _storage.upsert_record(ARCHIVE_INDEX_KIND, eid, {**record, 'aggregated': True})
+        _index_stats(stats)
+    if unaggregated:
+        print(f'Aggregated the stats of {len(unaggregated)} archived elections')
+
+    # Finished elections left over from before archiving, or from a crash mid-archiving
+    finished = [] if read_only else [e for e in _elections.values() if e.finished]
+    if finished:
+        _archive_elections(finished)
+        print(f'Archived {len(finished)} finished elections')
+
+
+@metrics.timed('db')
 def create_election(election: models.Election) -> None:
-    elections = database.table(ELECTIONS_TABLE)
-    elections.insert(election.to_dict())
-    database.table(get_votes_table_name(election.eid))
+    create_elections([election])
+
+
+@metrics.timed('db')
+def create_elections(elections: list[models.Election]) -> None:
+    tallies = [models.Tally(e.eid, 0, 0, 0) for e in elections]
+    with _storage.transaction():
+        for election, tally in zip(elections, tallies):
+            _storage.insert_election(election.to_dict())
+            _storage.upsert_tally(tally.to_dict())
+    for election, tally in zip(elections, tallies):
+        _index_election(election)
+        _tallies[election.eid] = tally
 
+
+@metrics.timed('db')
 def get_election_result(eid: str, requestor_uid: str = None) -> models.ElectionResult:
-    elections_table = database.table(ELECTIONS_TABLE)
-    election_matches = elections_table.search(tinydb.Query().eid == eid)
-    if len(election_matches) != 1:
+    """
+    :param eid: the election to get the current result of
+    :param requestor_uid: the user asking for the result, who must have created the election, or None if asked
+                          for by the bot itself
+    :return: the result, only computed again if votes were counted in the election since it was last asked for
+    """
+    _sync_election(eid)
+    result = _cached_result(eid)
+    if result is None:
         return models.ShortCircuitElectionResult()
-    election = models.Election.from_dict(election_matches[0])
     if requestor_uid is not None:
-        if requestor_uid != election.creator_uid:
+        if requestor_uid != result.election.creator_uid:
             return models.InvalidPermissionsElectionResult()
-    elif election.finished:
+    elif result.election.finished:
         # Return immediately if election was previously finished
         # Do not immediately return if checking vote (requestor UID passed)
         return models.ShortCircuitElectionResult()
+    return result
 
-    # If election not previously finished, calculate if it is now
-    votes_table = database.table(get_votes_table_name(eid))
-    vote_matches = votes_table.search(tinydb.Query().eid == eid)
-    num_yes = 0
-    num_no = 0
-    for m in vote_matches:
-        v = models.Vote.from_dict(m)
-        if v.is_yes:
-            num_yes += 1
-        else:
-            num_no += 1
-    return models.ElectionResult(election, num_yes, num_no)
+
+@metrics.timed('db')
+def get_tally(eid: str) -> models.Tally | None:
+    _sync_election(eid)
+    return _get_tally(eid)
 
 
-def mark_election_finished(election: models.Election) -> None:
-    election.finished = True
-    elections = database.table(ELECTIONS_TABLE)
-    elections.upsert(election.to_dict(), tinydb.Query().eid == election.eid)
-    database.table(get_votes_table_name(election.eid))
+@metrics.timed('db')
+def close_election(eid: str, jobs: Callable[[models.ElectionResult], list[models.Job]] = None
+                   ) -> models.ElectionResult | None:
+    """
+    Finish an open election, whether it was decided by its votes or reached its deadline.
 
+    :param eid: the election to finish
+    :param jobs: called with the final result for jobs to persist in the same transaction as finishing the election,
+                 e.g. to announce the result, if this caller is the one finishing it
+    :return: the final result of the election, or None if it was already finished, so that only one of several
+             concurrent callers announces the result
+    """
+    with _election_lock(eid), _coordinated():
+        _sync_election(eid)
+        election = _elections.get(eid)
+        if election is None or election.finished:
+            return None
+        tally = _tallies[eid]
+        result = models.ElectionResult(election, tally.num_yes, tally.num_no)
+        result_jobs = []
+        with _storage.transaction():
+            # Only decided by the storage, which also orders callers in other instances sharing it
+            if not _storage.finish_election(eid):
+                return None
+            if jobs is not None:
+                result_jobs = jobs(result)
+                _put_jobs(result_jobs)
+        _index_jobs(result_jobs)
+        election.finished = True
+        _index_election(election)
+        _freeze_result(result)
+        # Finished in storage before archiving, so that an election archived but not yet deleted by a crash is
+        # archived again by the next load()
+        _archive_elections([election])
+        return result
+
+
+@metrics.timed('db')
+def get_election(eid: str) -> models.Election | None:
+    _sync_election(eid)
+    return _get_election(eid)
+
+
+@metrics.timed('db')
+def is_election_open(eid: str) -> bool:
+    election = _elections.get(eid)
+    return election is not None and not election.finished
+
+
+@metrics.timed('db')
 def list_open_elections() -> list[models.Election]:
-    elections_table = database.table(ELECTIONS_TABLE)
-    return [models.Election.from_dict(v) for v in elections_table.search(tinydb.Query().finished == False)]
+    return [e for e in _elections.values() if not e.finished]
 
 
+@metrics.timed('db')
 def list_elections() -> list[models.Election]:
-    elections_table = database.table(ELECTIONS_TABLE)
-    return [models.Election.from_dict(v) for v in elections_table.all()]
+    return list(_elections.values())
+
+
+def iter_elections() -> Iterator[tuple[models.Election, models.Tally]]:
+    """
+    :return: every election, open ones first, then archived ones one month of the archive at a time, each with its
+             tally. Only one month is held in memory at once, besides the open elections. If other instances share
+             the storage, the elections are read from it, including any they created or archived.
+    """
+    if _shared:
+        tallies = {r['eid']: models.Tally.from_dict(r) for r in _storage.load_tallies()}
+        for record in _storage.load_elections():
+            eid = record['eid']
+            yield models.Election.from_dict(record), tallies.get(eid) or models.Tally(eid, 0, 0, 0)
+        archived = {eid: r['archive'] for eid, r in _storage.load_records(ARCHIVE_INDEX_KIND).items()}
+    else:
+        for election in list(_elections.values()):
+            tally = _tallies.get(election.eid)
+            if tally is not None:
+                yield election, tally
+        archived = dict(_archived)
+    by_archive: dict[str, list[str]] = {}
+    for eid, name in archived.items():
+        by_archive.setdefault(name, []).append(eid)
+    for name in sorted(by_archive):
+        entries = _archive.load(name)
+        for eid in by_archive[name]:
+            entry = entries.get(eid)
+            if entry is not None:
+                yield models.Election.from_dict(entry['election']), models.Tally.from_dict(entry['tally'])
 
 
+@metrics.timed('db')
+def list_voter_stats() -> list[models.VoterStats]:
+    if _shared:
+        return [models.VoterStats.from_dict(r) for r in _storage.load_records(VOTER_STATS_KIND).values()]
+    return list(_voter_stats.values())
+
+
+@metrics.timed('db')
+def list_position_stats() -> list[models.PositionStats]:
+    if _shared:
+        return [models.PositionStats.from_dict(r) for r in _storage.load_records(POSITION_STATS_KIND).values()]
+    return list(_position_stats.values())
+
+
+@metrics.timed('db')
 def is_user_allowed_voter(eid: str, uid: str) -> bool:
-    elections_table = database.table(ELECTIONS_TABLE)
-    election_matches = elections_table.search(tinydb.Query().eid == eid)
-    if len(election_matches) != 1:
-        return False
-    election = models.Election.from_dict(election_matches[0])
-    if uid not in election.allowed_voter_uids:
-        return False
-    return True
+    return uid in _allowed_voters.get(eid, frozenset())
 
 
+@metrics.timed('db')
 def has_user_voted(eid: str, uid: str) -> bool:
-    votes_table = database.table(get_votes_table_name(eid))
-    vote_matches = votes_table.search(tinydb.Query().uid == uid)
-    return len(vote_matches) != 0
+    return (eid, uid) in _votes
 
 
-def add_vote(eid: str, uid: str, is_yes: bool) -> models.Vote:
-    votes_table = database.table(get_votes_table_name(eid))
-    vote = models.Vote(uid, eid, is_yes, util.random_id())
-    votes_table.insert(vote.to_dict())
+@metrics.timed('db')
+def get_vote(eid: str, uid: str) -> models.Vote | None:
+    vote = _votes.get((eid, uid))
+    if vote is None and _shared:
+        _sync_election(eid)
+        vote = _votes.get((eid, uid))
+    if vote is None:
+        entry = _archived_entry(eid)
+        record = entry and next((v for v in entry['votes'] if v['uid'] == uid), None)
+        vote = record and models.Vote.from_dict(record)
     return vote
 
 
-def is_vote_valid(eid: str, confirmation: str) -> bool:
-    votes_table = database.table(get_votes_table_name(eid))
-    matches = votes_table.search(tinydb.Query().confirmation == confirmation and tinydb.Query().eid == eid)
-    return len(matches) == 1
+@metrics.timed('db')
+def add_vote(eid: str, uid: str, is_yes: bool, jobs: list[models.Job] = ()) -> models.Vote:
+    """
+    :param jobs: jobs to persist in the same transaction as the vote, e.g. to confirm it
+    """
+    vote = models.Vote(uid, eid, is_yes, _reserve_confirmation(eid, uid))
+    old_tally = _tallies[eid]
+    tally = models.Tally(eid, old_tally.num_yes, old_tally.num_no, old_tally.checksum)
+    _count_vote(vote, tally)
+    try:
+        with _storage.transaction():
+            _storage.insert_vote(vote.to_dict())
+            _storage.upsert_tally(tally.to_dict())
+            _put_jobs(jobs)
+    except Exception:
+        _confirmations.pop(vote.confirmation, None)
+        raise
+    _index_jobs(jobs)
+    _index_vote(vote)
+    _tallies[eid] = tally
+    _invalidate_result(eid)
+    return vote
+
+
+@metrics.timed('db')
+def cast_vote(eid: str, uid: str, is_yes: bool, jobs: list[models.Job] = ()) -> models.CastVoteResult:
+    """
+    :param jobs: jobs to persist in the same transaction as the vote if it is cast, and not otherwise
+    """
+    with _election_lock(eid), _coordinated():
+        _sync_election(eid)
+        election = _elections.get(eid)
+        if eid in _archived:
+            return models.ElectionFinishedCastVoteResult()
+        elif election is None:
+            return models.NonAllowedVoterCastVoteResult()
+        elif election.finished or election.is_past_deadline() or _election_result(eid).is_finished:
+            return models.ElectionFinishedCastVoteResult()
+        elif not is_user_allowed_voter(eid, uid):
+            return models.NonAllowedVoterCastVoteResult()
+        elif has_user_voted(eid, uid):
+            return models.AlreadyVotedCastVoteResult()
+        vote = add_vote(eid, uid, is_yes, jobs)
+        return models.CastVoteResult(vote, _election_result(eid))
+
+
+@metrics.timed('db')
+def is_vote_valid(eid: str | None, confirmation: str) -> bool:
+    # Any election will do if eid is None, as confirmation codes are unique across elections
+    ref = _confirmations.get(confirmation)
+    owner = util.confirmation_eid(confirmation) or eid
+    if ref is None and owner is not None:
+        # The vote may have been cast in another instance, or its election archived
+        _sync_election(owner)
+        ref = _confirmations.get(confirmation)
+        entry = None if ref is not None else _archived_entry(owner)
+        vote = entry and next((v for v in entry['votes'] if v['confirmation'] == confirmation), None)
+        if vote is not None:
+            ref = owner, vote['uid']
+    elif ref is None and _shared:
+        # The vote may have been cast in another instance, in an election open or archived since
+        vote = _storage.find_vote(confirmation)
+        if vote is not None:
+            _sync_election(vote['eid'])
+        else:
+            for archived_eid, record in _storage.load_records(ARCHIVE_INDEX_KIND).items():
+                _index_archived(archived_eid, record)
+        ref = _confirmations.get(confirmation)
+    return ref is not None and (eid is None or ref[0] == eid)
+
+
+@metrics.timed('db')
+def set_election_message(eid: str, channel_id: str, ts: str) -> None:
+    message = {'channel_id': channel_id, 'ts': ts}
+    _storage.upsert_record(ELECTION_MESSAGES_KIND, eid, message)
+    _election_messages[eid] = message
+
+
+@metrics.timed('db')
+def set_slate_message(eids: list[str], channel_id: str, ts: str) -> None:
+    # The message of every election of a slate is the same one, which lists all of them
+    message = {'channel_id': channel_id, 'ts': ts, 'eids': eids}
+    with _storage.transaction():
+        for eid in eids:
+            _storage.upsert_record(ELECTION_MESSAGES_KIND, eid, message)
+    for eid in eids:
+        _election_messages[eid] = message
+
+
+@metrics.timed('db')
+def get_election_message(eid: str) -> dict | None:
+    message = _election_messages.get(eid)
+    if message is None and _shared:
+        message = _storage.get_record(ELECTION_MESSAGES_KIND, eid)
+        if message is not None:
+            _election_messages[eid] = message
+    return message
+
+
+@metrics.timed('db')
+def create_fan_out(fid: str, text: str, uids: list[str]) -> models.FanOut:
+    with _fan_outs_lock:
+        if fid not in _fan_outs and _shared:
+            # Started by another instance, whose job running it was taken over by this one
+            record = _storage.get_record(FAN_OUTS_KIND, fid)
+            if record is not None:
+                _fan_outs[fid] = models.FanOut.from_dict(record)
+                _deliveries[fid] = {d.uid: d for d in map(models.Delivery.from_dict,
+                                                          _storage.load_records(DELIVERIES_KIND).values())
+                                    if d.fid == fid}
+        if fid in _fan_outs:
+            return _fan_outs[fid]
+        fan_out = models.FanOut(fid, text, list(dict.fromkeys(uids)), False)
+        deliveries = {uid: models.Delivery(fid, uid, models.Delivery.PENDING, 0) for uid in fan_out.uids}
+        with _storage.transaction():
+            _storage.upsert_record(FAN_OUTS_KIND, fid, fan_out.to_dict())
+            for delivery in deliveries.values():
+                _storage.upsert_record(DELIVERIES_KIND, _delivery_key(delivery), delivery.to_dict())
+        _fan_outs[fid] = fan_out
+        _deliveries[fid] = deliveries
+        return fan_out
+
+
+@metrics.timed('db')
+def list_deliveries(fid: str) -> list[models.Delivery]:
+    return list(_deliveries.get(fid, {}).values())
+
+
+@metrics.timed('db')
+def update_delivery(delivery: models.Delivery) -> None:
+    _storage.upsert_record(DELIVERIES_KIND, _delivery_key(delivery), delivery.to_dict())
+    _deliveries.setdefault(delivery.fid, {})[delivery.uid] = delivery
+
+
+@metrics.timed('db')
+def mark_fan_out_finished(fan_out: models.FanOut) -> None:
+    fan_out.finished = True
+    _storage.upsert_record(FAN_OUTS_KIND, fan_out.fid, fan_out.to_dict())
+    _fan_outs[fan_out.fid] = fan_out
+
+
+@metrics.timed('db')
+def get_dm_channel(key: str) -> str | None:
+    return _dm_channels.get(key)
+
+
+@metrics.timed('db')
+def set_dm_channel(key: str, channel_id: str) -> None:
+    _storage.upsert_record(DM_CHANNELS_KIND, key, {'channel_id': channel_id})
+    _dm_channels[key] = channel_id
+
+
+@metrics.timed('db')
+def remove_dm_channel(key: str) -> None:
+    if _dm_channels.pop(key, None) is not None:
+        _storage.delete_record(DM_CHANNELS_KIND, key)
+
+
+@metrics.timed('db')
+def put_job(job: models.Job) -> None:
+    _storage.upsert_record(JOBS_KIND, job.jid, job.to_dict())
+    _jobs[job.jid] = job
+
+
+@metrics.timed('db')
+def remove_job(job: models.Job) -> None:
+    _storage.delete_record(JOBS_KIND, job.jid)
+    _jobs.pop(job.jid, None)
+
+
+@metrics.timed('db')
+def list_pending_jobs() -> list[models.Job]:
+    if _shared:
+        # Including the ones enqueued by other instances, which are run by whichever instance leases them
+        _jobs.clear()
+        _jobs.update((jid, models.Job.from_dict(r)) for jid, r in _storage.load_records(JOBS_KIND).items())
+    return sorted((j for j in _jobs.values() if j.state == models.Job.PENDING), key=lambda j: j.seq)
+
+
+@metrics.timed('db')
+def refresh_job(job: models.Job) -> models.Job | None:
+    """
+    :return: the job as it is now stored, which differs from the given one if another instance has run it,
+             or None if it has since succeeded
+    """
+    if not _shared:
+        return job
+    record = _storage.get_record(JOBS_KIND, job.jid)
+    if record is None:
+        _jobs.pop(job.jid, None)
+        return None
+    job = _jobs[job.jid] = models.Job.from_dict(record)
+    return job
+
+
+def is_shared() -> bool:
+    return _shared
+
+
+@metrics.timed('db')
+def acquire_lease(name: str, duration: float) -> bool:
+    return _storage.acquire_lease(name, instance_id, duration)
+
+
+@metrics.timed('db')
+def release_lease(name: str) -> None:
+    _storage.release_lease(name, instance_id)
+
+
+def result_cache_stats() -> dict[str, int]:
+    with _results_lock:
+        return {'hits': _result_hits, 'misses': _result_misses, 'size': len(_results)}
+
+
+@metrics.timed('db')
+def load_dedup_keys() -> dict[str, float]:
+    # Only read once on startup by dedup.py, which keeps its own index
+    return {key: record['expires'] for key, record in _storage.load_records(DEDUP_KIND).items()}
+
+
+@metrics.timed('db')
+def update_dedup_keys(added: dict[str, float], removed: list[str]) -> None:
+    with _storage.transaction():
+        for key, expires in added.items():
+            _storage.upsert_record(DEDUP_KIND, key, {'expires': expires})
+        for key in removed:
+            _storage.delete_record(DEDUP_KIND, key)
+
+
+def _election_result(eid: str) -> models.ElectionResult:
+    election = _get_election(eid)
+    if election is None or election.finished:
+        return models.ShortCircuitElectionResult()
+
+    # If election not previously finished, calculate if it is now
+    tally = _get_tally(eid)
+    return models.ElectionResult(election, tally.num_yes, tally.num_no)
+
+
+def _cached_result(eid: str) -> models.ElectionResult | None:
+    global _result_hits, _result_misses
+    with _results_lock:
+        # Read before computing, so that a vote counted meanwhile leaves the result computed out of date
+        version = _result_versions.get(eid, 0)
+        cached = _results.get(eid)
+        if cached is not None and cached[0] in (None, version):
+            _results.move_to_end(eid)
+            _result_hits += 1
+            return cached[1]
+        _result_misses += 1
+    election = _get_election(eid)
+    if election is None:
+        return None
+    tally = _get_tally(eid)
+    result = models.ElectionResult(election, tally.num_yes, tally.num_no)
+    _cache_result(eid, None if election.finished else version, result)
+    return result
+
+
+def _cache_result(eid: str, version: int | None, result: models.ElectionResult) -> None:
+    with _results_lock:
+        # A final result is never replaced by one computed while its election was being finished
+        if version is not None and _results.get(eid, (version,))[0] is None:
+            return
+        _results[eid] = (version, result)
+        _results.move_to_end(eid)
+        while len(_results) > _results_max_size:
+            _results.popitem(last=False)
+
+
+def _freeze_result(result: models.ElectionResult) -> None:
+    # Versions are only kept for open elections, as a finished one's result never changes again
+    with _results_lock:
+        _result_versions.pop(result.election.eid, None)
+    _cache_result(result.election.eid, None, result)
+
+
+def _invalidate_result(eid: str) -> None:
+    with _results_lock:
+        _result_versions[eid] = _result_versions.get(eid, 0) + 1
+
+
+def _get_tally(eid: str) -> models.Tally | None:
+    tally = _tallies.get(eid)
+    if tally is None:
+        entry = _archived_entry(eid)
+        tally = entry and models.Tally.from_dict(entry['tally'])
+    return tally
+
+
+def _get_election(eid: str) -> models.Election | None:
+    election = _elections.get(eid)
+    if election is None:
+        entry = _archived_entry(eid)
+        election = entry and models.Election.from_dict(entry['election'])
+    return election
+
+
+def _archive_elections(elections: list[models.Election]) -> None:
+    # Into the current month's archive in one append, and out of the storage in one transaction, however many
+    name = _archive.current_name()
+    votes = {e.eid: [_votes[(e.eid, uid)] for uid in _allowed_voters[e.eid] if (e.eid, uid) in _votes]
+             for e in elections}
+    _archive.append(name, *({
+        'election': election.to_dict(),
+        'votes': [v.to_dict() for v in votes[election.eid]],
+        'tally': _tallies[election.eid].to_dict(),
+    } for election in elections))
+    records = {}
+    with _storage.transaction():
+        for election in elections:
+            _storage.delete_election(election.eid)
+            record = records[election.eid] = {'archive': name, 'aggregated': True}
+            # Codes issued before they named their election cannot be looked up in its archive without being given it
+            legacy = {v.confirmation: v.uid for v in votes[election.eid]
+                      if util.confirmation_eid(v.confirmation) is None}
+            if legacy:
+                record['confirmations'] = legacy
+            _storage.upsert_record(ARCHIVE_INDEX_KIND, election.eid, record)
+        stats = _aggregate([(election, votes[election.eid]) for election in elections])
+    for eid, record in records.items():
+        _archived[eid] = name
+        _unindex_election(eid)
+        _index_archived(eid, record)
+    _index_stats(stats)
+
+
+def _aggregate(elections: list[tuple[models.Election, list[models.Vote]]]) -> list[models.Model]:
+    # Add finished elections (with their votes) to the stats, returning the stats written, to be indexed once
+    # committed. Must be called in a transaction, in which the stats are read from the storage if shared, so that the
+    # additions of every instance sharing it add up.
+    voters: dict[str, models.VoterStats] = {}
+    positions: dict[str, models.PositionStats] = {}
+    for election, votes in elections:
+        is_yes = {v.uid: v.is_yes for v in votes}
+        num_yes = sum(is_yes.values())
+        for uid in election.allowed_voter_uids:
+            stats = (voters.get(uid) or _stats(models.VoterStats, VOTER_STATS_KIND, _voter_stats, uid)
+                     or models.VoterStats(uid, 0, 0, 0))
+            voted = uid in is_yes
+            voters[uid] = models.VoterStats(uid, stats.eligible + 1, stats.voted + voted,
+                                            stats.num_yes + (voted and is_yes[uid]))
+        stats = (positions.get(election.position)
+                 or _stats(models.PositionStats, POSITION_STATS_KIND, _position_stats, election.position)
+                 or models.PositionStats(election.position, 0, 0, 0, 0))
+        is_passed = models.ElectionResult(election, num_yes, len(is_yes) - num_yes).is_passed
+        positions[election.position] = models.PositionStats(election.position, stats.elections + 1,
+                                                            stats.passed + is_passed,
+                                                            stats.num_voters + len(election.allowed_voter_uids),
+                                                            stats.num_votes + len(is_yes))
+    for voter in voters.values():
+        _storage.upsert_record(VOTER_STATS_KIND, voter.uid, voter.to_dict())
+    for position in positions.values():
+        _storage.upsert_record(POSITION_STATS_KIND, position.position, position.to_dict())
+    return [*voters.values(), *positions.values()]
+
+
+def _stats(cls: type[models.Model], kind: str, index: dict, key: str) -> models.Model | None:
+    if not _shared:
+        return index.get(key)
+    record = _storage.get_record(kind, key)
+    return None if record is None else cls.from_dict(record)
+
+
+def _index_stats(stats: list[models.Model]) -> None:
+    for item in stats:
+        if isinstance(item, models.VoterStats):
+            _voter_stats[item.uid] = item
+        else:
+            _position_stats[item.position] = item
+
+
+def _archived_entry(eid: str) -> dict | None:
+    name = _archived.get(eid)
+    return None if name is None else _archive.load(name).get(eid)
+
+
+def _index_archived(eid: str, record: dict) -> None:
+    _archived[eid] = record['archive']
+    for confirmation, uid in record.get('confirmations', {}).items():
+        _confirmations[confirmation] = (eid, uid)
+
+
+def _coordinated() -> contextlib.AbstractContextManager:
+    # A transaction holds off every other instance sharing the storage until it commits
+    return _storage.transaction() if _shared else contextlib.nullcontext()
+
+
+def _sync_election(eid: str) -> None:
+    # Reindex an election as stored, since other instances sharing the storage may have created, voted in or
+    # finished (and so archived) it since it was indexed
+    if not _shared:
+        return
+    with _election_lock(eid):
+        record = _storage.load_election(eid)
+        indexed = _sync_state(eid)
+        _unindex_election(eid)
+        if record is None:
+            index = None if eid in _archived else _storage.get_record(ARCHIVE_INDEX_KIND, eid)
+            if index is not None:
+                _index_archived(eid, index)
+        else:
+            _index_election(models.Election.from_dict(record))
+            for vote_record in _storage.load_election_votes(eid):
+                vote = models.Vote.from_dict(vote_record)
+                _index_vote(vote)
+                _count_vote(vote)
+        if _sync_state(eid) != indexed:
+            _invalidate_result(eid)
+
+
+def _sync_state(eid: str) -> tuple:
+    # What the result of an election is computed from, changed by another instance if it differs after a sync
+    election = _elections.get(eid)
+    return _tallies.get(eid), election is not None and election.finished, eid in _archived
+
+
+def _reserve_confirmation(eid: str, uid: str) -> str:
+    with _confirmations_lock:
+        confirmation = util.confirmation_code(eid)
+        while confirmation in _confirmations:
+            confirmation = util.confirmation_code(eid)
+        _confirmations[confirmation] = (eid, uid)
+        return confirmation
+
+
+def _put_jobs(jobs: list[models.Job]) -> None:
+    # Must be called in a transaction, and followed by _index_jobs() once it commits
+    for job in jobs:
+        _storage.upsert_record(JOBS_KIND, job.jid, job.to_dict())
+
+
+def _index_jobs(jobs: list[models.Job]) -> None:
+    for job in jobs:
+        _jobs[job.jid] = job
+
+
+def _delivery_key(delivery: models.Delivery) -> str:
+    return f'{delivery.fid}/{delivery.uid}'
+
+
+def _election_lock(eid: str) -> threading.Lock:
+    return _election_locks[hash(eid) % len(_election_locks)]
+
+
+def _index_election(election: models.Election) -> None:
+    _elections[election.eid] = election
+    _allowed_voters[election.eid] = frozenset(election.allowed_voter_uids)
+    _tallies.setdefault(election.eid, models.Tally(election.eid, 0, 0, 0))
+
+
+def _unindex_election(eid: str) -> None:
+    election = _elections.pop(eid, None)
+    _allowed_voters.pop(eid, None)
+    _tallies.pop(eid, None)
+    for uid in election.allowed_voter_uids if election is not None else []:
+        vote = _votes.pop((eid, uid), None)
+        if vote is not None:
+            _confirmations.pop(vote.confirmation, None)
+
+
+def _index_vote(vote: models.Vote) -> None:
+    _votes[(vote.eid, vote.uid)] = vote
+    _confirmations[vote.confirmation] = (vote.eid, vote.uid)
 
 
-def get_votes_table_name(eid: str):
-    return f'votes_{eid}'
+def _count_vote(vote: models.Vote, tally: models.Tally = None) -> None:
+    tally = tally or _tallies.setdefault(vote.eid, models.Tally(vote.eid, 0, 0, 0))
+    if vote.is_yes:
+        tally.num_yes += 1
+    else:
+        tally.num_no += 1
+    # XOR of per-vote CRCs, so the checksum can be updated incrementally in any order
+    tally.checksum ^= zlib.crc32(f'{vote.uid}:{vote.confirmation}:{int(vote.is_yes)}'.encode())
 
 
 if __name__ == '__main__':
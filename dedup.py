@@ -0,0 +1,130 @@
+import collections
+import threading
+import time
+
+import async_db
+import db
+
+DEFAULT_TTL = 600.0
+DEFAULT_MAX_SIZE = 100_000
+
+KIND_EVENT = 'event'
+KIND_VOTE = 'vote'
+
+
+class DedupCache:
+    """
+    Keys of recently processed deliveries, so that a repeat of one is dropped before it touches db or Slack.
+
+    Keys are forgotten once their TTL has passed, or oldest first once there are more than max_size of them.
+    If persisted, keys are written through db as they are added, so that deliveries processed before a restart
+    are still recognised after it.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE, persist: bool = False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persist = persist
+        self.hits: collections.Counter[str] = collections.Counter()
+        self.misses = 0
+        # Keys in the order they were added, which is also the order they expire in as the TTL is the same for all
+        self._expiries: collections.OrderedDict[str, float] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Load the persisted keys, if persisted. Must be called after db.load()."""
+        if not self.persist:
+            return
+        now = time.time()
+        with self._lock:
+            self._expiries.clear()
+            for key, expires in sorted(db.load_dedup_keys().items(), key=lambda item: item[1]):
+                self._expiries[key] = expires
+            removed = self._evict(now)
+            while len(self._expiries) > self.max_size:
+                removed.append(self._expiries.popitem(last=False)[0])
+        if removed:
+            db.update_dedup_keys({}, removed)
+
+    def seen(self, key: str) -> bool:
+        """
+        :param key: the key of a delivery, from event_key() or vote_key()
+        :return: whether the key was seen within its TTL, in which case the delivery should be dropped.
+                 Otherwise the key is remembered from now on.
+        """
+        is_seen, added, removed = self._check(key)
+        if added or removed:
+            db.update_dedup_keys(added, removed)
+        return is_seen
+
+    async def seen_async(self, key: str) -> bool:
+        is_seen, added, removed = self._check(key)
+        if added or removed:
+            await async_db.update_dedup_keys(added, removed)
+        return is_seen
+
+    def forget(self, key: str) -> None:
+        """Forget a key, i.e. when processing its delivery failed and a repeat of it should be let through."""
+        if self._forget(key):
+            db.update_dedup_keys({}, [key])
+
+    async def forget_async(self, key: str) -> None:
+        if self._forget(key):
+            await async_db.update_dedup_keys({}, [key])
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = {f'{kind}_hits': n for kind, n in self.hits.items()}
+            stats.update(hits=sum(self.hits.values()), misses=self.misses, size=len(self._expiries))
+            return stats
+
+    def _check(self, key: str) -> tuple[bool, dict[str, float], list[str]]:
+        # Returns whether the key was seen, and the keys to add and remove from db if persisted
+        now = time.time()
+        with self._lock:
+            removed = self._evict(now)
+            if key in self._expiries:
+                self.hits[key.split(':', 1)[0]] += 1
+                is_seen, added = True, {}
+            else:
+                self.misses += 1
+                self._expiries[key] = now + self.ttl
+                is_seen, added = False, {key: now + self.ttl}
+                while len(self._expiries) > self.max_size:
+                    removed.append(self._expiries.popitem(last=False)[0])
+        if not self.persist:
+            return is_seen, {}, []
+        return is_seen, added, removed
+
+    def _forget(self, key: str) -> bool:
+        with self._lock:
+            is_forgotten = self._expiries.pop(key, None) is not None
+        return is_forgotten and self.persist
+
+    def _evict(self, now: float) -> list[str]:
+        removed = []
+        while self._expiries and next(iter(self._expiries.values())) <= now:
+            removed.append(self._expiries.popitem(last=False)[0])
+        return removed
+
+
+def event_key(body: dict) -> str | None:
+    """
+    :param body: the payload of a request from Slack
+    :return: the key identifying the delivery, which a redelivery of the same payload shares, if there is one
+    """
+    if 'event_id' in body:
+        return f'{KIND_EVENT}:{body["event_id"]}'
+    if 'trigger_id' in body:
+        # Unique per slash command or button click
+        return f'{KIND_EVENT}:{body["trigger_id"]}'
+    return None
+
+
+def vote_key(eid: str, uid: str) -> str:
+    # A voter can only vote once per election, so any click after the first one can only be answered with an error
+    return f'{KIND_VOTE}:{eid}:{uid}'
+
+
+if __name__ == '__main__':
+    raise NotImplementedError('Not an entrypoint')
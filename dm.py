@@ -0,0 +1,277 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+import async_db
+import db
+import models
+
+if TYPE_CHECKING:
+    from slack_sdk.web.async_client import AsyncWebClient
+    from slack_sdk.web.async_slack_response import AsyncSlackResponse
+
+ERR_DM_RENDER = '[this DM was not sent correctly - please try again]'
+
+# Requests per minute allowed for the methods used to send a DM (https://api.slack.com/apis/rate-limits).
+# conversations.open is Tier 3; chat.postMessage is limited per channel, so it is bounded by Tier 4 here.
+TIER_LIMITS = {
+    'conversations.open': 50,
+    'chat.postMessage': 100,
+}
+
+# Errors that will not go away by retrying, after which a recipient is marked as failed
+PERMANENT_ERRORS = {
+    'account_inactive',
+    'cannot_dm_bot',
+    'channel_not_found',
+    'invalid_auth',
+    'is_archived',
+    'not_authed',
+    'user_disabled',
+    'user_not_found',
+    'user_not_visible',
+}
+
+
+class DMChannelCache:
+    """
+    Cache of the DM channel with each user (or group of users), persisted through db so that it survives restarts.
+    Saves a conversations.open call for every DM after the first one sent to the same users.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def is_cached(self, uids: list[str]) -> bool:
+        return db.get_dm_channel(self._key(uids)) is not None
+
+    def open(self, client: WebClient, uids: list[str]) -> str:
+        key = self._key(uids)
+        channel_id = self._count(db.get_dm_channel(key))
+        if channel_id is None:
+            channel_id = client.conversations_open(users=uids)['channel']['id']
+            db.set_dm_channel(key, channel_id)
+        return channel_id
+
+    async def open_async(self, client: 'AsyncWebClient', uids: list[str]) -> str:
+        key = self._key(uids)
+        channel_id = self._count(await async_db.get_dm_channel(key))
+        if channel_id is None:
+            channel_id = (await client.conversations_open(users=uids))['channel']['id']
+            await async_db.set_dm_channel(key, channel_id)
+        return channel_id
+
+    def invalidate(self, uids: list[str]) -> None:
+        db.remove_dm_channel(self._key(uids))
+
+    async def invalidate_async(self, uids: list[str]) -> None:
+        await async_db.remove_dm_channel(self._key(uids))
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def _count(self, channel_id: str | None) -> str | None:
+        with self._lock:
+            if channel_id is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return channel_id
+
+    @staticmethod
+    def _key(uids: list[str]) -> str:
+        return ','.join(sorted(uids))
+
+
+dm_channels = DMChannelCache()
+
+
+def send_dm(client: WebClient, uids: list[str], text=None, blocks=None) -> SlackResponse:
+    if text is None and blocks is None:
+        raise ValueError('Neither text nor blocks provided for DM')
+    try:
+        return _post_dm(client, dm_channels.open(client, uids), text, blocks)
+    except SlackApiError as e:
+        if e.response.get('error') != 'channel_not_found':
+            raise
+        # The cached channel is no longer usable, so open it again and retry once
+        dm_channels.invalidate(uids)
+        return _post_dm(client, dm_channels.open(client, uids), text, blocks)
+
+
+async def send_dm_async(client: 'AsyncWebClient', uids: list[str], text=None, blocks=None) -> 'AsyncSlackResponse':
+    if text is None and blocks is None:
+        raise ValueError('Neither text nor blocks provided for DM')
+    try:
+        return await _post_dm(client, await dm_channels.open_async(client, uids), text, blocks)
+    except SlackApiError as e:
+        if e.response.get('error') != 'channel_not_found':
+            raise
+        await dm_channels.invalidate_async(uids)
+        return await _post_dm(client, await dm_channels.open_async(client, uids), text, blocks)
+
+
+def _post_dm(client: WebClient, dm_channel_id: str, text=None, blocks=None) -> SlackResponse:
+    # With an AsyncWebClient, this returns the coroutine of the call instead
+    if text is not None:
+        return client.chat_postMessage(channel=dm_channel_id, text=text, unfurl_links=True)
+    else:
+        return client.chat_postMessage(channel=dm_channel_id, blocks=blocks, text=ERR_DM_RENDER, unfurl_links=True)
+
+
+class RateLimiter:
+    """
+    Token bucket per Slack API method, refilled at the method's per-minute limit and allowing bursts of up to
+    one minute's worth of requests. A 429 response pauses every method until its Retry-After has passed.
+    """
+
+    def __init__(self, limits: dict[str, int]):
+        self._limits = limits
+        self._tokens = {method: float(limit) for method, limit in limits.items()}
+        self._updated = {method: time.monotonic() for method in limits}
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, method: str) -> None:
+        while (wait := self._take(method)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, method: str) -> None:
+        while (wait := self._take(method)) > 0:
+            await asyncio.sleep(wait)
+
+    def _take(self, method: str) -> float:
+        """Take a token if one is available, otherwise return the seconds to wait for before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._paused_until - now
+            if wait > 0:
+                return wait
+            limit = self._limits[method]
+            self._tokens[method] = min(limit, self._tokens[method] + (now - self._updated[method]) * limit / 60)
+            self._updated[method] = now
+            if self._tokens[method] >= 1:
+                self._tokens[method] -= 1
+                return 0.0
+            return (1 - self._tokens[method]) * 60 / limit
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class FanOutDispatcher:
+    """
+    Sends the same DM to many users with bounded concurrency, within Slack's rate limits.
+
+    The state of every recipient is persisted through db, so a fan-out interrupted by a restart is resumed by
+    fanning out again with the same ID (as the job queue does when it runs the interrupted job again) without
+    re-sending DMs that were already delivered.
+    """
+
+    def __init__(self, client: WebClient, max_workers: int = 8, max_attempts: int = 5,
+                 limiter: RateLimiter = None):
+        self._client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fan-out')
+        self._max_attempts = max_attempts
+        self._limiter = limiter or RateLimiter(TIER_LIMITS)
+
+    def fan_out(self, fid: str, uids: list[str], text: str) -> models.FanOut:
+        """
+        Send a DM to every user, blocking until each one has either been delivered or has failed.
+
+        :param fid: a fan-out ID, unique to this message; fanning out with an existing ID resumes that fan-out
+        :param uids: the users to send a separate DM to
+        :param text: the text of the DM
+        :return: the finished fan-out
+        """
+        return self._run(db.create_fan_out(fid, text, uids))
+
+    def _run(self, fan_out: models.FanOut) -> models.FanOut:
+        pending = [d for d in db.list_deliveries(fan_out.fid) if d.state == models.Delivery.PENDING]
+        for future in [self._executor.submit(self._deliver, fan_out, d) for d in pending]:
+            future.result()
+        db.mark_fan_out_finished(fan_out)
+        return fan_out
+
+    def _deliver(self, fan_out: models.FanOut, delivery: models.Delivery) -> None:
+        while delivery.state == models.Delivery.PENDING:
+            if not dm_channels.is_cached([delivery.uid]):
+                self._limiter.acquire('conversations.open')
+            self._limiter.acquire('chat.postMessage')
+            delivery.attempts += 1
+            try:
+                send_dm(self._client, [delivery.uid], text=fan_out.text)
+                delivery.state = models.Delivery.SENT
+            except SlackApiError as e:
+                if e.response.status_code == 429:
+                    # Rate limited attempts do not count towards max_attempts
+                    delivery.attempts -= 1
+                    self._limiter.pause(float(e.response.headers.get('Retry-After', 1)))
+                elif e.response.get('error') in PERMANENT_ERRORS or delivery.attempts >= self._max_attempts:
+                    delivery.state = models.Delivery.FAILED
+                else:
+                    time.sleep(2 ** delivery.attempts)
+            except Exception:
+                if delivery.attempts >= self._max_attempts:
+                    delivery.state = models.Delivery.FAILED
+                else:
+                    time.sleep(2 ** delivery.attempts)
+            db.update_delivery(delivery)
+
+
+class AsyncFanOutDispatcher:
+    """
+    FanOutDispatcher for async_app.py, sending DMs as concurrent tasks on the event loop instead of on threads.
+    Delivery state is persisted through db just the same, so either dispatcher can resume the other's fan-outs.
+    """
+
+    def __init__(self, client: 'AsyncWebClient', max_concurrency: int = 32, max_attempts: int = 5,
+                 limiter: RateLimiter = None):
+        self._client = client
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_attempts = max_attempts
+        self._limiter = limiter or RateLimiter(TIER_LIMITS)
+
+    async def fan_out(self, fid: str, uids: list[str], text: str) -> models.FanOut:
+        return await self._run(await async_db.create_fan_out(fid, text, uids))
+
+    async def _run(self, fan_out: models.FanOut) -> models.FanOut:
+        pending = [d for d in await async_db.list_deliveries(fan_out.fid) if d.state == models.Delivery.PENDING]
+        await asyncio.gather(*[self._deliver(fan_out, d) for d in pending])
+        await async_db.mark_fan_out_finished(fan_out)
+        return fan_out
+
+    async def _deliver(self, fan_out: models.FanOut, delivery: models.Delivery) -> None:
+        async with self._semaphore:
+            while delivery.state == models.Delivery.PENDING:
+                if not dm_channels.is_cached([delivery.uid]):
+                    await self._limiter.acquire_async('conversations.open')
+                await self._limiter.acquire_async('chat.postMessage')
+                delivery.attempts += 1
+                try:
+                    await send_dm_async(self._client, [delivery.uid], text=fan_out.text)
+                    delivery.state = models.Delivery.SENT
+                except SlackApiError as e:
+                    if e.response.status_code == 429:
+                        delivery.attempts -= 1
+                        self._limiter.pause(float(e.response.headers.get('Retry-After', 1)))
+                    elif e.response.get('error') in PERMANENT_ERRORS or delivery.attempts >= self._max_attempts:
+                        delivery.state = models.Delivery.FAILED
+                    else:
+                        await asyncio.sleep(2 ** delivery.attempts)
+                except Exception:
+                    if delivery.attempts >= self._max_attempts:
+                        delivery.state = models.Delivery.FAILED
+                    else:
+                        await asyncio.sleep(2 ** delivery.attempts)
+                await async_db.update_delivery(delivery)
@@ -0,0 +1,178 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import sys
+from typing import Iterable, Iterator
+
+import dotenv
+
+import db
+import models
+
+REPORT_ELECTIONS = 'elections'
+REPORT_VOTERS = 'voters'
+REPORT_POSITIONS = 'positions'
+REPORTS = (REPORT_ELECTIONS, REPORT_VOTERS, REPORT_POSITIONS)
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+
+# Bytes per chunk of an export, each uploaded to Slack as a file of its own
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+
+COLUMNS = {
+    REPORT_ELECTIONS: ['eid', 'position', 'electee_uid', 'creator_uid', 'threshold_pct', 'deadline', 'finished',
+                       'passed', 'num_voters', 'num_yes', 'num_no', 'turnout_pct', 'vote_pct'],
+    REPORT_VOTERS: ['uid', 'eligible', 'voted', 'turnout_pct', 'num_yes'],
+    REPORT_POSITIONS: ['position', 'elections', 'passed', 'pass_rate_pct', 'num_voters', 'num_votes', 'turnout_pct'],
+}
+
+
+def export(report: str, file_format: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Iterator[str]:
+    """
+    Stream a report out of db, which must be loaded.
+
+    :param report: the report to export, one of REPORTS
+    :param file_format: the format to export it in, one of FORMATS
+    :param chunk_bytes: the size chunks of the export are kept under, unless a single row is larger
+    :return: the export, in chunks, each of them produced only once the previous one has been consumed, and each
+             starting with the header line for CSV, since every chunk is uploaded as a file of its own
+    """
+    columns = COLUMNS[report]
+    return chunk(encode(rows(report), columns, file_format), chunk_bytes, header(columns, file_format))
+
+
+def rows(report: str) -> Iterator[dict]:
+    if report == REPORT_ELECTIONS:
+        return (_election_row(election, tally) for election, tally in db.iter_elections())
+    if report == REPORT_VOTERS:
+        return (_voter_row(stats) for stats in sorted(db.list_voter_stats(), key=lambda s: s.uid))
+    return (_position_row(stats) for stats in sorted(db.list_position_stats(), key=lambda s: s.position))
+
+
+def header(columns: list[str], file_format: str) -> str:
+    """
+    :return: the header line of the columns for CSV, or nothing for NDJSON
+    """
+    if file_format == FORMAT_NDJSON:
+        return ''
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, columns, lineterminator='\n').writeheader()
+    return buffer.getvalue()
+
+
+def encode(rows_: Iterable[dict], columns: list[str], file_format: str) -> Iterator[str]:
+    """
+    :return: a line for each row
+    """
+    if file_format == FORMAT_NDJSON:
+        for row in rows_:
+            yield json.dumps(row, separators=(',', ':')) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, lineterminator='\n')
+    for row in rows_:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def chunk(lines: Iterable[str], chunk_bytes: int, header_: str = '') -> Iterator[str]:
+    """
+    :param header_: a line to start every chunk with
+    :return: the lines joined into chunks of at most chunk_bytes (UTF-8 encoded) each, or of a single line (and the
+             header) if longer, or the header alone if there are no lines
+    """
+    header_bytes = len(header_.encode('utf-8'))
+    pending, size = [], header_bytes
+    for line in lines:
+        line_bytes = len(line.encode('utf-8'))
+        if pending and size + line_bytes > chunk_bytes:
+            yield header_ + ''.join(pending)
+            pending, size = [], header_bytes
+        pending.append(line)
+        size += line_bytes
+    if pending or header_:
+        yield header_ + ''.join(pending)
+
+
+def filename(report: str, file_format: str, part: int) -> str:
+    return f'votebot-{report}-{part:03}.{file_format}'
+
+
+def _election_row(election: models.Election, tally: models.Tally) -> dict:
+    result = models.ElectionResult(election, tally.num_yes, tally.num_no)
+    return {
+        'eid': election.eid,
+        'position': election.position,
+        'electee_uid': election.electee_uid,
+        'creator_uid': election.creator_uid,
+        'threshold_pct': election.threshold_pct,
+        'deadline': election.deadline,
+        'finished': election.finished,
+        # Only decided once the election has finished
+        'passed': result.is_passed if election.finished else None,
+        'num_voters': result.num_voters,
+        'num_yes': result.num_yes,
+        'num_no': result.num_no,
+        'turnout_pct': result.reporting_pct,
+        'vote_pct': result.vote_pct,
+    }
+
+
+def _voter_row(stats: models.VoterStats) -> dict:
+    return {
+        'uid': stats.uid,
+        'eligible': stats.eligible,
+        'voted': stats.voted,
+        'turnout_pct': _pct(stats.voted, stats.eligible),
+        'num_yes': stats.num_yes,
+    }
+
+
+def _position_row(stats: models.PositionStats) -> dict:
+    return {
+        'position': stats.position,
+        'elections': stats.elections,
+        'passed': stats.passed,
+        'pass_rate_pct': _pct(stats.passed, stats.elections),
+        'num_voters': stats.num_voters,
+        'num_votes': stats.num_votes,
+        'turnout_pct': _pct(stats.num_votes, stats.num_voters),
+    }
+
+
+def _pct(part: int, whole: int) -> int:
+    return 0 if whole == 0 else int(100 * part / whole)
+
+
+def main():
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description='Export every election, or stats per voter or position')
+    parser.add_argument('report', nargs='?', default=REPORT_ELECTIONS, choices=REPORTS,
+                        help='what to export (default: %(default)s)')
+    parser.add_argument('--format', dest='file_format', default=FORMAT_CSV, choices=FORMATS,
+                        help='format to export in (default: %(default)s)')
+    parser.add_argument('--output', help='file to write the export to (default: stdout)')
+    args = parser.parse_args()
+
+    # Only read the database, leaving its upkeep (archiving finished elections, aggregating stats) to the bot
+    db.load(read_only=True)
+    if args.output:
+        output = open(args.output, 'w', encoding='utf-8', newline='')
+    else:
+        output = contextlib.nullcontext(sys.stdout)
+    # A single file, so with a single header line, unlike the chunks of export()
+    columns = COLUMNS[args.report]
+    with output as f:
+        f.write(header(columns, args.file_format))
+        for line in encode(rows(args.report), columns, args.file_format):
+            f.write(line)
+
+
+if __name__ == '__main__':
+    main()
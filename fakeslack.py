@@ -0,0 +1,125 @@
+import collections
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeSlack:
+    """
+    Local HTTP stand-in for the Slack Web API, for benchmarking votebot without a workspace.
+
+    Point a WebClient at base_url. Every call is recorded, and can be slowed down by a fixed latency or
+    answered with a 429 (with a Retry-After) at a given rate. Usergroup members are served from usergroups.
+    Files uploaded (through files_upload_v2) are kept in uploads, by file ID.
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit_pct: float = 0.0, retry_after: float = 1.0,
+                 usergroups: dict[str, list[str]] = None):
+        self.latency = latency
+        self.rate_limit_pct = rate_limit_pct
+        self.retry_after = retry_after
+        self.usergroups = usergroups or {}
+        self.calls: list[tuple[float, str, dict]] = []
+        self.uploads: dict[str, str] = {}
+        self._ts = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/api/'
+
+    @property
+    def response_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/respond'
+
+    def start(self) -> 'FakeSlack':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(collections.Counter(method for _, method, _ in self.calls))
+
+    def respond(self, method: str, args: dict) -> tuple[int, dict]:
+        with self._lock:
+            self.calls.append((time.monotonic(), method, args))
+        if self.latency:
+            time.sleep(self.latency)
+        if method != 'auth.test' and random.random() * 100 < self.rate_limit_pct:
+            with self._lock:
+                self.calls.append((time.monotonic(), '429', {'method': method}))
+            return 429, {'ok': False, 'error': 'ratelimited'}
+
+        if method == 'auth.test':
+            return 200, {'ok': True, 'url': 'https://fake.slack.com/', 'team_id': 'T0', 'user_id': 'UBOT',
+                         'bot_id': 'BBOT'}
+        elif method == 'conversations.open':
+            return 200, {'ok': True, 'channel': {'id': f'D{args.get("users", "")}'}}
+        elif method in ('chat.postMessage', 'chat.update'):
+            return 200, {'ok': True, 'channel': args.get('channel'), 'ts': f'{next(self._ts)}.000000'}
+        elif method == 'chat.postEphemeral':
+            return 200, {'ok': True, 'message_ts': f'{next(self._ts)}.000000'}
+        elif method == 'chat.getPermalink':
+            return 200, {'ok': True, 'permalink': f'https://fake.slack.com/archives/{args.get("channel")}/'
+                                                  f'p{args.get("message_ts", "").replace(".", "")}'}
+        elif method == 'files.getUploadURLExternal':
+            file_id = f'F{next(self._file_ids)}'
+            return 200, {'ok': True, 'file_id': file_id,
+                         'upload_url': f'http://127.0.0.1:{self._server.server_port}/upload/{file_id}'}
+        elif method == 'files.completeUploadExternal':
+            files = json.loads(args['files']) if isinstance(args.get('files'), str) else args.get('files', [])
+            return 200, {'ok': True, 'files': [{'id': f['id'], 'title': f.get('title')} for f in files]}
+        elif method == 'usergroups.users.list':
+            return 200, {'ok': True, 'users': self.usergroups.get(args.get('usergroup'), [])}
+        return 200, {'ok': True}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                raw = self.rfile.read(length).decode() if length else ''
+                if self.path.startswith('/upload/'):
+                    with fake._lock:
+                        fake.uploads[self.path.removeprefix('/upload/')] = raw
+                    raw = ''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    args = json.loads(raw or '{}')
+                else:
+                    args = {k: v[0] for k, v in urllib.parse.parse_qs(raw).items()}
+                args.update({k: v[0] for k, v in urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query).items()})
+                method = self.path.split('?')[0].removeprefix('/api/').strip('/')
+                status, data = fake.respond(method, args)
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', str(fake.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Some methods are sent as GET by some clients (e.g. usergroups.users.list by AsyncWebClient)
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
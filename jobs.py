@@ -0,0 +1,304 @@
+import asyncio
+import collections
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+import async_db
+import db
+import models
+import util
+
+# Seconds a job is leased to the instance running it when the storage is shared, renewed for as long as it runs
+LEASE_DURATION = 60.0
+# Seconds between attempts to lease a job leased by another instance, which the rest of its group waits on
+LEASE_RETRY_INTERVAL = 2.0
+
+
+class JobQueue:
+    """
+    Durable outbox of side-effect jobs, so that listeners can return as soon as their database writes are done.
+
+    Jobs are persisted through db before they are run and removed once they succeed, so jobs interrupted by a
+    restart are run again by start(). Jobs of the same group (e.g. election) run one at a time in the order they
+    were enqueued, while jobs of different groups run concurrently. A failing job is retried with backoff,
+    holding up the rest of its group, until it has failed max_attempts times.
+
+    If other instances share the storage, each job is run by whichever instance leases it. A job leased by another
+    instance holds up the rest of its group until it is done or its lease expires, keeping the group in order across
+    instances. Jobs of every instance are rescanned periodically, so that the jobs of an instance that stopped
+    renewing its leases are taken over.
+    """
+
+    def __init__(self, max_workers: int = 4, max_attempts: int = 5):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jobs')
+        self._max_attempts = max_attempts
+        self._handlers: dict[str, Callable[[models.Job], None]] = {}
+        self._queues: dict[str, collections.deque[models.Job]] = {}
+        # IDs of the jobs scheduled and not yet run, and the names of the leases held on the ones being run
+        self._scheduled: set[str] = set()
+        self._leases: set[str] = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def register(self, kind: str, handler: Callable[[models.Job], None]) -> None:
+        self._handlers[kind] = handler
+
+    def enqueue(self, kind: str, group: str, payload: dict) -> models.Job:
+        """
+        Persist a job and schedule it to run after all previously enqueued jobs of the same group.
+
+        :param kind: the kind of job, which determines the registered handler it is run with
+        :param group: the group the job is ordered within
+        :param payload: JSON serializable arguments of the job
+        :return: the enqueued job
+        """
+        job = new_job(kind, group, payload)
+        db.put_job(job)
+        self._schedule(job)
+        return job
+
+    def schedule(self, jobs: list[models.Job]) -> None:
+        """
+        Schedule jobs created by new_job() and persisted by the caller, e.g. in the same transaction as the writes
+        they are a side effect of, so that those are never committed without them.
+        """
+        for job in jobs:
+            self._schedule(job)
+
+    def start(self) -> None:
+        for job in db.list_pending_jobs():
+            self._schedule(job)
+        if db.is_shared():
+            threading.Thread(target=self._coordinate, name='jobs-leases', daemon=True).start()
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Wait until every scheduled job has either succeeded or failed.
+
+        :param timeout: the maximum number of seconds to wait for, or None to wait indefinitely
+        :return: whether the queue became idle before the timeout
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._queues, timeout)
+
+    def _schedule(self, job: models.Job) -> None:
+        with self._lock:
+            if job.jid in self._scheduled:
+                return
+            self._scheduled.add(job.jid)
+            queue = self._queues.get(job.group)
+            if queue is not None:
+                # The group is already being drained, which will pick this job up too
+                queue.append(job)
+                return
+            self._queues[job.group] = collections.deque([job])
+        self._executor.submit(self._drain, job.group)
+
+    def _drain(self, group: str) -> None:
+        while True:
+            with self._lock:
+                queue = self._queues[group]
+                if not queue:
+                    del self._queues[group]
+                    if not self._queues:
+                        self._idle.notify_all()
+                    return
+                job = queue[0]
+            if not self._run_leased(job):
+                # Tried again later, without holding up a worker (and so other groups) meanwhile
+                timer = threading.Timer(LEASE_RETRY_INTERVAL, self._executor.submit, [self._drain, group])
+                timer.daemon = True
+                timer.start()
+                return
+            with self._lock:
+                queue.popleft()
+                self._scheduled.discard(job.jid)
+
+    def _run_leased(self, job: models.Job) -> bool:
+        """
+        :return: whether the job is done with, as opposed to leased by another instance
+        """
+        if not db.is_shared():
+            self._run(job)
+            return True
+        lease = _lease_name(job)
+        if not db.acquire_lease(lease, LEASE_DURATION):
+            # Being run by another instance, unless it was done with since
+            job = db.refresh_job(job)
+            return job is None or job.state != models.Job.PENDING
+        with self._lock:
+            self._leases.add(lease)
+        try:
+            job = db.refresh_job(job)
+            if job is not None and job.state == models.Job.PENDING:
+                self._run(job)
+        finally:
+            with self._lock:
+                self._leases.discard(lease)
+            db.release_lease(lease)
+        return True
+
+    def _coordinate(self) -> None:
+        while True:
+            time.sleep(LEASE_DURATION / 3)
+            try:
+                with self._lock:
+                    leases = list(self._leases)
+                for lease in leases:
+                    db.acquire_lease(lease, LEASE_DURATION)
+                for job in db.list_pending_jobs():
+                    self._schedule(job)
+            except Exception:
+                traceback.print_exc()
+
+    def _run(self, job: models.Job) -> None:
+        while True:
+            try:
+                self._handlers[job.kind](job)
+                db.remove_job(job)
+                return
+            except Exception:
+                print(f'Job {job.kind} {job.jid} failed (attempt {job.attempts + 1}/{self._max_attempts})')
+                traceback.print_exc()
+                job.attempts += 1
+                if job.attempts >= self._max_attempts:
+                    job.state = models.Job.FAILED
+                    db.put_job(job)
+                    return
+                db.put_job(job)
+                time.sleep(min(2 ** job.attempts, 60))
+
+
+class AsyncJobQueue:
+    """
+    JobQueue for async_app.py, running jobs as coroutines on the event loop instead of on threads.
+    Jobs are persisted through db just the same, so jobs left over by either queue are run by the other.
+    """
+
+    def __init__(self, max_attempts: int = 5):
+        self._max_attempts = max_attempts
+        self._handlers: dict[str, Callable[[models.Job], Awaitable[None]]] = {}
+        self._queues: dict[str, collections.deque[models.Job]] = {}
+        self._scheduled: set[str] = set()
+        self._leases: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def register(self, kind: str, handler: Callable[[models.Job], Awaitable[None]]) -> None:
+        self._handlers[kind] = handler
+
+    async def enqueue(self, kind: str, group: str, payload: dict) -> models.Job:
+        job = new_job(kind, group, payload)
+        await async_db.put_job(job)
+        self._schedule(job)
+        return job
+
+    def schedule(self, jobs: list[models.Job]) -> None:
+        for job in jobs:
+            self._schedule(job)
+
+    async def start(self) -> None:
+        for job in await async_db.list_pending_jobs():
+            self._schedule(job)
+        if db.is_shared():
+            self._start_task(self._coordinate())
+
+    async def join(self, timeout: float = None) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _schedule(self, job: models.Job) -> None:
+        if job.jid in self._scheduled:
+            return
+        self._scheduled.add(job.jid)
+        queue = self._queues.get(job.group)
+        if queue is not None:
+            queue.append(job)
+            return
+        self._queues[job.group] = collections.deque([job])
+        self._idle.clear()
+        self._start_task(self._drain(job.group))
+
+    def _start_task(self, coroutine) -> None:
+        # The event loop only keeps weak references to tasks
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, group: str) -> None:
+        queue = self._queues[group]
+        while queue:
+            job = queue[0]
+            if not await self._run_leased(job):
+                await asyncio.sleep(LEASE_RETRY_INTERVAL)
+                continue
+            queue.popleft()
+            self._scheduled.discard(job.jid)
+        del self._queues[group]
+        if not self._queues:
+            self._idle.set()
+
+    async def _run(self, job: models.Job) -> None:
+        while True:
+            try:
+                await self._handlers[job.kind](job)
+                await async_db.remove_job(job)
+                return
+            except Exception:
+                print(f'Job {job.kind} {job.jid} failed (attempt {job.attempts + 1}/{self._max_attempts})')
+                traceback.print_exc()
+                job.attempts += 1
+                if job.attempts >= self._max_attempts:
+                    job.state = models.Job.FAILED
+                    await async_db.put_job(job)
+                    return
+                await async_db.put_job(job)
+                await asyncio.sleep(min(2 ** job.attempts, 60))
+
+    async def _run_leased(self, job: models.Job) -> bool:
+        if not db.is_shared():
+            await self._run(job)
+            return True
+        lease = _lease_name(job)
+        if not await async_db.acquire_lease(lease, LEASE_DURATION):
+            job = await async_db.refresh_job(job)
+            return job is None or job.state != models.Job.PENDING
+        self._leases.add(lease)
+        try:
+            job = await async_db.refresh_job(job)
+            if job is not None and job.state == models.Job.PENDING:
+                await self._run(job)
+        finally:
+            self._leases.discard(lease)
+            await async_db.release_lease(lease)
+        return True
+
+    async def _coordinate(self) -> None:
+        while True:
+            await asyncio.sleep(LEASE_DURATION / 3)
+            try:
+                for lease in list(self._leases):
+                    await async_db.acquire_lease(lease, LEASE_DURATION)
+                for job in await async_db.list_pending_jobs():
+                    self._schedule(job)
+            except Exception:
+                traceback.print_exc()
+
+
+def new_job(kind: str, group: str, payload: dict) -> models.Job:
+    """
+    Create a job to be persisted by the caller and then scheduled with JobQueue.schedule() (or AsyncJobQueue's),
+    with the same arguments as JobQueue.enqueue().
+    """
+    return models.Job(util.random_id(), kind, group, time.time_ns(), payload, models.Job.PENDING, 0)
+
+
+def _lease_name(job: models.Job) -> str:
+    return f'jobs/{job.jid}'
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+import traceback
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+
+import async_db
+import blockgen
+import db
+import models
+
+if TYPE_CHECKING:
+    from slack_sdk.web.async_client import AsyncWebClient
+
+# Minimum seconds between two updates of the same election message
+DEFAULT_INTERVAL = 5.0
+
+
+class TallyUpdater:
+    """
+    Keeps the reporting bar of each election message up to date with chat.update.
+
+    Updates are coalesced per message: however many votes are notified within one interval (in any of the elections
+    of a slate message), the message is updated at most once per interval, with the tallies as they are then.
+    """
+
+    def __init__(self, client: WebClient, interval: float = DEFAULT_INTERVAL):
+        self._client = client
+        self.interval = interval
+        self._last_updated: dict[str, float] = {}
+        self._scheduled: set[str] = set()
+        self._lock = threading.Lock()
+
+    def notify(self, eid: str) -> None:
+        message = db.get_election_message(eid)
+        if message is None:
+            return
+        key = message['ts']
+        with self._lock:
+            if key in self._scheduled:
+                return
+            self._scheduled.add(key)
+            delay = max(0.0, self._last_updated.get(key, 0.0) + self.interval - time.monotonic())
+        timer = threading.Timer(delay, self._update, [key, eid])
+        timer.daemon = True
+        timer.start()
+
+    def forget(self, eid: str) -> None:
+        """Stop keeping the time of the last update of an election's message, once none of its elections is open."""
+        message = db.get_election_message(eid)
+        if message is None or _has_open_election(message, eid):
+            return
+        with self._lock:
+            # Otherwise forgotten by the scheduled update once it is done
+            if message['ts'] not in self._scheduled:
+                self._last_updated.pop(message['ts'], None)
+
+    def _update(self, key: str, eid: str) -> None:
+        with self._lock:
+            self._scheduled.discard(key)
+            self._last_updated[key] = time.monotonic()
+        rendered = render(eid)
+        if rendered is None or not _has_open_election(rendered[0], eid):
+            # No vote can be notified anymore, so no later update is to be spaced from this one
+            with self._lock:
+                if key not in self._scheduled:
+                    self._last_updated.pop(key, None)
+        if rendered is None:
+            return
+        message, blocks = rendered
+        try:
+            self._client.chat_update(channel=message['channel_id'], ts=message['ts'], blocks=blocks,
+                                     text=blockgen.ERR_VOTE_RENDER)
+        except Exception:
+            # Live updates are best effort, the next vote will try again
+            traceback.print_exc()
+
+
+class AsyncTallyUpdater:
+    """TallyUpdater for async_app.py, scheduling updates on the event loop instead of on timer threads."""
+
+    def __init__(self, client: 'AsyncWebClient', interval: float = DEFAULT_INTERVAL):
+        self._client = client
+        self.interval = interval
+        self._last_updated: dict[str, float] = {}
+        self._scheduled: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    def notify(self, eid: str) -> None:
+        task = asyncio.create_task(self._update(eid))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def forget(self, eid: str) -> None:
+        message = await async_db.get_election_message(eid)
+        if message is None or await asyncio.to_thread(_has_open_election, message, eid):
+            return
+        if message['ts'] not in self._scheduled:
+            self._last_updated.pop(message['ts'], None)
+
+    async def _update(self, eid: str) -> None:
+        message = await async_db.get_election_message(eid)
+        if message is None or message['ts'] in self._scheduled:
+            return
+        key = message['ts']
+        self._scheduled.add(key)
+        await asyncio.sleep(max(0.0, self._last_updated.get(key, 0.0) + self.interval - time.monotonic()))
+        self._scheduled.discard(key)
+        self._last_updated[key] = time.monotonic()
+        rendered = await asyncio.to_thread(render, eid)
+        if rendered is None or not await asyncio.to_thread(_has_open_election, rendered[0], eid):
+            if key not in self._scheduled:
+                self._last_updated.pop(key, None)
+        if rendered is None:
+            return
+        message, blocks = rendered
+        try:
+            await self._client.chat_update(channel=message['channel_id'], ts=message['ts'], blocks=blocks,
+                                           text=blockgen.ERR_VOTE_RENDER)
+        except Exception:
+            traceback.print_exc()
+
+
+def render(eid: str) -> tuple[dict, list[dict]] | None:
+    """
+    Render the message of an election with the current tallies of every election it shows.
+
+    :param eid: the ID of the election, or of any election of a slate
+    :return: the message (channel and ts) and its new blocks, or None if there is no message to update
+    """
+    message = db.get_election_message(eid)
+    if message is None:
+        return None
+    elections, results = [], []
+    for message_eid in message.get('eids', [eid]):
+        election = db.get_election(message_eid)
+        if election is None:
+            return None
+        tally = db.get_tally(message_eid)
+        elections.append(election)
+        results.append(models.ElectionResult(election, tally.num_yes, tally.num_no))
+    if 'eids' in message:
+        return message, blockgen.slate(elections, results)
+    return message, blockgen.election(elections[0], results[0])
+
+
+def _has_open_election(message: dict, eid: str) -> bool:
+    return any(db.is_election_open(message_eid) for message_eid in message.get('eids', [eid]))
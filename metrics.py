@@ -0,0 +1,334 @@
+import bisect
+import collections
+import contextlib
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
+import traceback
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+# Upper bounds (in seconds) of the buckets of every latency histogram
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Registry:
+    """
+    Latency histograms and counters, keyed by metric name and label values, plus collectors of
+    counters kept elsewhere (e.g. cache hit counts) that are read whenever the metrics are exported.
+    """
+
+    def __init__(self):
+        self._histograms: dict[str, dict[tuple, Histogram]] = collections.defaultdict(dict)
+        self._counters: dict[str, dict[tuple, float]] = collections.defaultdict(dict)
+        self._collectors: dict[str, Callable[[], dict[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters[name][key] = self._counters[name].get(key, 0) + amount
+
+    def register_collector(self, name: str, collector: Callable[[], dict[str, float]]) -> None:
+        """
+        :param name: the name of the metric, with one sample per key of the collected dict as its "key" label
+        :param collector: a callable returning the current values of the metric
+        """
+        self._collectors[name] = collector
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, h in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(h.buckets, h.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(key, le=str(bound))} {cumulative}')
+                    lines.append(f'{name}_bucket{_labels(key, le="+Inf")} {h.count}')
+                    lines.append(f'{name}_sum{_labels(key)} {h.sum}')
+                    lines.append(f'{name}_count{_labels(key)} {h.count}')
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for key, value in sorted(counters.items()):
+                    lines.append(f'{name}{_labels(key)} {value}')
+        for name, collector in sorted(self._collectors.items()):
+            lines.append(f'# TYPE {name} gauge')
+            for key, value in sorted(collector().items()):
+                lines.append(f'{name}{_labels((("key", key),))} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        summary = {}
+        with self._lock:
+            for name, histograms in self._histograms.items():
+                for key, h in histograms.items():
+                    summary[f'{name}{_labels(key)}'] = {
+                        'count': h.count,
+                        'mean_ms': round(1000 * h.sum / h.count, 3),
+                        'p50_ms': 1000 * h.quantile(0.5),
+                        'p99_ms': 1000 * h.quantile(0.99),
+                    }
+            for name, counters in self._counters.items():
+                for key, value in counters.items():
+                    summary[f'{name}{_labels(key)}'] = value
+        for name, collector in self._collectors.items():
+            summary[name] = collector()
+        return summary
+
+
+registry = Registry()
+
+
+def _labels(key: tuple, **extra: str) -> str:
+    items = list(key) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def timed(component: str):
+    """
+    Decorate a function to record its latency in the votebot_{component}_seconds histogram,
+    and its exceptions in the votebot_{component}_errors_total counter, both labelled by function name.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    registry.inc(f'votebot_{component}_errors_total', function=func.__name__)
+                    raise
+                finally:
+                    registry.observe(f'votebot_{component}_seconds', time.perf_counter() - start,
+                                     function=func.__name__)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                registry.inc(f'votebot_{component}_errors_total', function=func.__name__)
+                raise
+            finally:
+                registry.observe(f'votebot_{component}_seconds', time.perf_counter() - start, function=func.__name__)
+        return wrapper
+    return decorator
+
+
+# Bolt passes arguments to listeners by parameter name, which functools.wraps keeps visible
+instrument_listener = timed('listener')
+
+
+class InstrumentedWebClient(WebClient):
+    """WebClient recording the latency, errors and rate limits of every Slack API call per method."""
+
+    @classmethod
+    def from_client(cls, client: WebClient) -> 'InstrumentedWebClient':
+        return cls(token=client.token, base_url=client.base_url, timeout=client.timeout, ssl=client.ssl,
+                   proxy=client.proxy, headers=client.headers, team_id=client.default_params.get('team_id'),
+                   retry_handlers=client.retry_handlers)
+
+    def api_call(self, api_method: str, **kwargs):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super().api_call(api_method, **kwargs)
+        except SlackApiError as e:
+            error = e
+            raise
+        finally:
+            record_api_call(api_method, time.perf_counter() - start, error)
+
+
+def record_api_call(api_method: str, seconds: float, error: SlackApiError = None) -> None:
+    if error is not None:
+        if error.response.status_code == 429:
+            registry.inc('votebot_slack_api_rate_limited_total', method=api_method)
+        else:
+            registry.inc('votebot_slack_api_errors_total', method=api_method)
+    registry.observe('votebot_slack_api_seconds', seconds, method=api_method)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread at an interval while running, aggregated in collapsed stack format
+    (one "frame;frame;frame count" line per stack), which flame graph tools take as input.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._stacks: collections.Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stacks.clear()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> str:
+        with self._lock:
+            if self._thread is not None:
+                self._stop.set()
+                self._thread.join()
+                self._thread = None
+            return '\n'.join(f'{stack} {count}' for stack, count in self._stacks.most_common()) + '\n'
+
+    def _sample(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = traceback.extract_stack(frame)
+                self._stacks[';'.join(f'{f.name} ({f.filename}:{f.lineno})' for f in stack)] += 1
+
+
+profiler = SamplingProfiler()
+
+
+class StartupTimer:
+    """
+    Durations of the phases of startup, in seconds: consecutive phases are timed by mark() from the end of the
+    previous one, and phases overlapping them (e.g. loading db in the background) by phase().
+    """
+
+    def __init__(self, started_at: float):
+        """
+        :param started_at: the time.perf_counter() value startup began at, taken before the slow imports
+        """
+        self.started_at = started_at
+        self.phases: dict[str, float] = {}
+        self._last = started_at
+        self._lock = threading.Lock()
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.phases[name] = now - self._last
+            self._last = now
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - start
+
+    def ready(self) -> str:
+        """
+        Record the time from the start until requests are handled, including any that were buffered.
+
+        :return: a report of every phase, to be printed
+        """
+        with self._lock:
+            self.phases['ready'] = time.perf_counter() - self.started_at
+            phases = ', '.join(f'{name} {seconds:.3f}s' for name, seconds in self.phases.items())
+        return f'Startup: {phases}'
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self.phases)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/metrics':
+            self._reply(200, registry.render_prometheus(), 'text/plain; version=0.0.4')
+        elif path == '/profiler/start':
+            profiler.start()
+            self._reply(200, 'Profiler started\n')
+        elif path == '/profiler/stop':
+            self._reply(200, profiler.stop())
+        else:
+            self._reply(404, 'Not found\n')
+
+    def _reply(self, status: int, text: str, content_type: str = 'text/plain') -> None:
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serve the metrics in Prometheus text format on /metrics, and control the sampling profiler with
+    /profiler/start and /profiler/stop (which returns the collapsed stacks sampled since the start).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def log_periodically(interval: float) -> threading.Thread:
+    def log():
+        while True:
+            time.sleep(interval)
+            print(json.dumps({'metrics': registry.summary()}, default=str))
+
+    thread = threading.Thread(target=log, name='metrics-log', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,32 @@
+import argparse
+
+import dotenv
+
+import storage
+
+
+def main():
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description='Import an existing votebot database into another storage backend')
+    parser.add_argument('source', nargs='?', default=storage.DEFAULT_PATHS[storage.BACKEND_TINYDB],
+                        help='path of the database to import (default: %(default)s)')
+    parser.add_argument('destination', nargs='?', default=storage.DEFAULT_PATHS[storage.BACKEND_SQLITE],
+                        help='path of the database to create (default: %(default)s)')
+    parser.add_argument('--from', dest='source_backend', default=storage.BACKEND_TINYDB, choices=storage.BACKENDS,
+                        help='backend of the imported database (default: %(default)s)')
+    parser.add_argument('--to', dest='destination_backend', default=storage.BACKEND_SQLITE, choices=storage.BACKENDS,
+                        help='backend of the created database (default: %(default)s)')
+    args = parser.parse_args()
+
+    source = storage.open_storage(args.source_backend, args.source)
+    destination = storage.open_storage(args.destination_backend, args.destination)
+    try:
+        num_elections, num_votes = storage.migrate(source, destination)
+    finally:
+        source.close()
+        destination.close()
+    print(f'Imported {num_elections} elections and {num_votes} votes from {args.source} into {args.destination}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,20 @@
+import time
 from abc import ABC
 
 import util
 
 
 class Model(ABC):
+    # Subclasses list their attributes in __slots__, in the order of their __init__ parameters, which saves a
+    # __dict__ per instance
+    __slots__ = ()
+
     @classmethod
     def from_dict(cls, mapping: dict):
         return cls(**mapping)
 
     def to_dict(self):
-        return vars(self)
+        return {name: getattr(self, name) for name in self.__slots__}
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.to_dict() == other.to_dict()
@@ -23,6 +28,8 @@ class Model(ABC):
 
 
 class User(Model):
+    __slots__ = ('name', 'uid')
+
     def __init__(self, name: str, uid: str):
         super().__init__()
         self.name = name
@@ -38,6 +45,8 @@ class User(Model):
 
 
 class UserGroup(Model):
+    __slots__ = ('name', 'ugid')
+
     def __init__(self, name: str, ugid: str):
         super().__init__()
         self.name = name
@@ -53,8 +62,11 @@ class UserGroup(Model):
 
 
 class Election(Model):
+    __slots__ = ('eid', 'electee_uid', 'position', 'threshold_pct', 'allowed_voter_uids', 'creator_uid', 'finished',
+                 'deadline')
+
     def __init__(self, eid: str, electee_uid: str, position: str, threshold_pct: float,
-                 allowed_voter_uids: list[str], creator_uid: str, finished: bool):
+                 allowed_voter_uids: list[str], creator_uid: str, finished: bool, deadline: float = None):
         super().__init__()
         self.eid = eid
         self.electee_uid = electee_uid
@@ -63,9 +75,16 @@ class Election(Model):
         self.allowed_voter_uids = allowed_voter_uids
         self.creator_uid = creator_uid
         self.finished = finished
+        # Seconds since the epoch at which the election is closed if its votes have not finished it, if ever
+        self.deadline = deadline
+
+    def is_past_deadline(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
 
 
 class Vote(Model):
+    __slots__ = ('uid', 'eid', 'is_yes', 'confirmation')
+
     def __init__(self, uid: str, eid: str, is_yes: bool, confirmation: str):
         super().__init__()
         self.uid = uid
@@ -74,6 +93,85 @@ class Vote(Model):
         self.confirmation = confirmation
 
 
+class Tally(Model):
+    __slots__ = ('eid', 'num_yes', 'num_no', 'checksum')
+
+    def __init__(self, eid: str, num_yes: int, num_no: int, checksum: int):
+        super().__init__()
+        self.eid = eid
+        self.num_yes = num_yes
+        self.num_no = num_no
+        self.checksum = checksum
+
+
+class FanOut(Model):
+    __slots__ = ('fid', 'text', 'uids', 'finished')
+
+    def __init__(self, fid: str, text: str, uids: list[str], finished: bool):
+        super().__init__()
+        self.fid = fid
+        self.text = text
+        self.uids = uids
+        self.finished = finished
+
+
+class Delivery(Model):
+    __slots__ = ('fid', 'uid', 'state', 'attempts')
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    def __init__(self, fid: str, uid: str, state: str, attempts: int):
+        super().__init__()
+        self.fid = fid
+        self.uid = uid
+        self.state = state
+        self.attempts = attempts
+
+
+class Job(Model):
+    __slots__ = ('jid', 'kind', 'group', 'seq', 'payload', 'state', 'attempts')
+
+    PENDING = 'pending'
+    FAILED = 'failed'
+
+    def __init__(self, jid: str, kind: str, group: str, seq: int, payload: dict, state: str, attempts: int):
+        super().__init__()
+        self.jid = jid
+        self.kind = kind
+        self.group = group
+        self.seq = seq
+        self.payload = payload
+        self.state = state
+        self.attempts = attempts
+
+
+class VoterStats(Model):
+    __slots__ = ('uid', 'eligible', 'voted', 'num_yes')
+
+    def __init__(self, uid: str, eligible: int, voted: int, num_yes: int):
+        super().__init__()
+        self.uid = uid
+        # Finished elections the user was an allowed voter in, and voted in
+        self.eligible = eligible
+        self.voted = voted
+        self.num_yes = num_yes
+
+
+class PositionStats(Model):
+    __slots__ = ('position', 'elections', 'passed', 'num_voters', 'num_votes')
+
+    def __init__(self, position: str, elections: int, passed: int, num_voters: int, num_votes: int):
+        super().__init__()
+        self.position = position
+        # Finished elections for the position, and the allowed voters and votes cast across all of them
+        self.elections = elections
+        self.passed = passed
+        self.num_voters = num_voters
+        self.num_votes = num_votes
+
+
 class ElectionResult:
     def __init__(self, election: Election, num_yes: int, num_no: int):
         self.election = election
@@ -104,3 +202,24 @@ class ShortCircuitElectionResult(ElectionResult):
 class InvalidPermissionsElectionResult(ElectionResult):
     def __init__(self):
         super().__init__(BLANK_ELECTION, 0, 0)
+
+
+class CastVoteResult:
+    def __init__(self, vote: Vote | None, result: ElectionResult):
+        self.vote = vote
+        self.result = result
+
+
+class ElectionFinishedCastVoteResult(CastVoteResult):
+    def __init__(self):
+        super().__init__(None, ShortCircuitElectionResult())
+
+
+class NonAllowedVoterCastVoteResult(CastVoteResult):
+    def __init__(self):
+        super().__init__(None, ShortCircuitElectionResult())
+
+
+class AlreadyVotedCastVoteResult(CastVoteResult):
+    def __init__(self):
+        super().__init__(None, ShortCircuitElectionResult())
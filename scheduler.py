@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import threading
+import time
+import traceback
+from typing import Awaitable, Callable
+
+import async_db
+import db
+
+# Seconds before closing an election is tried again after it failed
+RETRY_DELAY = 60.0
+
+
+class DeadlineScheduler:
+    """
+    Closes elections at their deadline, from a single thread sleeping until the earliest deadline is due.
+
+    Deadlines are kept in a min-heap, rebuilt from the open elections by start(). Elections finished by their votes
+    before their deadline are left in the heap, and only dropped once due, by on_due finding them already closed.
+    """
+
+    def __init__(self, on_due: Callable[[str], None]):
+        self._on_due = on_due
+        self._deadlines: list[tuple[float, str]] = []
+        self._changed = threading.Condition()
+
+    def start(self) -> None:
+        with self._changed:
+            self._deadlines = [(e.deadline, e.eid) for e in db.list_open_elections() if e.deadline is not None]
+            heapq.heapify(self._deadlines)
+        threading.Thread(target=self._run, name='deadlines', daemon=True).start()
+
+    def schedule(self, eid: str, deadline: float) -> None:
+        """
+        :param eid: the election to close
+        :param deadline: the time to close it at, in seconds since the epoch
+        """
+        with self._changed:
+            heapq.heappush(self._deadlines, (deadline, eid))
+            # Only the earliest deadline changes how long to sleep for
+            if self._deadlines[0][1] == eid:
+                self._changed.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                while not self._deadlines or self._deadlines[0][0] > time.time():
+                    self._changed.wait(self._deadlines[0][0] - time.time() if self._deadlines else None)
+                _, eid = heapq.heappop(self._deadlines)
+            try:
+                self._on_due(eid)
+            except Exception:
+                print(f'Closing election {eid} at its deadline failed')
+                traceback.print_exc()
+                self.schedule(eid, time.time() + RETRY_DELAY)
+
+
+class AsyncDeadlineScheduler:
+    """DeadlineScheduler for async_app.py, sleeping in a task on the event loop instead of in a thread."""
+
+    def __init__(self, on_due: Callable[[str], Awaitable[None]]):
+        self._on_due = on_due
+        self._deadlines: list[tuple[float, str]] = []
+        self._changed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._deadlines = [(e.deadline, e.eid) for e in await async_db.list_open_elections() if e.deadline is not None]
+        heapq.heapify(self._deadlines)
+        self._task = asyncio.create_task(self._run())
+
+    def schedule(self, eid: str, deadline: float) -> None:
+        heapq.heappush(self._deadlines, (deadline, eid))
+        if self._deadlines[0][1] == eid:
+            self._changed.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._changed.clear()
+            if not self._deadlines or self._deadlines[0][0] > time.time():
+                timeout = self._deadlines[0][0] - time.time() if self._deadlines else None
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, eid = heapq.heappop(self._deadlines)
+            try:
+                await self._on_due(eid)
+            except Exception:
+                print(f'Closing election {eid} at its deadline failed')
+                traceback.print_exc()
+                self.schedule(eid, time.time() + RETRY_DELAY)
+
+
+if __name__ == '__main__':
+    raise NotImplementedError('Not an entrypoint')
@@ -0,0 +1,855 @@
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+import tinydb
+from tinydb.middlewares import CachingMiddleware
+
+import codec
+
+
+BACKEND_TINYDB = 'tinydb'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_JOURNAL = 'journal'
+
+DEFAULT_PATHS = {
+    BACKEND_TINYDB: 'db.json',
+    BACKEND_SQLITE: 'db.sqlite3',
+    BACKEND_JOURNAL: 'db.journal',
+}
+
+# Encodings of the files a backend persists to: indented JSON, or the compact binary encoding of codec
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+
+
+class Storage(ABC):
+    """
+    Persistence backend behind the in-memory indexes in db.
+
+    Records are the dicts produced by models.Model.to_dict(). Elections, votes and tallies have dedicated tables,
+    while any other bot state is stored as generic records of a given kind, unique by key within that kind.
+    Every mutation is committed on its own, unless it is made inside transaction(),
+    in which case everything in the block is committed together.
+
+    Backends that are SHAREABLE can be opened by several bot instances at once, which then coordinate through them
+    with the methods only those backends implement (the ones raising NotImplementedError by default below).
+    Backends persisting to files of their own can write them in any of their FORMATS, and read them in any of them.
+    """
+
+    SHAREABLE = False
+    FORMATS = (FORMAT_JSON,)
+
+    @abstractmethod
+    def load_elections(self) -> list[dict]:
+        raise NotImplementedError('load_elections() must be implemented by subclasses')
+
+    @abstractmethod
+    def load_votes(self) -> list[dict]:
+        raise NotImplementedError('load_votes() must be implemented by subclasses')
+
+    @abstractmethod
+    def load_tallies(self) -> list[dict]:
+        raise NotImplementedError('load_tallies() must be implemented by subclasses')
+
+    @abstractmethod
+    def load_records(self, kind: str) -> dict[str, dict]:
+        raise NotImplementedError('load_records() must be implemented by subclasses')
+
+    @abstractmethod
+    def list_record_kinds(self) -> list[str]:
+        raise NotImplementedError('list_record_kinds() must be implemented by subclasses')
+
+    @abstractmethod
+    def insert_election(self, election: dict) -> None:
+        raise NotImplementedError('insert_election() must be implemented by subclasses')
+
+    @abstractmethod
+    def update_election(self, election: dict) -> None:
+        raise NotImplementedError('update_election() must be implemented by subclasses')
+
+    @abstractmethod
+    def delete_election(self, eid: str) -> None:
+        """Delete an election along with its votes and tally."""
+        raise NotImplementedError('delete_election() must be implemented by subclasses')
+
+    @abstractmethod
+    def finish_election(self, eid: str) -> bool:
+        """
+        Mark an election as finished, unless it already is.
+
+        :return: whether the election was open until now, which is only ever true for one caller per election
+        """
+        raise NotImplementedError('finish_election() must be implemented by subclasses')
+
+    @abstractmethod
+    def insert_vote(self, vote: dict) -> None:
+        raise NotImplementedError('insert_vote() must be implemented by subclasses')
+
+    @abstractmethod
+    def upsert_tally(self, tally: dict) -> None:
+        raise NotImplementedError('upsert_tally() must be implemented by subclasses')
+
+    @abstractmethod
+    def upsert_record(self, kind: str, key: str, record: dict) -> None:
+        raise NotImplementedError('upsert_record() must be implemented by subclasses')
+
+    @abstractmethod
+    def delete_record(self, kind: str, key: str) -> None:
+        raise NotImplementedError('delete_record() must be implemented by subclasses')
+
+    @abstractmethod
+    def transaction(self) -> contextlib.AbstractContextManager:
+        raise NotImplementedError('transaction() must be implemented by subclasses')
+
+    def load_election(self, eid: str) -> dict | None:
+        raise NotImplementedError(f'{self.__class__.__name__} cannot be shared')
+
+    def load_election_votes(self, eid: str) -> list[dict]:
+        raise NotImplementedError(f'{self.__class__.__name__} cannot be shared')
+
+    def find_vote(self, confirmation: str) -> dict | None:
+        raise NotImplementedError(f'{self.__class__.__name__} cannot be shared')
+
+    def get_record(self, kind: str, key: str) -> dict | None:
+        raise NotImplementedError(f'{self.__class__.__name__} cannot be shared')
+
+    def acquire_lease(self, name: str, owner: str, duration: float) -> bool:
+        """
+        Acquire or renew a lease, unless another owner holds it and it has not expired yet.
+
+        :param name: the name of the lease, i.e. of what it grants ownership of
+        :param owner: the (unique) name of the instance acquiring it
+        :param duration: the seconds after which the lease expires unless renewed
+        :return: whether the owner now holds the lease
+        """
+        raise NotImplementedError(f'{self.__class__.__name__} cannot be shared')
+
+    def release_lease(self, name: str, owner: str) -> None:
+        raise NotImplementedError(f'{self.__class__.__name__} cannot be shared')
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError('close() must be implemented by subclasses')
+
+
+class TinyDBStorage(Storage):
+    FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+    ELECTIONS_TABLE = 'elections'
+    TALLIES_TABLE = 'tallies'
+    VOTES_TABLE_PREFIX = 'votes_'
+    RECORDS_TABLE_PREFIX = 'records_'
+
+    def __init__(self, path: str, file_format: str = FORMAT_JSON):
+        # Writes are cached and flushed once per (outermost) transaction rather than once per table operation
+        self._middleware = CachingMiddleware(_TinyDBFile)
+        self._database = tinydb.TinyDB(path, storage=self._middleware, file_format=file_format)
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def load_elections(self) -> list[dict]:
+        with self._lock:
+            return [dict(r) for r in self._database.table(self.ELECTIONS_TABLE).all()]
+
+    def load_votes(self) -> list[dict]:
+        with self._lock:
+            votes = []
+            for table_name in self._database.tables():
+                if table_name.startswith(self.VOTES_TABLE_PREFIX):
+                    votes.extend(dict(r) for r in self._database.table(table_name).all())
+            return votes
+
+    def load_tallies(self) -> list[dict]:
+        with self._lock:
+            return [dict(r) for r in self._database.table(self.TALLIES_TABLE).all()]
+
+    def load_records(self, kind: str) -> dict[str, dict]:
+        with self._lock:
+            return {r['key']: dict(r['record']) for r in self._database.table(self.records_table_name(kind)).all()}
+
+    def list_record_kinds(self) -> list[str]:
+        with self._lock:
+            return [t.removeprefix(self.RECORDS_TABLE_PREFIX) for t in self._database.tables()
+                    if t.startswith(self.RECORDS_TABLE_PREFIX)]
+
+    def insert_election(self, election: dict) -> None:
+        with self.transaction():
+            self._database.table(self.ELECTIONS_TABLE).insert(election)
+            self._database.table(self.votes_table_name(election['eid']))
+
+    def update_election(self, election: dict) -> None:
+        with self.transaction():
+            self._database.table(self.ELECTIONS_TABLE).upsert(election, tinydb.Query().eid == election['eid'])
+
+    def delete_election(self, eid: str) -> None:
+        with self.transaction():
+            self._database.table(self.ELECTIONS_TABLE).remove(tinydb.Query().eid == eid)
+            self._database.table(self.TALLIES_TABLE).remove(tinydb.Query().eid == eid)
+            self._database.drop_table(self.votes_table_name(eid))
+
+    def finish_election(self, eid: str) -> bool:
+        with self.transaction():
+            table = self._database.table(self.ELECTIONS_TABLE)
+            election = table.get(tinydb.Query().eid == eid)
+            if election is None or election['finished']:
+                return False
+            table.update({'finished': True}, tinydb.Query().eid == eid)
+            return True
+
+    def insert_vote(self, vote: dict) -> None:
+        with self.transaction():
+            self._database.table(self.votes_table_name(vote['eid'])).insert(vote)
+
+    def upsert_tally(self, tally: dict) -> None:
+        with self.transaction():
+            self._database.table(self.TALLIES_TABLE).upsert(tally, tinydb.Query().eid == tally['eid'])
+
+    def upsert_record(self, kind: str, key: str, record: dict) -> None:
+        with self.transaction():
+            self._database.table(self.records_table_name(kind)).upsert(
+                {'key': key, 'record': record}, tinydb.Query().key == key
+            )
+
+    def delete_record(self, kind: str, key: str) -> None:
+        with self.transaction():
+            self._database.table(self.records_table_name(kind)).remove(tinydb.Query().key == key)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._middleware.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._database.close()
+
+    @classmethod
+    def votes_table_name(cls, eid: str) -> str:
+        return f'{cls.VOTES_TABLE_PREFIX}{eid}'
+
+    @classmethod
+    def records_table_name(cls, kind: str) -> str:
+        return f'{cls.RECORDS_TABLE_PREFIX}{kind}'
+
+
+class SQLiteStorage(Storage):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS elections (
+            eid TEXT PRIMARY KEY,
+            electee_uid TEXT NOT NULL,
+            position TEXT NOT NULL,
+            threshold_pct NOT NULL,
+            creator_uid TEXT NOT NULL,
+            finished INTEGER NOT NULL DEFAULT 0,
+            deadline REAL,
+            num_yes INTEGER,
+            num_no INTEGER,
+            tally_checksum INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS elections_finished ON elections (finished);
+        CREATE TABLE IF NOT EXISTS allowed_voters (
+            eid TEXT NOT NULL REFERENCES elections (eid),
+            idx INTEGER NOT NULL,
+            uid TEXT NOT NULL,
+            PRIMARY KEY (eid, idx)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS allowed_voters_uid ON allowed_voters (eid, uid);
+        CREATE TABLE IF NOT EXISTS votes (
+            eid TEXT NOT NULL REFERENCES elections (eid),
+            uid TEXT NOT NULL,
+            is_yes INTEGER NOT NULL,
+            confirmation TEXT NOT NULL UNIQUE,
+            PRIMARY KEY (eid, uid)
+        );
+        CREATE TABLE IF NOT EXISTS records (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            record TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID;
+    '''
+    # Other processes see every commit, and transactions are serialized across processes by BEGIN IMMEDIATE
+    SHAREABLE = True
+
+    def __init__(self, path: str):
+        # Autocommit mode: transactions are managed explicitly by transaction()
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript(self.SCHEMA)
+        self._add_missing_columns('elections', {
+            'num_yes': 'INTEGER',
+            'num_no': 'INTEGER',
+            'tally_checksum': 'INTEGER',
+            'deadline': 'REAL',
+        })
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def load_elections(self) -> list[dict]:
+        with self._lock:
+            voters = {}
+            for eid, uid in self._conn.execute('SELECT eid, uid FROM allowed_voters ORDER BY eid, idx'):
+                voters.setdefault(eid, []).append(uid)
+            rows = self._conn.execute(
+                'SELECT eid, electee_uid, position, threshold_pct, creator_uid, finished, deadline FROM elections '
+                'ORDER BY rowid'
+            )
+            return [{
+                'eid': eid,
+                'electee_uid': electee_uid,
+                'position': position,
+                'threshold_pct': threshold_pct,
+                'allowed_voter_uids': voters.get(eid, []),
+                'creator_uid': creator_uid,
+                'finished': bool(finished),
+                'deadline': deadline,
+            } for eid, electee_uid, position, threshold_pct, creator_uid, finished, deadline in rows]
+
+    def load_votes(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute('SELECT uid, eid, is_yes, confirmation FROM votes ORDER BY rowid')
+            return [{
+                'uid': uid,
+                'eid': eid,
+                'is_yes': bool(is_yes),
+                'confirmation': confirmation,
+            } for uid, eid, is_yes, confirmation in rows]
+
+    def load_tallies(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT eid, num_yes, num_no, tally_checksum FROM elections WHERE tally_checksum IS NOT NULL'
+            )
+            return [{
+                'eid': eid,
+                'num_yes': num_yes,
+                'num_no': num_no,
+                'checksum': checksum,
+            } for eid, num_yes, num_no, checksum in rows]
+
+    def load_records(self, kind: str) -> dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute('SELECT key, record FROM records WHERE kind = ?', (kind,))
+            return {key: json.loads(record) for key, record in rows}
+
+    def list_record_kinds(self) -> list[str]:
+        with self._lock:
+            return [kind for kind, in self._conn.execute('SELECT DISTINCT kind FROM records')]
+
+    def insert_election(self, election: dict) -> None:
+        with self.transaction():
+            self._conn.execute(
+                'INSERT INTO elections (eid, electee_uid, position, threshold_pct, creator_uid, finished, deadline) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (election['eid'], election['electee_uid'], election['position'], election['threshold_pct'],
+                 election['creator_uid'], int(election['finished']), election.get('deadline'))
+            )
+            self._conn.executemany(
+                'INSERT INTO allowed_voters (eid, idx, uid) VALUES (?, ?, ?)',
+                [(election['eid'], i, uid) for i, uid in enumerate(election['allowed_voter_uids'])]
+            )
+
+    def update_election(self, election: dict) -> None:
+        with self.transaction():
+            self._conn.execute(
+                'UPDATE elections SET electee_uid = ?, position = ?, threshold_pct = ?, creator_uid = ?, finished = ?, '
+                'deadline = ? WHERE eid = ?',
+                (election['electee_uid'], election['position'], election['threshold_pct'], election['creator_uid'],
+                 int(election['finished']), election.get('deadline'), election['eid'])
+            )
+
+    def delete_election(self, eid: str) -> None:
+        with self.transaction():
+            self._conn.execute('DELETE FROM votes WHERE eid = ?', (eid,))
+            self._conn.execute('DELETE FROM allowed_voters WHERE eid = ?', (eid,))
+            self._conn.execute('DELETE FROM elections WHERE eid = ?', (eid,))
+
+    def finish_election(self, eid: str) -> bool:
+        with self.transaction():
+            cursor = self._conn.execute('UPDATE elections SET finished = 1 WHERE eid = ? AND finished = 0', (eid,))
+            return cursor.rowcount == 1
+
+    def insert_vote(self, vote: dict) -> None:
+        with self.transaction():
+            self._conn.execute(
+                'INSERT INTO votes (uid, eid, is_yes, confirmation) VALUES (?, ?, ?, ?)',
+                (vote['uid'], vote['eid'], int(vote['is_yes']), vote['confirmation'])
+            )
+
+    def upsert_tally(self, tally: dict) -> None:
+        with self.transaction():
+            self._conn.execute(
+                'UPDATE elections SET num_yes = ?, num_no = ?, tally_checksum = ? WHERE eid = ?',
+                (tally['num_yes'], tally['num_no'], tally['checksum'], tally['eid'])
+            )
+
+    def upsert_record(self, kind: str, key: str, record: dict) -> None:
+        with self.transaction():
+            self._conn.execute(
+                'INSERT INTO records (kind, key, record) VALUES (?, ?, ?) '
+                'ON CONFLICT (kind, key) DO UPDATE SET record = excluded.record',
+                (kind, key, json.dumps(record))
+            )
+
+    def delete_record(self, kind: str, key: str) -> None:
+        with self.transaction():
+            self._conn.execute('DELETE FROM records WHERE kind = ? AND key = ?', (kind, key))
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute('COMMIT')
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def load_election(self, eid: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT electee_uid, position, threshold_pct, creator_uid, finished, deadline FROM elections '
+                'WHERE eid = ?', (eid,)
+            ).fetchone()
+            if row is None:
+                return None
+            electee_uid, position, threshold_pct, creator_uid, finished, deadline = row
+            voters = self._conn.execute('SELECT uid FROM allowed_voters WHERE eid = ? ORDER BY idx', (eid,))
+            return {
+                'eid': eid,
+                'electee_uid': electee_uid,
+                'position': position,
+                'threshold_pct': threshold_pct,
+                'allowed_voter_uids': [uid for uid, in voters],
+                'creator_uid': creator_uid,
+                'finished': bool(finished),
+                'deadline': deadline,
+            }
+
+    def load_election_votes(self, eid: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute('SELECT uid, is_yes, confirmation FROM votes WHERE eid = ? ORDER BY rowid', (eid,))
+            return [{
+                'uid': uid,
+                'eid': eid,
+                'is_yes': bool(is_yes),
+                'confirmation': confirmation,
+            } for uid, is_yes, confirmation in rows]
+
+    def find_vote(self, confirmation: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT uid, eid, is_yes FROM votes WHERE confirmation = ?', (confirmation,)
+            ).fetchone()
+            if row is None:
+                return None
+            uid, eid, is_yes = row
+            return {'uid': uid, 'eid': eid, 'is_yes': bool(is_yes), 'confirmation': confirmation}
+
+    def get_record(self, kind: str, key: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute('SELECT record FROM records WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+            return None if row is None else json.loads(row[0])
+
+    def acquire_lease(self, name: str, owner: str, duration: float) -> bool:
+        now = time.time()
+        with self.transaction():
+            cursor = self._conn.execute(
+                'INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                'WHERE leases.owner = excluded.owner OR leases.expires <= ?',
+                (name, owner, now + duration, now)
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self.transaction():
+            self._conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def _add_missing_columns(self, table: str, columns: dict[str, str]) -> None:
+        existing = {row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+        for name, definition in columns.items():
+            if name not in existing:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+class JournalStorage(Storage):
+    """
+    Keeps every record in memory and persists each transaction as one compact JSON line appended to a journal,
+    so that a write costs the size of what it changes rather than the size of the whole database.
+
+    A transaction returns once its line has been fsync'd. Transactions committed by other threads while a line is
+    being fsync'd are written and fsync'd together by the next one to commit (group commit). Once the journal has
+    grown past compact_bytes, a background thread compacts it into a snapshot of the whole state, and a new journal
+    is started. On open, the state is rebuilt from the snapshot and the journals written since; a line torn by a
+    crash mid-write is discarded, along with the transaction it belonged to.
+    """
+
+    FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+    SNAPSHOT_SUFFIX = '.snapshot'
+    COMPACTING_SUFFIX = '.compacting'
+
+    def __init__(self, path: str, compact_bytes: int = 4 * 1024 * 1024, compact_interval: float = 60.0,
+                 file_format: str = FORMAT_JSON):
+        self._path = path
+        self._compact_bytes = compact_bytes
+        # Only the snapshot is written in file_format, the journal is always made of JSON lines
+        self._file_format = file_format
+        self._elections: dict[str, dict] = {}
+        self._votes: dict[tuple[str, str], dict] = {}
+        self._tallies: dict[str, dict] = {}
+        self._records: dict[str, dict[str, dict]] = {}
+        self._operations = []
+        self._lock = threading.RLock()
+        self._depth = 0
+        # Lines of committed transactions not yet written, and the sequence numbers of the last committed and
+        # last fsync'd transactions. _write_lock is only ever taken after _lock, never the other way around.
+        self._pending: list[str] = []
+        self._pending_lock = threading.Lock()
+        self._committed = 0
+        self._durable = 0
+        self._write_lock = threading.Lock()
+
+        self._load_snapshot()
+        # A journal left over from a compaction interrupted by a crash, which the snapshot may or may not include.
+        # Replaying it is harmless either way, since every operation sets a record to its value at that point.
+        self._replay(path + self.COMPACTING_SUFFIX)
+        self._replay(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._closed = threading.Event()
+        self._compactor = threading.Thread(target=self._compact_periodically, args=[compact_interval],
+                                           name='journal-compactor', daemon=True)
+        self._compactor.start()
+
+    def load_elections(self) -> list[dict]:
+        with self._lock:
+            return [dict(e) for e in self._elections.values()]
+
+    def load_votes(self) -> list[dict]:
+        with self._lock:
+            return [dict(v) for v in self._votes.values()]
+
+    def load_tallies(self) -> list[dict]:
+        with self._lock:
+            return [dict(t) for t in self._tallies.values()]
+
+    def load_records(self, kind: str) -> dict[str, dict]:
+        with self._lock:
+            return {key: dict(record) for key, record in self._records.get(kind, {}).items()}
+
+    def list_record_kinds(self) -> list[str]:
+        with self._lock:
+            return list(self._records)
+
+    def insert_election(self, election: dict) -> None:
+        self._log('election', election)
+
+    def update_election(self, election: dict) -> None:
+        self._log('election', election)
+
+    def delete_election(self, eid: str) -> None:
+        self._log('delete_election', eid)
+
+    def finish_election(self, eid: str) -> bool:
+        with self._lock:
+            election = self._elections.get(eid)
+            if election is None or election['finished']:
+                return False
+            self._log('election', {**election, 'finished': True})
+            return True
+
+    def insert_vote(self, vote: dict) -> None:
+        self._log('vote', vote)
+
+    def upsert_tally(self, tally: dict) -> None:
+        self._log('tally', tally)
+
+    def upsert_record(self, kind: str, key: str, record: dict) -> None:
+        self._log('record', kind, key, record)
+
+    def delete_record(self, kind: str, key: str) -> None:
+        self._log('delete_record', kind, key)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock:
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    # Nothing is applied before the commit, so rolling back is forgetting the operations
+                    self._operations = []
+                raise
+            self._depth -= 1
+            if self._depth > 0 or not self._operations:
+                return
+            operations, self._operations = self._operations, []
+            line = json.dumps(operations, separators=(',', ':')) + '\n'
+            for operation in operations:
+                self._apply(operation)
+            with self._pending_lock:
+                self._pending.append(line)
+                self._committed += 1
+                seq = self._committed
+        # Wait for durability outside of _lock, so that other transactions can commit into the same fsync
+        with self._write_lock:
+            if self._durable < seq:
+                self._write_pending()
+
+    def compact(self) -> None:
+        """Write a snapshot of the current state, and start a new journal holding only what is committed after it."""
+        with self._lock:
+            with self._write_lock:
+                self._write_pending()
+                state = {
+                    'elections': list(self._elections.values()),
+                    'votes': list(self._votes.values()),
+                    'tallies': list(self._tallies.values()),
+                    'records': {kind: dict(records) for kind, records in self._records.items()},
+                }
+                self._file.close()
+                self._move_to_compacting()
+                self._file = open(self._path, 'a', encoding='utf-8')
+        # Records are replaced rather than mutated, so the shallow copies can be serialized while writes go on
+        snapshot_path = self._path + self.SNAPSHOT_SUFFIX
+        with open(snapshot_path + '.tmp', 'wb') as f:
+            if self._file_format == FORMAT_BINARY:
+                f.write(codec.dumps(state))
+            else:
+                f.write(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        self._fsync_directory()
+        os.remove(self._path + self.COMPACTING_SUFFIX)
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            with self._write_lock:
+                self._write_pending()
+                self._file.close()
+
+    def _log(self, *operation) -> None:
+        with self.transaction():
+            self._operations.append(operation)
+
+    def _apply(self, operation: list) -> None:
+        op, *args = operation
+        if op == 'election':
+            self._elections[args[0]['eid']] = args[0]
+        elif op == 'delete_election':
+            self._elections.pop(args[0], None)
+            self._tallies.pop(args[0], None)
+            for key in [k for k in self._votes if k[0] == args[0]]:
+                del self._votes[key]
+        elif op == 'vote':
+            self._votes[(args[0]['eid'], args[0]['uid'])] = args[0]
+        elif op == 'tally':
+            self._tallies[args[0]['eid']] = args[0]
+        elif op == 'record':
+            self._records.setdefault(args[0], {})[args[1]] = args[2]
+        elif op == 'delete_record':
+            self._records.get(args[0], {}).pop(args[1], None)
+        else:
+            raise ValueError(f'Unknown journal operation {op}')
+
+    def _write_pending(self) -> None:
+        # Must be called with _write_lock held
+        with self._pending_lock:
+            lines, self._pending = self._pending, []
+            seq = self._committed
+        if lines:
+            self._file.write(''.join(lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._durable = seq
+
+    def _load_snapshot(self) -> None:
+        snapshot_path = self._path + self.SNAPSHOT_SUFFIX
+        if not os.path.exists(snapshot_path):
+            return
+        with open(snapshot_path, 'rb') as f:
+            state = _decode(f.read())
+        self._elections = {e['eid']: e for e in state['elections']}
+        self._votes = {(v['eid'], v['uid']): v for v in state['votes']}
+        self._tallies = {t['eid']: t for t in state['tallies']}
+        self._records = state['records']
+
+    def _replay(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        valid_bytes = 0
+        with open(path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    operations = json.loads(raw)
+                except ValueError:
+                    break
+                for operation in operations:
+                    self._apply(operation)
+                valid_bytes += len(raw)
+        if valid_bytes < os.path.getsize(path):
+            print(f'Discarding {os.path.getsize(path) - valid_bytes} bytes torn off the end of {path}')
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)
+
+    def _move_to_compacting(self) -> None:
+        compacting_path = self._path + self.COMPACTING_SUFFIX
+        if not os.path.exists(compacting_path):
+            os.replace(self._path, compacting_path)
+            return
+        # Left over by an earlier compaction that failed or crashed before writing its snapshot, so the snapshot may
+        # not hold what it does: the journal is appended to it rather than replacing it. If that is interrupted, both
+        # are still replayed on open, which is harmless for the part of the journal already appended.
+        with open(compacting_path, 'ab') as compacting, open(self._path, 'rb') as journal:
+            shutil.copyfileobj(journal, compacting)
+            compacting.flush()
+            os.fsync(compacting.fileno())
+        os.remove(self._path)
+
+    def _compact_periodically(self, interval: float) -> None:
+        while not self._closed.wait(interval):
+            try:
+                if os.path.getsize(self._path) >= self._compact_bytes:
+                    self.compact()
+            except Exception:
+                traceback.print_exc()
+
+    def _fsync_directory(self) -> None:
+        if os.name != 'posix':
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+BACKENDS = {
+    BACKEND_TINYDB: TinyDBStorage,
+    BACKEND_SQLITE: SQLiteStorage,
+    BACKEND_JOURNAL: JournalStorage,
+}
+
+
+def open_storage(backend: str = None, path: str = None, file_format: str = None) -> Storage:
+    """
+    Open a storage backend, by default the one configured by the STORAGE_BACKEND, STORAGE_PATH and STORAGE_FORMAT
+    env vars.
+
+    :param backend: the name of the backend to open, one of BACKENDS
+    :param path: the file the backend persists to, or its default path if not set
+    :param file_format: the format to write the file in, one of the backend's FORMATS, or JSON if not set
+    :return: the opened backend
+    """
+    backend = backend or os.environ.get('STORAGE_BACKEND') or BACKEND_TINYDB
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown storage backend {backend}, expected one of {", ".join(BACKENDS)}')
+    path = path or os.environ.get('STORAGE_PATH') or DEFAULT_PATHS[backend]
+    file_format = file_format or os.environ.get('STORAGE_FORMAT') or FORMAT_JSON
+    if file_format not in BACKENDS[backend].FORMATS:
+        raise ValueError(f'Storage backend {backend} cannot be written as {file_format}, '
+                         f'expected one of {", ".join(BACKENDS[backend].FORMATS)}')
+    if file_format == FORMAT_JSON:
+        return BACKENDS[backend](path)
+    return BACKENDS[backend](path, file_format=file_format)
+
+
+def migrate(source: Storage, destination: Storage) -> tuple[int, int]:
+    """
+    Copy every election, vote and record from one storage backend into another in a single transaction.
+
+    :param source: the backend to read from
+    :param destination: the (empty) backend to write to
+    :return: the number of elections and votes copied
+    """
+    elections = source.load_elections()
+    votes = source.load_votes()
+    tallies = source.load_tallies()
+    records = {kind: source.load_records(kind) for kind in source.list_record_kinds()}
+    with destination.transaction():
+        for election in elections:
+            destination.insert_election(election)
+        for vote in votes:
+            destination.insert_vote(vote)
+        for tally in tallies:
+            destination.upsert_tally(tally)
+        for kind, kind_records in records.items():
+            for key, record in kind_records.items():
+                destination.upsert_record(kind, key, record)
+    return len(elections), len(votes)
+
+
+class _TinyDBFile(tinydb.Storage):
+    # tinydb's JSONStorage, but reading files in either format, and writing them in file_format
+
+    def __init__(self, path: str, file_format: str = FORMAT_JSON):
+        self._file_format = file_format
+        # Creates the file if it does not exist, without truncating it if it does
+        open(path, 'ab').close()
+        self._handle = open(path, 'r+b')
+
+    def read(self) -> dict | None:
+        self._handle.seek(0)
+        data = self._handle.read()
+        # None lets TinyDB initialize an empty database
+        return _decode(data) if data else None
+
+    def write(self, data: dict) -> None:
+        if self._file_format == FORMAT_BINARY:
+            encoded = codec.dumps(data)
+        else:
+            encoded = json.dumps(data, indent=4).encode('utf-8')
+        self._handle.seek(0)
+        self._handle.write(encoded)
+        self._handle.truncate()
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+def _decode(data: bytes):
+    return codec.loads(data) if codec.is_encoded(data) else json.loads(data)
+
+
+if __name__ == '__main__':
+    raise NotImplementedError('Not an entrypoint')
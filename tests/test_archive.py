@@ -0,0 +1,33 @@
+import os
+
+import archive
+import db
+import models
+import storage
+import util
+
+
+def test_leftover_finished_elections_are_archived_at_once(tmp_path):
+    storage_ = storage.open_storage(storage.BACKEND_TINYDB, os.path.join(tmp_path, 'db.json'))
+    archive_ = archive.Archive(os.path.join(tmp_path, 'archive'))
+    uids = ['U1', 'U2', 'U3']
+    eids = [util.random_id() for _ in range(10)]
+    # As left by a crash before archiving, each voted on by the first two voters
+    with storage_.transaction():
+        for eid in eids:
+            storage_.insert_election(models.Election(eid, 'UELECTEE', 'Position', 50, uids, 'UCREATOR', True).to_dict())
+            for uid in uids[:2]:
+                storage_.insert_vote(models.Vote(uid, eid, uid == 'U1', util.confirmation_code(eid)).to_dict())
+
+    db.load(storage_, archive_, shared=False)
+
+    assert storage_.load_elections() == [] and not db.list_elections()
+    assert sorted(archive_.load(archive_.current_name())) == sorted(eids)
+    # Every election is added to the stats, though all of them are aggregated in the same transaction
+    assert db.list_position_stats() == [models.PositionStats('Position', 10, 10, 30, 20)]
+    assert sorted(db.list_voter_stats(), key=lambda s: s.uid) == [
+        models.VoterStats('U1', 10, 10, 10), models.VoterStats('U2', 10, 10, 0), models.VoterStats('U3', 10, 0, 0)
+    ]
+    db.load(storage_, archive_, shared=False)
+    assert db.list_position_stats() == [models.PositionStats('Position', 10, 10, 30, 20)]
+    storage_.close()
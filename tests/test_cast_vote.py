@@ -0,0 +1,94 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import archive
+import db
+import jobs
+import models
+import storage
+import util
+
+ELECTIONS = 4
+VOTERS = 100
+CLICKS_PER_VOTER = 5
+
+
+@pytest.fixture(params=[
+    (storage.BACKEND_TINYDB, False),
+    (storage.BACKEND_SQLITE, False),
+    (storage.BACKEND_SQLITE, True),
+    (storage.BACKEND_JOURNAL, False),
+], ids=['tinydb', 'sqlite', 'sqlite-shared', 'journal'])
+def loaded_storage(request, tmp_path):
+    backend, shared = request.param
+    storage_ = storage.open_storage(backend, os.path.join(tmp_path, f'db.{backend}'), storage.FORMAT_JSON)
+    db.load(storage_, archive.Archive(os.path.join(tmp_path, 'archive')), shared=shared)
+    yield storage_
+    storage_.close()
+
+
+def test_parallel_clicks_count_one_vote_per_voter(loaded_storage):
+    uids = [f'U{i:05}' for i in range(VOTERS)]
+    # Every voter has to vote yes to pass (and so finish) an election, so it finishes on the last voter's vote
+    eids = [util.random_id() for _ in range(ELECTIONS)]
+    db.create_elections([models.Election(eid, 'UELECTEE', f'Position {i}', 100, uids, 'UCREATOR', False)
+                         for i, eid in enumerate(eids)])
+    clicks = [(eid, uid) for eid in eids for uid in uids for _ in range(CLICKS_PER_VOTER)]
+
+    with ThreadPoolExecutor(32) as pool:
+        results = list(pool.map(lambda click: (click, db.cast_vote(click[0], click[1], True)), clicks))
+
+    for eid in eids:
+        cast = [result for (click_eid, _), result in results if click_eid == eid and result.vote is not None]
+        assert sorted(result.vote.uid for result in cast) == uids
+        assert sum(result.result.is_finished for result in cast) == 1
+        # Repeat clicks are rejected, as already voted or, once the last vote is cast, as finished
+        assert all(isinstance(result, (models.AlreadyVotedCastVoteResult, models.ElectionFinishedCastVoteResult))
+                   for (click_eid, _), result in results if click_eid == eid and result.vote is None)
+        assert db.get_tally(eid).num_yes == VOTERS
+
+    # Exactly one vote per voter was written, not only indexed
+    stored = collections.Counter((vote['eid'], vote['uid']) for vote in loaded_storage.load_votes())
+    assert stored == collections.Counter({(eid, uid): 1 for eid in eids for uid in uids})
+
+
+def test_jobs_are_committed_with_the_vote_and_the_result(loaded_storage):
+    eid = util.random_id()
+    db.create_election(models.Election(eid, 'UELECTEE', 'Position', 100, ['U1'], 'UCREATOR', False))
+    confirmation = jobs.new_job('confirm', eid, {'eid': eid, 'uid': 'U1'})
+    rejected = jobs.new_job('confirm', eid, {'eid': eid, 'uid': 'U2'})
+
+    assert isinstance(db.cast_vote(eid, 'U2', True, [rejected]), models.NonAllowedVoterCastVoteResult)
+    assert db.cast_vote(eid, 'U1', True, [confirmation]).result.is_finished
+    announcement = db.close_election(eid, lambda result: [jobs.new_job('announce', eid, {'num_yes': result.num_yes})])
+    assert db.close_election(eid, lambda result: pytest.fail('finished twice')) is None
+
+    # Read back from the storage, as they would be after a crash right after these calls
+    stored = loaded_storage.load_records(db.JOBS_KIND)
+    assert sorted(job['kind'] for job in stored.values()) == ['announce', 'confirm']
+    assert stored[confirmation.jid]['payload'] == {'eid': eid, 'uid': 'U1'}
+    assert {job['payload'].get('num_yes') for job in stored.values()} == {None, announcement.num_yes}
+
+
+def test_confirmation_codes_are_valid_once_archived(loaded_storage, tmp_path, monkeypatch):
+    eid = util.random_id()
+    db.create_election(models.Election(eid, 'UELECTEE', 'Position', 100, ['U1', 'U2'], 'UCREATOR', False))
+    confirmation = db.cast_vote(eid, 'U1', True).vote.confirmation
+    # As issued before codes named their election
+    monkeypatch.setattr(util, 'confirmation_code', lambda _: util.random_id())
+    legacy = db.cast_vote(eid, 'U2', True).vote
+    monkeypatch.undo()
+    db.close_election(eid)
+
+    db.load(loaded_storage, archive.Archive(os.path.join(tmp_path, 'archive')), shared=db.is_shared())
+    # Only the legacy code is kept out of the archive, which the others are looked up in
+    assert db._confirmations == {legacy.confirmation: (eid, 'U2')}
+    for code in (confirmation, legacy.confirmation):
+        assert db.is_vote_valid(None, code)
+        assert db.is_vote_valid(eid, code)
+        assert not db.is_vote_valid('E0', code)
+    assert not db.is_vote_valid(None, f'{eid}-{util.random_id()}')
+    assert not db.is_vote_valid(eid, util.random_id())
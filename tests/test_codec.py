@@ -0,0 +1,32 @@
+import pytest
+
+import codec
+
+VALUES = [
+    None, True, -3, 2 ** 70, 2.5, '', 'é', [], {}, ['U1', 'é'], [{}, {}], [{'a': 1}],
+    # Records, by column, including columns that are neither all strings nor all bools
+    [{'uid': 'U1', 'is_yes': True}, {'uid': 'U2', 'is_yes': False}],
+    {'1': {'eid': 'E1', 'voters': ['U1'], 'deadline': None}, '2': {'eid': 'E2', 'voters': [], 'deadline': 1.5}},
+    # Not records, as their keys differ in order
+    [{'a': 1, 'b': 2}, {'b': 2, 'a': 1}],
+]
+
+
+@pytest.mark.parametrize('value', VALUES, ids=repr)
+def test_values_are_decoded_as_json_would(value):
+    decoded = codec.loads(codec.dumps(value))
+    assert decoded == value
+    # Including the order of the keys of every dict
+    assert repr(decoded) == repr(value)
+
+
+def test_values_encoded_before_records_were_stored_by_column_are_read():
+    encoded = (b'VBC\x01\x06\x05votes\x03uid\x02U1\x06is_yes\x02U2\x01n\x07\x02\x00\x06\x02\x07\x02\x01\x05\x02\x03'
+               b'\x02\x07\x02\x01\x05\x04\x03\x01\x05\x03\x05')
+    assert codec.is_encoded(encoded)
+    assert codec.loads(encoded) == {'votes': [{'uid': 'U1', 'is_yes': True}, {'uid': 'U2', 'is_yes': False}], 'n': -3}
+
+
+def test_non_string_keys_are_rejected():
+    with pytest.raises(TypeError):
+        codec.dumps({'1': {1: 'a'}, '2': {1: 'b'}})
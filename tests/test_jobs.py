@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import archive
+import db
+import jobs
+import models
+import storage
+
+OTHER_INSTANCE = 'other-instance'
+
+
+@pytest.fixture
+def shared_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'LEASE_RETRY_INTERVAL', 0.05)
+    storage_ = storage.open_storage(storage.BACKEND_SQLITE, os.path.join(tmp_path, 'db.sqlite3'))
+    db.load(storage_, archive.Archive(os.path.join(tmp_path, 'archive')), shared=True)
+    # The first of two jobs of an election, leased by another instance
+    db.put_job(models.Job('J1', 'confirm', 'E1', 1, {}, models.Job.PENDING, 0))
+    db.put_job(models.Job('J2', 'announce', 'E1', 2, {}, models.Job.PENDING, 0))
+    assert storage_.acquire_lease('jobs/J1', OTHER_INSTANCE, jobs.LEASE_DURATION)
+    yield storage_
+    storage_.close()
+
+
+def _start_queue(ran: list[str]) -> jobs.JobQueue:
+    queue = jobs.JobQueue()
+    queue.register('confirm', lambda job: ran.append(job.jid))
+    queue.register('announce', lambda job: ran.append(job.jid))
+    queue.start()
+    return queue
+
+
+def test_group_waits_on_job_run_by_another_instance(shared_storage):
+    ran = []
+    queue = _start_queue(ran)
+    # The job after the leased one is held up, rather than run out of order
+    assert not queue.join(timeout=0.3)
+    assert ran == []
+
+    # The other instance runs the job
+    shared_storage.delete_record(db.JOBS_KIND, 'J1')
+    shared_storage.release_lease('jobs/J1', OTHER_INSTANCE)
+    assert queue.join(timeout=5)
+    assert ran == ['J2']
+
+
+def test_group_takes_over_job_released_by_another_instance(shared_storage):
+    ran = []
+    queue = _start_queue(ran)
+    assert not queue.join(timeout=0.3)
+
+    # As if the other instance stopped without running it, and its lease expired
+    shared_storage.release_lease('jobs/J1', OTHER_INSTANCE)
+    assert queue.join(timeout=5)
+    assert ran == ['J1', 'J2']
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import storage
+
+
+def _election(eid: str) -> dict:
+    return {'eid': eid, 'electee_uid': 'UELECTEE', 'position': 'Position', 'threshold_pct': 50,
+            'allowed_voter_uids': ['U1'], 'creator_uid': 'UCREATOR', 'finished': False, 'deadline': None}
+
+
+def test_compaction_keeps_journal_left_by_failed_compaction(tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, 'db.journal')
+    journal = storage.JournalStorage(path, compact_interval=3600)
+    journal.insert_election(_election('A'))
+    journal.close()
+    # As left by a crash after the journal was moved aside but before the snapshot was written
+    os.replace(path, path + storage.JournalStorage.COMPACTING_SUFFIX)
+
+    journal = storage.JournalStorage(path, compact_interval=3600)
+    journal.insert_election(_election('B'))
+
+    replace = os.replace
+
+    def replace_but_snapshot(src, dst):
+        if dst.endswith(storage.JournalStorage.SNAPSHOT_SUFFIX):
+            raise OSError('No space left on device')
+        replace(src, dst)
+
+    # Fails before the snapshot is written, again
+    monkeypatch.setattr(os, 'replace', replace_but_snapshot)
+    with pytest.raises(OSError):
+        journal.compact()
+    journal.close()
+    monkeypatch.undo()
+
+    journal = storage.JournalStorage(path, compact_interval=3600)
+    assert sorted(e['eid'] for e in journal.load_elections()) == ['A', 'B']
+    journal.compact()
+    journal.close()
+    assert not os.path.exists(path + storage.JournalStorage.COMPACTING_SUFFIX)
+    journal = storage.JournalStorage(path, compact_interval=3600)
+    assert sorted(e['eid'] for e in journal.load_elections()) == ['A', 'B']
+    journal.close()
@@ -0,0 +1,60 @@
+import os
+import threading
+
+import pytest
+
+import archive
+import db
+import live
+import models
+import storage
+
+
+class _RecordingClient:
+    def __init__(self):
+        self.updated = threading.Event()
+
+    def chat_update(self, **kwargs):
+        self.updated.set()
+
+
+@pytest.fixture
+def election(tmp_path):
+    storage_ = storage.open_storage(storage.BACKEND_TINYDB, os.path.join(tmp_path, 'db.json'))
+    db.load(storage_, archive.Archive(os.path.join(tmp_path, 'archive')), shared=False)
+    election_ = models.Election('E1', 'UELECTEE', 'Position', 50, ['U1', 'U2'], 'UCREATOR', False)
+    db.create_election(election_)
+    db.set_election_message(election_.eid, 'CBENCH', '1.0')
+    yield election_
+    storage_.close()
+
+
+def test_finished_election_is_forgotten_after_its_last_update(election):
+    client = _RecordingClient()
+    updater = live.TallyUpdater(client, interval=0)
+    db.add_vote(election.eid, 'U1', True)
+    updater.notify(election.eid)
+    assert client.updated.wait(5)
+    assert '1.0' in updater._last_updated
+
+    # The deciding vote's update, which lands once the election is finished
+    client.updated.clear()
+    db.add_vote(election.eid, 'U2', True)
+    db.close_election(election.eid)
+    updater.notify(election.eid)
+    assert client.updated.wait(5)
+    assert updater._last_updated == {}
+
+
+def test_election_finished_at_deadline_is_forgotten(election):
+    client = _RecordingClient()
+    updater = live.TallyUpdater(client, interval=0)
+    db.add_vote(election.eid, 'U1', True)
+    updater.notify(election.eid)
+    assert client.updated.wait(5)
+
+    updater.forget(election.eid)
+    assert '1.0' in updater._last_updated
+    db.close_election(election.eid)
+    updater.forget(election.eid)
+    assert updater._last_updated == {}
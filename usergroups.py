@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from slack_sdk import WebClient
+
+import models
+
+if TYPE_CHECKING:
+    from slack_sdk.web.async_client import AsyncWebClient
+
+# Seconds for which the members of a usergroup are cached before being looked up again
+DEFAULT_TTL = 300
+
+
+class UserGroupCache:
+    """
+    Cache of the members of each usergroup, expiring after a TTL or when refreshed manually.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_workers: int = 4):
+        self.ttl = ttl
+        self._members: dict[str, tuple[float, list[str]]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='usergroups')
+
+    def members(self, client: WebClient, ugid: str) -> list[str]:
+        cached = self._cached(ugid)
+        if cached is not None:
+            return cached
+        members = client.usergroups_users_list(usergroup=ugid)['users']
+        with self._lock:
+            self._members[ugid] = (time.monotonic(), members)
+        return members
+
+    async def members_async(self, client: 'AsyncWebClient', ugid: str) -> list[str]:
+        cached = self._cached(ugid)
+        if cached is not None:
+            return cached
+        members = (await client.usergroups_users_list(usergroup=ugid))['users']
+        with self._lock:
+            self._members[ugid] = (time.monotonic(), members)
+        return members
+
+    def expand(self, client: WebClient, ugids: list[str]) -> dict[str, list[str]]:
+        """
+        Look up the members of several usergroups concurrently.
+
+        :param client: the client to look up uncached usergroups with
+        :param ugids: the usergroups to expand
+        :return: the members of every usergroup, by usergroup ID
+        """
+        return dict(zip(ugids, self._executor.map(lambda ugid: self.members(client, ugid), ugids)))
+
+    async def expand_async(self, client: 'AsyncWebClient', ugids: list[str]) -> dict[str, list[str]]:
+        return dict(zip(ugids, await asyncio.gather(*[self.members_async(client, ugid) for ugid in ugids])))
+
+    def _cached(self, ugid: str) -> list[str] | None:
+        with self._lock:
+            cached = self._members.get(ugid)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        return None
+
+    def refresh(self, ugid: str = None) -> None:
+        with self._lock:
+            if ugid is None:
+                self._members.clear()
+            else:
+                self._members.pop(ugid, None)
+
+
+usergroup_members = UserGroupCache()
+
+
+def usergroup_ids(voter_escstrs: list[str]) -> list[str]:
+    return [models.UserGroup.from_str(v).ugid for v in voter_escstrs if v.startswith('<!subteam^')]
+
+
+def merge_voters(voter_escstrs: list[str], members: dict[str, list[str]]) -> list[str]:
+    """
+    Resolve escaped users and usergroups into allowed voters, deduplicated in the order they were passed.
+
+    :param voter_escstrs: the escaped users and usergroups passed to /vote-create
+    :param members: the members of every usergroup in voter_escstrs, by usergroup ID
+    :return: the UIDs of the allowed voters
+    """
+    allowed_voters = {}
+    for voter_escstr in voter_escstrs:
+        if voter_escstr.startswith('<!subteam^'):
+            allowed_voters.update(dict.fromkeys(members[models.UserGroup.from_str(voter_escstr).ugid]))
+        else:
+            allowed_voters[models.User.from_str(voter_escstr).uid] = None
+    return list(allowed_voters)
@@ -3,13 +3,86 @@ import re
 import string
 
 
+BUTTON_ACTION_ID_PATTERN = re.compile(r'^([a-zA-Z0-9]+)_(yes|no)$')
+DURATION_PATTERN = re.compile(r'^(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?$')
+
+
 def button_action_id(eid: str, is_yes: bool) -> str:
     return f'{eid}_{"yes" if is_yes else "no"}'
 
 
+def parse_button_action_id(action_id: str) -> tuple[str, bool]:
+    eid, vote = BUTTON_ACTION_ID_PATTERN.match(action_id).groups()
+    return eid, vote == 'yes'
+
+
+def fan_out_id(eid: str) -> str:
+    return f'{eid}_result'
+
+
 def random_id(length: int = 8) -> str:
     return ''.join(random.choices(string.digits + string.ascii_letters, k=length))
 
 
+def confirmation_code(eid: str) -> str:
+    return f'{eid}-{random_id()}'
+
+
+def confirmation_eid(confirmation: str) -> str | None:
+    """
+    :return: the election a confirmation code was issued in, or None if it was issued before codes named it
+    """
+    return confirmation.rpartition('-')[0] or None
+
+
 def clean_alphanumeric(text: str) -> str:
-    return re.sub(r'[^a-zA-Z0-9]+', '', text)
\ No newline at end of file
+    return re.sub(r'[^a-zA-Z0-9]+', '', text)
+
+
+def uid_from_body(body) -> str:
+    return body.get('user_id') if 'user_id' in body else body.get('user').get('id')
+
+
+def parse_duration(text: str) -> int | None:
+    """
+    :param text: a duration in days, hours and/or minutes, i.e. 7d, 48h, 90m or 1d12h
+    :return: the duration in seconds, or None if the text is not a positive duration
+    """
+    match = DURATION_PATTERN.match(text)
+    if match is None:
+        return None
+    days, hours, minutes = (int(g or 0) for g in match.groups())
+    seconds = ((days * 24 + hours) * 60 + minutes) * 60
+    return seconds or None
+
+
+def parse_args(command) -> list[str]:
+    text = command['text']
+    args = []
+    last_split_idx = 0
+    in_quotes = False
+    for i in range(len(text)):
+        if text[i] == '\"':
+            in_quotes = not in_quotes
+        if text[i] == ' ' and not in_quotes:
+            args.append(text[last_split_idx:i])
+            i += 1
+            last_split_idx = i
+    if last_split_idx != len(text) - 1:
+        args.append(text[last_split_idx:])
+    return [v.replace('\"', '') for v in args]
+
+
+def parse_slate_args(args: list[str]) -> tuple[list[tuple[str, str]], list[str]]:
+    """
+    Split the arguments of /vote-create-batch following the threshold into electee/position pairs and voters.
+    Pairs are taken for as long as the argument after an electee is not a mention, i.e. is a position.
+
+    :return: the escaped electee and the position of each pair, and the escaped allowed voters
+    """
+    pairs = []
+    i = 0
+    while i + 1 < len(args) and not args[i + 1].startswith('<'):
+        pairs.append((args[i], args[i + 1]))
+        i += 2
+    return pairs, args[i:]